@@ -1,61 +1,110 @@
 import logging
 from threading import Thread
 
-from src.constants import DEBUG, RAW_POSTS_TABLE_MODEL, STPO_MAP_MODEL, LOGGING_MODEL
-from src.database import get_connection_and_cursor, PGError
-from src.firehose import AtProtocolError
+from src.constants import (
+    ASYNC_RUNTIME,
+    FIREHOSE_CHECKPOINT_MODEL,
+    LOGGING_MODEL,
+    ONLINE_FAMILY_DETECTION,
+    POST_SPOOL_ENABLED,
+    PROCESS_POSTS_OVERLAP,
+    RAW_POSTS_TABLE_MODEL,
+    STPO_FAMILY_INDEX_MODEL,
+    STPO_MAP_MODEL,
+    STPO_PAIRS_MODEL,
+    STPO_SERVICE_ENABLED,
+    STPO_VOCABULARY_MODEL,
+)
+from src import db_connection
+from src.db_connection import get_connection_and_cursor
+from src.family_detector import OnlineFamilyDetector
 from src.logging import LogDBHandler, set_local_logger
-from src.process_loops import count_posts, package_message_handler, process_posts
+from src.post_spool import PostSpool
+from src.process_loops import package_message_handler, schedule_tasks
+from src.scheduler import Scheduler
+from src.stpo_service import start_stpo_service
 
 logger = set_local_logger(__name__)
 
 
 def main():
     logger.info("Starting up.")
+    # PostProcessor has no cancel_event, see PROCESS_POSTS_OVERLAP
+    if PROCESS_POSTS_OVERLAP not in ("skip", "queue"):
+        raise ValueError(f"Unsupported PROCESS_POSTS_OVERLAP: {PROCESS_POSTS_OVERLAP}")
 
+    db_log = None
     try:
+        # One connection checks the whole schema, then carries the database
+        # logger
+        logger.debug("Connecting to database to bootstrap tables.")
+        con, cur = get_connection_and_cursor()
+        changed_tables = cur.bootstrap_schema(
+            cur,
+            [
+                LOGGING_MODEL,
+                RAW_POSTS_TABLE_MODEL,
+                STPO_MAP_MODEL,
+                STPO_VOCABULARY_MODEL,
+                STPO_PAIRS_MODEL,
+                STPO_FAMILY_INDEX_MODEL,
+                FIREHOSE_CHECKPOINT_MODEL,
+            ],
+        )
+        logger.debug(f"Tables created or updated: {changed_tables}")
+
         logger.debug("Initializing database logger.")
-        db_log = LogDBHandler(LOGGING_MODEL["name"])
+        db_log = LogDBHandler(LOGGING_MODEL["name"], connection=(con, cur))
         db_log.setLevel(20)
         logging.getLogger("").addHandler(db_log)
 
-        logger.debug(
-            "Connecting to database to create raw and stpo_map tables (if exists)."
+        family_detector = None
+        if ONLINE_FAMILY_DETECTION:
+            family_detector = OnlineFamilyDetector()
+
+        post_spool = None
+        if POST_SPOOL_ENABLED:
+            post_spool = PostSpool()
+
+        if STPO_SERVICE_ENABLED:
+            logger.debug("Starting STPO query service.")
+            start_stpo_service(family_detector=family_detector)
+
+        if ASYNC_RUNTIME:
+            # Imported here: the async runtime loads atproto, which takes
+            # most of startup
+            from src.async_runtime import run_async_runtime
+
+            logger.debug("Starting async runtime.")
+            run_async_runtime(family_detector=family_detector, post_spool=post_spool)
+            return
+
+        logger.debug("Defining tasks.")
+        task1 = Thread(
+            target=package_message_handler, args=[family_detector, post_spool]
         )
-        con, cur = get_connection_and_cursor()
-        cur.create_table(cur, RAW_POSTS_TABLE_MODEL)
-        cur.create_table(cur, STPO_MAP_MODEL)
-        con.close()
-
-        logger.debug("Defining task threads.")
-        task1 = Thread(target=package_message_handler)
-        task2 = Thread(target=process_posts)
-        if DEBUG:
-            task3 = Thread(target=count_posts)
-
-        # Start threads
-        logger.debug("Starting task threads.")
+        scheduler = Scheduler()
+        scoring_pool = schedule_tasks(scheduler, family_detector, post_spool)
+
+        # Start tasks
+        logger.debug("Starting tasks.")
         task1.start()
-        task2.start()
-        if DEBUG:
-            task3.start()
+        scheduler.start()
 
         # end all tasks
         logger.debug("Starting .join() for all tasks.")
         task1.join()
-        task2.join()
-        if DEBUG:
-            task3.join()
+        scheduler.stop()
+        scheduler.join()
+        if scoring_pool is not None:
+            scoring_pool.close()
 
         logger.info("Tasks ended. Attempting to close gracefully.")
 
     except RuntimeError as e:
         logger.critical("RUNTIME ERROR:", e)
         raise
-    except AtProtocolError as e:
-        logger.critical("ATPROTOCOL ERROR:", e)
-        raise
-    except PGError as e:
+    except db_connection.PGError as e:
         logger.critical("POSTGRES ERROR:", e)
         raise
     except KeyboardInterrupt:
@@ -68,7 +117,8 @@ def main():
         raise
 
     finally:
-        db_log.close()
+        if db_log is not None:
+            db_log.close()
         logger.debug("ass")
 
 
@@ -0,0 +1,325 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import functools
+import multiprocessing
+import signal
+
+from atproto import models
+from atproto.firehose import AsyncFirehoseSubscribeReposClient
+
+from .constants import (
+    ASYNC_POST_BATCH_SIZE,
+    ASYNC_POST_FLUSH_INTERVAL,
+    ASYNC_POST_QUEUE_SIZE,
+    ASYNC_RECONNECT_DELAY,
+    ASYNC_RECONNECT_MAX_DELAY,
+    ASYNC_SHUTDOWN_TIMEOUT,
+    ASYNC_STPO_WORKERS,
+    COUNT_POSTS_INTERVAL,
+    DEBUG,
+    FIREHOSE_CHECKPOINT,
+)
+from .database import get_connection_and_cursor, PGDataError, PGError
+from .firehose import (
+    AtProtocolError,
+    flush_post_batch,
+    flush_posts_singly,
+    get_commit_posts,
+    parse_commit,
+)
+from .firehose_checkpoint import FirehoseCheckpoint, parse_commit_time
+from .logging import set_local_logger
+from .process_loops import schedule_tasks
+from .scheduler import Scheduler
+
+logger = set_local_logger(__name__)
+
+
+def seconds_until_next_tick(interval: timedelta, now=None) -> float:
+    """Seconds until the next multiple of <interval> since the epoch (UTC)."""
+    now = now or datetime.now(timezone.utc)
+    interval_seconds = interval.total_seconds()
+    elapsed = now.timestamp() % interval_seconds
+    return interval_seconds - elapsed
+
+
+class AsyncRuntime:
+    """
+    Ingest in one event loop instead of a firehose thread:
+        ingest_posts: async firehose client -> post_queue
+        write_posts: post_queue -> batched COPY into the raw posts table
+            (or, with a post_spool, the spool when the COPY fails)
+        count_posts (DEBUG only): queue stats every COUNT_POSTS_INTERVAL
+
+    The periodic tasks (see schedule_tasks) run on a Scheduler, as in the
+    threaded runtime, with stateless STPO builds in a process pool of
+    <stpo_workers>.
+
+    With a checkpoint (see firehose_checkpoint.py), ingest subscribes from
+    the last saved seq and each batch is written in one transaction with the
+    seq it covers, as in FirehoseClient. Without a post spool, a failed
+    batch resubscribes from the checkpoint rather than losing posts.
+
+    Blocking database calls run on a single-thread executor that owns the
+    runtime's connection, which is reopened on the next use after a
+    Postgres error. Errors in one iteration of a task are logged and the
+    task carries on. SIGINT/SIGTERM stop ingest, flush the queue (up to
+    ASYNC_SHUTDOWN_TIMEOUT seconds), cancel the remaining tasks and stop
+    the scheduler.
+    """
+
+    def __init__(
+        self,
+        batch_size=ASYNC_POST_BATCH_SIZE,
+        flush_interval=ASYNC_POST_FLUSH_INTERVAL,
+        queue_size=ASYNC_POST_QUEUE_SIZE,
+        stpo_workers=ASYNC_STPO_WORKERS,
+        family_detector=None,
+        post_spool=None,
+        checkpoint=None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.stpo_workers = stpo_workers
+        self.family_detector = family_detector
+        self.post_spool = post_spool
+        self.checkpoint = checkpoint
+
+        self.firehose_client = None
+        self.last_flush = None
+        self.posts_written = 0
+        self.posts_dropped = 0
+        self.posts_rejected = 0
+
+    async def run_db(self, function, *args, **kwargs):
+        """Run a blocking database call on the database thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.db_executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def get_cursor(self):
+        """The runtime's cursor, reconnecting if the last one was dropped."""
+        if self.cur is None:
+            self.con, self.cur = await self.run_db(get_connection_and_cursor)
+        return self.cur
+
+    async def drop_connection(self):
+        """Close the connection after a Postgres error; get_cursor reopens."""
+        con, self.con, self.cur = self.con, None, None
+        if con is not None:
+            try:
+                await self.run_db(con.close)
+            except PGError:
+                pass
+
+    async def get_resume_params(self):
+        """Subscription params resuming from the checkpoint, or None for live."""
+        if self.checkpoint is None:
+            return None
+        try:
+            await self.run_db(self.checkpoint.load, await self.get_cursor())
+        except (PGError, RuntimeError) as e:
+            # RuntimeError: no connection could be opened
+            if isinstance(e, PGError):
+                await self.drop_connection()
+            logger.warning(f"Could not load firehose checkpoint: {e}")
+        cursor = self.checkpoint.resume_cursor()
+        if cursor is None:
+            return None
+        return models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor)
+
+    async def ingest_posts(self):
+        logger.info("Starting async message handler")
+        reconnect_delay = ASYNC_RECONNECT_DELAY
+        received = False
+
+        async def on_message_handler(message):
+            nonlocal received
+            received = True
+            commit = parse_commit(message)
+            if commit is None:
+                return
+            if self.checkpoint is not None and not self.checkpoint.observe(commit.seq):
+                return
+            for post in get_commit_posts(commit):
+                try:
+                    self.post_queue.put_nowait((commit.seq, commit.time, post))
+                except asyncio.QueueFull:
+                    self.posts_dropped += 1
+                    continue
+                if self.family_detector:
+                    self.family_detector.add_post(post["text"])
+
+        while not self.stopping.is_set():
+            params = await self.get_resume_params()
+            client = AsyncFirehoseSubscribeReposClient(params)
+            self.firehose_client = client
+            received = False
+            try:
+                await client.start(on_message_handler)
+            except AtProtocolError as e:
+                logger.error(f"Message Handler error: {e}")
+            except Exception as e:
+                logger.exception(f"Unexpected message handler error: {e}")
+            if received:
+                reconnect_delay = ASYNC_RECONNECT_DELAY
+            logger.error(f"Restarting in {reconnect_delay} seconds.")
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(2 * reconnect_delay, ASYNC_RECONNECT_MAX_DELAY)
+
+    async def throttle_catchup(self, post_count, commit_time):
+        """Hold a batch back so catch-up stays under the checkpoint's rate."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        seconds_since_flush = now - (self.last_flush or now)
+        delay = self.checkpoint.flush_delay(
+            post_count, parse_commit_time(commit_time), seconds_since_flush
+        )
+        if delay:
+            await asyncio.sleep(delay)
+        self.last_flush = loop.time()
+
+    async def resubscribe(self):
+        """Stop the firehose client; ingest_posts resumes from the checkpoint."""
+        client = self.firehose_client
+        if client is not None:
+            await client.stop()
+
+    async def write_posts(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.post_queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.post_queue.get(), timeout))
+                except TimeoutError:
+                    break
+
+            posts = [post for _, _, post in batch]
+            seq, commit_time, _ = batch[-1]
+            try:
+                if self.checkpoint is not None:
+                    await self.throttle_catchup(len(posts), commit_time)
+                cur = await self.get_cursor()
+                try:
+                    await self.run_db(
+                        flush_post_batch, cur, posts, self.checkpoint, seq
+                    )
+                except PGDataError as e:
+                    logger.warning(f"Post batch rejected, writing posts singly: {e}")
+                    self.posts_rejected += await self.run_db(
+                        flush_posts_singly, cur, posts, self.checkpoint, seq
+                    )
+                self.posts_written += len(posts)
+                if self.checkpoint is not None:
+                    self.checkpoint.mark_saved(seq)
+            except (PGError, RuntimeError) as e:
+                # RuntimeError: no connection could be opened
+                if isinstance(e, PGError):
+                    await self.drop_connection()
+                if self.post_spool is not None:
+                    logger.warning(f"Spooling posts, database unavailable: {e}")
+                    self.post_spool.append(posts)
+                    if self.checkpoint is not None:
+                        self.checkpoint.mark_saved(seq)
+                elif self.checkpoint is not None:
+                    logger.error(f"Post flush failed, resubscribing at seq: {e}")
+                    await self.resubscribe()
+                else:
+                    logger.error(f"Postgres Error writing posts: {e}")
+            except Exception as e:
+                logger.exception(f"Error writing posts: {e}")
+            finally:
+                for _ in batch:
+                    self.post_queue.task_done()
+
+    async def count_posts(self):
+        """Ingest stats only this process sees; PostCounter logs the rest."""
+        while True:
+            await asyncio.sleep(seconds_until_next_tick(COUNT_POSTS_INTERVAL))
+            logger.debug(f"Posts written: {self.posts_written}")
+            logger.debug(f"Queued posts: {self.post_queue.qsize()}")
+            if self.posts_dropped:
+                logger.warning(f"Posts dropped (queue full): {self.posts_dropped}")
+
+    async def _drain(self):
+        try:
+            await asyncio.wait_for(self.post_queue.join(), ASYNC_SHUTDOWN_TIMEOUT)
+        except TimeoutError:
+            logger.warning(
+                f"Shutdown timed out with {self.post_queue.qsize()} posts unsaved"
+            )
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signal_number, self.stopping.set)
+
+        self.post_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.db_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="database"
+        )
+        self.stpo_executor = ProcessPoolExecutor(
+            max_workers=self.stpo_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.con, self.cur = await self.run_db(get_connection_and_cursor)
+        # Built off the loop: PostProcessor warms the family detector
+        self.scheduler = Scheduler()
+        scoring_pool = await loop.run_in_executor(
+            None,
+            functools.partial(
+                schedule_tasks,
+                self.scheduler,
+                self.family_detector,
+                self.post_spool,
+                build_executor=self.stpo_executor,
+            ),
+        )
+        self.scheduler.start()
+
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                ingest = tasks.create_task(self.ingest_posts())
+                writer = tasks.create_task(self.write_posts())
+                background = []
+                if DEBUG:
+                    background.append(tasks.create_task(self.count_posts()))
+
+                await self.stopping.wait()
+                logger.info("Stopping. Flushing queued posts.")
+                ingest.cancel()
+                for task in background:
+                    task.cancel()
+                await self._drain()
+                writer.cancel()
+        finally:
+            for signal_number in [signal.SIGINT, signal.SIGTERM]:
+                loop.remove_signal_handler(signal_number)
+            self.scheduler.stop()
+            self.stpo_executor.shutdown(wait=False, cancel_futures=True)
+            await loop.run_in_executor(None, self.scheduler.join)
+            if scoring_pool is not None:
+                scoring_pool.close()
+            await self.drop_connection()
+            self.db_executor.shutdown()
+            logger.info("Async runtime stopped.")
+
+
+def run_async_runtime(family_detector=None, post_spool=None):
+    checkpoint = FirehoseCheckpoint() if FIREHOSE_CHECKPOINT else None
+    asyncio.run(
+        AsyncRuntime(
+            family_detector=family_detector,
+            post_spool=post_spool,
+            checkpoint=checkpoint,
+        ).run()
+    )
@@ -0,0 +1,60 @@
+from .constants import FIREHOSE_FILTER_COMMIT_OPS
+
+POST_COLLECTION = "app.bsky.feed.post"
+
+
+def has_post_creates(commit) -> bool:
+    """Whether any of a commit's ops creates a post record."""
+    return any(
+        op.action == "create" and op.path.startswith(POST_COLLECTION + "/")
+        for op in commit.ops
+    )
+
+
+class CommitFilterStats:
+    """
+    Counts of firehose commits rejected from their ops alone, without
+    decoding their CAR blocks, and an estimate of the CPU time that saved
+    (rejected commits times the mean decode time of accepted ones).
+    """
+
+    def __init__(self):
+        self.commits = 0
+        self.rejected_commits = 0
+        self.decoded_commits = 0
+        self.decode_seconds = 0.0
+
+    def record_rejected(self):
+        self.commits += 1
+        self.rejected_commits += 1
+
+    def record_decoded(self, decode_seconds):
+        self.commits += 1
+        self.decoded_commits += 1
+        self.decode_seconds += decode_seconds
+
+    @property
+    def saved_seconds(self) -> float:
+        if not self.decoded_commits:
+            return 0.0
+        return self.rejected_commits * self.decode_seconds / self.decoded_commits
+
+    def stats(self) -> dict:
+        return {
+            "commits": self.commits,
+            "rejected_commits": self.rejected_commits,
+            "decoded_commits": self.decoded_commits,
+            "decode_seconds": self.decode_seconds,
+            "saved_seconds": self.saved_seconds,
+        }
+
+
+commit_filter_stats = CommitFilterStats()
+
+
+def should_decode(commit, filter_ops=FIREHOSE_FILTER_COMMIT_OPS) -> bool:
+    """False for commits with no post creates, counted as rejected."""
+    if filter_ops and not has_post_creates(commit):
+        commit_filter_stats.record_rejected()
+        return False
+    return True
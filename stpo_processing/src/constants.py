@@ -1,7 +1,183 @@
+from datetime import timedelta
+
 DEBUG = True
 
+# Run firehose ingest in an asyncio event loop (see async_runtime.py) instead
+# of a thread. Periodic tasks still run on the Scheduler, with stateless STPO
+# builds in ASYNC_STPO_WORKERS processes.
+ASYNC_RUNTIME = False
+ASYNC_POST_BATCH_SIZE = 500
+ASYNC_POST_FLUSH_INTERVAL = 1.0  # seconds before a partial batch is written
+ASYNC_POST_QUEUE_SIZE = 50000
+ASYNC_SHUTDOWN_TIMEOUT = 30  # seconds to flush queued posts on shutdown
+ASYNC_STPO_WORKERS = 1
+# Firehose reconnects back off from ASYNC_RECONNECT_DELAY, doubling up to
+# ASYNC_RECONNECT_MAX_DELAY seconds until a client receives messages again
+ASYNC_RECONNECT_DELAY = 1
+ASYNC_RECONNECT_MAX_DELAY = 300
+
 SQL_INDENT = 4
 
+# STPOCursor caches the SQL of insert_into_table and select_from_table by
+# statement shape, and PREPAREs a statement on a connection once it has run
+# STATEMENT_PREPARE_THRESHOLD times there (None never prepares)
+STATEMENT_CACHE_MAX_STATEMENTS = 256
+STATEMENT_PREPARE_THRESHOLD = 5
+
+# How process_posts stores each STPO snapshot in stpo_map:
+#   "json": nested map as jsonb in stpo_snapshot
+#   "binary": compact snapshot (see stpo_snapshot.py) in stpo_snapshot_binary
+#   "sidecar": compact snapshot written to SNAPSHOT_SIDECAR_DIR, path stored
+#       in stpo_snapshot_path
+#   "relational": one row per pair in stpo_pairs (see STPO_PAIRS_MODEL)
+SNAPSHOT_FORMAT = "json"
+SNAPSHOT_SIDECAR_DIR = "stpo_snapshots"
+# Write a full snapshot every N cycles and only changed pairs ("delta") in
+# between. 1 writes every snapshot in full.
+SNAPSHOT_KEYFRAME_INTERVAL = 1
+
+# Periodic tasks (see scheduler.py). Post processing runs at every multiple of
+# its interval; a run due while the last one is still building is handled
+# per PROCESS_POSTS_OVERLAP ("skip" or "queue"). PostProcessor can't be
+# cancelled mid-build, so the scheduler's "cancel" policy doesn't apply to it.
+PROCESS_POSTS_INTERVAL = timedelta(minutes=10)
+PROCESS_POSTS_OVERLAP = "skip"
+# Posts each cycle's main snapshot covers. Scorers use the newest snapshot of
+# this interval, not bucketed mode's other windows.
+ANALYSIS_INTERVAL = timedelta(days=1)
+COUNT_POSTS_INTERVAL = timedelta(minutes=1)
+
+# Detect post families at ingest (see family_detector.py) so process_posts
+# doesn't rebuild them from the database every cycle
+ONLINE_FAMILY_DETECTION = False
+FAMILY_DETECTOR_MAX_POSTS = 500000
+# Single-post families kept for later posts to join; the least recently
+# added are dropped first, as build_post_families trims them
+FAMILY_DETECTOR_MAX_SINGLETONS = 20000
+
+# "exact" builds the full STPO map each cycle. "approximate" keeps fixed-memory
+# sliding-window count-min sketches (see stpo_sketch.py) fed with each cycle's
+# new posts, and snapshots their heavy hitters. "bucketed" keeps a partial map
+# per STPO_BUCKET_DURATION of posts (see stpo_buckets.py) and snapshots every
+# window in STPO_WINDOWS by merging buckets.
+STPO_MODE = "exact"
+STPO_WINDOWS = [timedelta(hours=1), timedelta(hours=6), timedelta(days=1)]
+STPO_BUCKET_DURATION = timedelta(hours=1)
+SKETCH_WINDOW = timedelta(days=1)
+SKETCH_BUCKET_DURATION = timedelta(hours=1)
+SKETCH_EPSILON = 2e-5  # overcount bound, as a fraction of all counted pairs
+SKETCH_DELTA = 0.02  # probability an estimate exceeds that bound
+SKETCH_HEAVY_HITTERS = 20000  # pairs tracked per bucket
+
+# Store normalized tokens alongside raw_post_text at ingest, so processing
+# doesn't re-run format_post on every post every cycle
+NORMALIZE_AT_INGEST = False
+
+# Collapse exact and normalized-exact duplicate posts into one weighted post
+# before family building and pair counting (see deduplicate_posts)
+DEDUPLICATE_POSTS = True
+
+# Spool posts the database can't take (an outage or ingest burst) to segment
+# files in POST_SPOOL_DIR (see post_spool.py), and bulk-load them back every
+# POST_SPOOL_DRAIN_INTERVAL. Posts past POST_SPOOL_MAX_BYTES on disk are
+# dropped. A segment failing to load POST_SPOOL_MAX_ATTEMPTS times for reasons
+# other than the connection is moved aside to a dead letter file.
+POST_SPOOL_ENABLED = False
+POST_SPOOL_DIR = "post_spool"
+POST_SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+POST_SPOOL_MAX_BYTES = 2 * 1024 * 1024 * 1024
+POST_SPOOL_MAX_ATTEMPTS = 3
+POST_SPOOL_DRAIN_INTERVAL = timedelta(seconds=5)
+
+# FirehoseClient writes posts in batches of up to FIREHOSE_FLUSH_POSTS, or
+# every FIREHOSE_FLUSH_INTERVAL seconds, each in one transaction with the
+# last firehose seq it covers (see firehose_checkpoint.py). Restarts resume
+# from that seq, unless it's older than FIREHOSE_RESUME_MAX_AGE (None always
+# resumes). While commits lag the clock by more than FIREHOSE_CATCHUP_LAG,
+# flushes are paced to FIREHOSE_CATCHUP_MAX_POSTS_PER_SECOND (None unpaced).
+# FIREHOSE_SKIP_REPLAYED drops commits at or before the last seq seen.
+FIREHOSE_CHECKPOINT = True
+FIREHOSE_CHECKPOINT_NAME = "subscribe_repos"
+FIREHOSE_FLUSH_POSTS = 100
+FIREHOSE_FLUSH_INTERVAL = 1.0
+FIREHOSE_RESUME_MAX_AGE = timedelta(hours=6)
+FIREHOSE_CATCHUP_LAG = timedelta(seconds=30)
+FIREHOSE_CATCHUP_MAX_POSTS_PER_SECOND = 2000
+FIREHOSE_SKIP_REPLAYED = True
+FIREHOSE_RESTART_DELAY = 5  # seconds between client restarts without a database
+
+# Skip commits with no post creates from their ops, before decoding their
+# blocks (see commit_filter.py)
+FIREHOSE_FILTER_COMMIT_OPS = True
+
+# Ingest filters on post record fields (see ingest_filters.py). Posts failing
+# them are never stored. INGEST_LANGS None keeps every language; otherwise a
+# post needs one of these tags (or their primary language, "en" of "en-US"),
+# and untagged posts are kept only with INGEST_UNTAGGED_LANGS.
+INGEST_LANGS = None
+INGEST_UNTAGGED_LANGS = True
+INGEST_REPLIES = True
+INGEST_EMBEDS = True
+INGEST_MIN_TEXT_LENGTH = 3
+INGEST_MAX_TEXT_LENGTH = None
+
+# Build STPO maps from one segment of the stored posts: raw posts table
+# column values every post must match, e.g. {"lang": "en", "is_reply": False}.
+# Empty uses every post.
+STPO_SEGMENT = {}
+
+# Score new posts against the newest STPO snapshot in a process pool (see
+# scoring_pool.py), SCORING_BATCH_SIZE posts per database round trip and up
+# to SCORING_MAX_BATCHES per run. Workers share the model through shared
+# memory. SCORING_WORKERS None uses every core.
+SCORING_ENABLED = False
+SCORING_WORKERS = None
+SCORING_CHUNK_SIZE = 250  # posts per worker task
+SCORING_BATCH_SIZE = 5000
+SCORING_MAX_BATCHES = 20
+SCORING_INTERVAL = timedelta(seconds=10)
+
+# Stream finalized post family chunks through a PostFamilyStore (see
+# family_spill.py) to pair counting, spilling them to a temp file past
+# POST_FAMILY_MAX_BYTES (estimated) instead of holding every chunk in RAM
+SPILL_POST_FAMILIES = False
+POST_FAMILY_MAX_BYTES = 256 * 1024 * 1024
+
+# Keep known post families across cycles and restarts (see family_index.py),
+# forgetting families not seen for FAMILY_INDEX_TTL
+PERSIST_FAMILY_INDEX = False
+FAMILY_INDEX_TTL = timedelta(days=7)
+
+# Local HTTP query service over the in-memory scoring model (see
+# stpo_service.py). Fresh maps built from the family detector are reused for
+# STPO_SERVICE_FRESH_TTL seconds.
+STPO_SERVICE_ENABLED = False
+STPO_SERVICE_HOST = "127.0.0.1"
+STPO_SERVICE_PORT = 8710
+STPO_SERVICE_FRESH_TTL = 30
+
+# Long-tail pruning of STPO maps before they're saved (see stpo_pruning.py).
+# None disables top-K or the byte budget; a min count of 1 keeps every pair.
+STPO_PRUNE_MIN_COUNT = 1
+STPO_PRUNE_TOP_K = None  # successors kept per (separation, first_word)
+STPO_PRUNE_MAX_BYTES = None  # estimated scoring model size
+# Successor holding a row's pruned occurrences. format_post strips "<" and
+# ">", so no post word can match it and it never adds to a score. It is a
+# reserved word: stored like any successor (relational snapshots keep it in
+# the vocabulary), but the snapshot, model and pair query helpers leave it
+# out of the successors they return.
+PRUNED_MASS_KEY = "<pruned>"
+# Rough in-memory cost of one pair in a cfdist map (dict slot, key, int)
+BYTES_PER_PAIR = 160
+
+# Word id and row lookups cached per STPO model (see stpo_model.py)
+STPO_MODEL_LOOKUP_CACHE_SIZE = 1 << 16
+
+# In-process cache of scoring models (see model_cache.py)
+MODEL_CACHE_MAX_MODELS = 2
+MODEL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+MODEL_CACHE_CHECK_INTERVAL = 30  # seconds between checks for a newer snapshot
+
 RAW_POSTS_TABLE_MODEL = {
     "name": "raw_post_data_test",
     "temp": False,
@@ -20,6 +196,26 @@ RAW_POSTS_TABLE_MODEL = {
             "default": "(now() at time zone 'utc')",
             "is_null": False,
         },
+        # normalize_post output, when NORMALIZE_AT_INGEST is on
+        {"name": "post_tokens", "data_type": "text[]", "is_null": True},
+        {"name": "normalizer_version", "data_type": "integer", "is_null": True},
+        # Post record fields (see ingest_filters.py); lang is the primary
+        # language of the first tag. NULL for rows stored before them.
+        {"name": "lang", "data_type": "text", "is_null": True},
+        {"name": "langs", "data_type": "text[]", "is_null": True},
+        {"name": "is_reply", "data_type": "boolean", "is_null": True},
+        {"name": "has_embed", "data_type": "boolean", "is_null": True},
+        # get_post_score against the stpo_map snapshot it was scored with,
+        # when SCORING_ENABLED is on
+        {"name": "stpo_score", "data_type": "double precision", "is_null": True},
+        {"name": "score_snapshot_id", "data_type": "integer", "is_null": True},
+    ],
+    "indexes": [
+        {
+            # Per-language STPO_SEGMENT selections over a time range
+            "name": "raw_post_lang_created_at_idx",
+            "columns": ["lang", "created_at"],
+        },
     ],
 }
 
@@ -43,9 +239,107 @@ STPO_MAP_MODEL = {
         {
             "name": "stpo_snapshot",
             "data_type": "jsonb",
-            "is_null": False,
+            "is_null": True,
         },
         {"name": "snapshot_interval", "data_type": "interval", "is_null": False},
+        # NULL for rows written before snapshot formats existed (jsonb)
+        {"name": "snapshot_format", "data_type": "text", "is_null": True},
+        {"name": "stpo_snapshot_binary", "data_type": "bytea", "is_null": True},
+        {"name": "stpo_snapshot_path", "data_type": "text", "is_null": True},
+        # Delta snapshots only: the full snapshot the delta chain starts from
+        {"name": "keyframe_id", "data_type": "integer", "is_null": True},
+    ],
+}
+
+STPO_VOCABULARY_MODEL = {
+    "name": "stpo_vocabulary",
+    "temp": False,
+    "is_if_not_exists": True,
+    "columns": [
+        {
+            "name": "id",
+            "data_type": "serial",
+            "is_null": False,
+            "constraint": "primary key",
+        },
+        {"name": "word", "data_type": "text", "is_null": False, "constraint": "unique"},
+    ],
+}
+
+STPO_PAIRS_MODEL = {
+    "name": "stpo_pairs",
+    "temp": False,
+    "is_if_not_exists": True,
+    "columns": [
+        {"name": "snapshot_id", "data_type": "integer", "is_null": False},
+        {"name": "separation", "data_type": "smallint", "is_null": False},
+        {"name": "first_word_id", "data_type": "integer", "is_null": False},
+        {"name": "second_word_id", "data_type": "integer", "is_null": False},
+        {"name": "count", "data_type": "integer", "is_null": False},
+    ],
+    "indexes": [
+        {
+            # Whole-snapshot reads and top successors within a snapshot
+            "name": "stpo_pairs_snapshot_idx",
+            "columns": [
+                "snapshot_id",
+                "separation",
+                "first_word_id",
+                "second_word_id",
+            ],
+            "unique": True,
+        },
+        {
+            # Pair history across snapshots
+            "name": "stpo_pairs_pair_idx",
+            "columns": [
+                "separation",
+                "first_word_id",
+                "second_word_id",
+                "snapshot_id",
+            ],
+        },
+    ],
+}
+
+STPO_FAMILY_INDEX_MODEL = {
+    "name": "stpo_family_index",
+    "temp": False,
+    "is_if_not_exists": True,
+    "columns": [
+        {
+            "name": "family_name",
+            "data_type": "text",
+            "is_null": False,
+            "constraint": "primary key",
+        },
+        {"name": "unique_words", "data_type": "text[]", "is_null": False},
+        {"name": "member_count", "data_type": "bigint", "is_null": False},
+        {
+            "name": "last_seen",
+            "data_type": "timestamp with time zone",
+            "is_null": False,
+        },
+    ],
+}
+
+FIREHOSE_CHECKPOINT_MODEL = {
+    "name": "firehose_checkpoint",
+    "temp": False,
+    "is_if_not_exists": True,
+    "columns": [
+        {
+            "name": "checkpoint_name",
+            "data_type": "text",
+            "is_null": False,
+            "constraint": "primary key",
+        },
+        {"name": "seq", "data_type": "bigint", "is_null": False},
+        {
+            "name": "updated_at",
+            "data_type": "timestamp with time zone",
+            "is_null": False,
+        },
     ],
 }
 
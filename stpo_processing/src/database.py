@@ -1,12 +1,30 @@
+from collections import OrderedDict
+import io
 import logging
 import os
+from threading import Lock
+import weakref
 
-from dotenv import load_dotenv
 import psycopg2
 import psycopg2.extensions
+import psycopg2.extras
 from psycopg2 import sql
-
-from .constants import DEBUG, SQL_INDENT
+from psycopg2 import DataError as PGDataError  # noqa: F401 (re-exported)
+from psycopg2 import Error as PGError  # noqa: F401 (re-exported)
+
+from .constants import (
+    DEBUG,
+    FIREHOSE_CHECKPOINT_MODEL,
+    PRUNED_MASS_KEY,
+    RAW_POSTS_TABLE_MODEL,
+    SQL_INDENT,
+    STATEMENT_CACHE_MAX_STATEMENTS,
+    STATEMENT_PREPARE_THRESHOLD,
+    STPO_FAMILY_INDEX_MODEL,
+    STPO_MAP_MODEL,
+    STPO_PAIRS_MODEL,
+    STPO_VOCABULARY_MODEL,
+)
 
 logger = logging.getLogger(__name__)
 if DEBUG:
@@ -14,11 +32,22 @@ if DEBUG:
 else:
     logger.setLevel(logging.INFO)
 
-# Load environment variables from .env
-load_dotenv()
+# Errors from a lost or unusable connection rather than from the statement
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+_dotenv_loaded = False
 
 
 def get_database_credentials() -> dict:
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        # Load environment variables from .env on first use rather than at
+        # import, so importing the package stays cheap
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
+
     try:
         database_credentials = {
             "user": os.getenv("STPODB_USER"),
@@ -48,6 +77,117 @@ def get_connection_and_cursor():
     return connection, cursor
 
 
+class StatementCache:
+    """
+    SQL text of composed statements, keyed by statement shape (table, column
+    set, where shape), so repeated inserts and selects skip building and
+    quoting their psycopg2.sql objects. Bounded LRU.
+
+    Statements run <prepare_threshold> times on a connection are PREPAREd
+    there and then run with EXECUTE, so Postgres plans them once per
+    connection. Evicting a statement queues a DEALLOCATE on each connection
+    that prepared it, run by that connection's next execute_cached, so the
+    server side stays as bounded as the cache.
+
+    statements = {
+        <statement_key>: {
+            "sql": "<query text with %s placeholders>",
+            "name": "<prepared statement name>",
+            "uses": {<connection>: <executions>, ...}
+        },
+        ...
+    }
+    """
+
+    def __init__(
+        self,
+        max_statements=STATEMENT_CACHE_MAX_STATEMENTS,
+        prepare_threshold=STATEMENT_PREPARE_THRESHOLD,
+    ):
+        self.max_statements = max_statements
+        self.prepare_threshold = prepare_threshold
+
+        self.statements = OrderedDict()
+        # Prepared statement names per connection, gone with the connection
+        self.prepared = weakref.WeakKeyDictionary()
+        # Names of evicted statements each connection still has to DEALLOCATE
+        self.evicted = weakref.WeakKeyDictionary()
+        self._statement_ids = 0
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.prepares = 0
+        self.evictions = 0
+
+    def get(self, context, statement_key, build_query) -> dict:
+        """The cached statement for <statement_key>, built on a miss."""
+        with self._lock:
+            statement = self.statements.get(statement_key)
+            if statement is not None:
+                self.hits += 1
+                self.statements.move_to_end(statement_key)
+                return statement
+
+            self.misses += 1
+            self._statement_ids += 1
+            statement = {
+                "sql": build_query().as_string(context),
+                "name": f"stpo_statement_{self._statement_ids}",
+                "uses": weakref.WeakKeyDictionary(),
+            }
+            self.statements[statement_key] = statement
+            while len(self.statements) > self.max_statements:
+                _, evicted = self.statements.popitem(last=False)
+                self._evict(evicted)
+            return statement
+
+    def _evict(self, statement):
+        for connection, names in self.prepared.items():
+            if statement["name"] in names:
+                names.discard(statement["name"])
+                self.evicted.setdefault(connection, set()).add(statement["name"])
+        self.evictions += 1
+
+    def pop_evicted(self, connection) -> set:
+        """Names of evicted statements still prepared on <connection>."""
+        with self._lock:
+            return self.evicted.pop(connection, set())
+
+    def should_prepare(self, connection, statement) -> bool:
+        """Count a use on <connection>; True once it should be prepared."""
+        if self.prepare_threshold is None:
+            return False
+        with self._lock:
+            uses = statement["uses"].get(connection, 0) + 1
+            statement["uses"][connection] = uses
+            return uses >= self.prepare_threshold
+
+    def is_prepared(self, connection, statement) -> bool:
+        with self._lock:
+            return statement["name"] in self.prepared.get(connection, ())
+
+    def mark_prepared(self, connection, statement):
+        with self._lock:
+            self.prepared.setdefault(connection, set()).add(statement["name"])
+            self.prepares += 1
+
+
+def _prepared_sql(query_text: str):
+    """
+    PREPARE body and EXECUTE placeholders for a query with %s placeholders.
+    The PREPARE runs without arguments, so %% escapes become plain %.
+    """
+    query_parts = query_text.rstrip(";").split("%s")
+    prepared_text = query_parts[0].replace("%%", "%")
+    for idx, query_part in enumerate(query_parts[1:]):
+        prepared_text += f"${idx + 1}" + query_part.replace("%%", "%")
+    return prepared_text, len(query_parts) - 1
+
+
+statement_cache = StatementCache()
+
+
 class STPOCursor(psycopg2.extensions.cursor):
     def execute(self, sql, args=None):
         try:
@@ -77,6 +217,33 @@ class STPOCursor(psycopg2.extensions.cursor):
             print(f"{exc.__class__.__name__} {exc}")
             raise
 
+    def execute_cached(
+        self, context, statement_key, build_query, args=None, verbose=False
+    ):
+        """
+        Run a statement through the statement cache. <build_query> returns
+        the psycopg2.sql statement and is only called on a cache miss.
+        """
+        statement = statement_cache.get(context, statement_key, build_query)
+        if verbose:
+            print(statement["sql"])
+
+        connection = self.connection
+        for name in statement_cache.pop_evicted(connection):
+            self.execute(f"DEALLOCATE {name};")
+        if not statement_cache.should_prepare(connection, statement):
+            self.execute(statement["sql"], args)
+            return
+
+        prepared_text, arg_count = _prepared_sql(statement["sql"])
+        if not statement_cache.is_prepared(connection, statement):
+            self.execute(f"PREPARE {statement['name']} AS {prepared_text};")
+            statement_cache.mark_prepared(connection, statement)
+        execute_text = f"EXECUTE {statement['name']}"
+        if arg_count:
+            execute_text += " (" + ", ".join(["%s"] * arg_count) + ")"
+        self.execute(execute_text + ";", args)
+
     def _complete_attributes(
         self, attributes: dict, attributes_reference: list
     ) -> dict:
@@ -86,8 +253,35 @@ class STPOCursor(psycopg2.extensions.cursor):
 
         return attributes
 
-    def create_table(self, context, table_attributes: dict, verbose=False) -> None:
+    def _column_definition(self, context, col_attr: dict) -> str:
+        """For use with create_table and add_table_columns."""
+        column_attributes_reference = [
+            "name",
+            "data_type",
+            "default",
+            "is_null",
+            "constraint",
+        ]
+        col_attr = self._complete_attributes(col_attr, column_attributes_reference)
+
+        col_name = sql.Identifier(col_attr["name"].lower())
+        col_text = f" {col_attr['data_type'].upper()}"
+        if col_attr["default"]:
+            col_text += f" DEFAULT {col_attr['default'].upper()}"
+        if not col_attr["is_null"]:
+            col_text += " NOT NULL"
+        if col_attr["constraint"]:
+            col_text += f" {col_attr['constraint'].upper()}"
+        return col_name.as_string(context) + col_text
+
+    def create_table(
+        self, context, table_attributes: dict, with_indexes=True, verbose=False
+    ) -> None:
         """
+        Create a table from its model. with_indexes=False leaves the indexes
+        to add_table_columns, for tables that may predate their indexed
+        columns.
+
         Table attributes:
             {
                 "name": "<table_name>",
@@ -104,18 +298,20 @@ class STPOCursor(psycopg2.extensions.cursor):
                     },
                     {...},
                     ...
+                ],
+                "indexes" <optional>: [
+                    {
+                        "name": "<index_name>",
+                        "columns": ["<col_name>", ...],
+                        "unique": False
+                    },
+                    {...},
+                    ...
                 ]
             }
         """
 
         table_attributes_reference = ["name", "temp", "is_if_not_exists"]
-        column_attributes_reference = [
-            "name",
-            "data_type",
-            "default",
-            "is_null",
-            "constraint",
-        ]
 
         table_attributes = self._complete_attributes(
             table_attributes, table_attributes_reference
@@ -142,19 +338,7 @@ class STPOCursor(psycopg2.extensions.cursor):
         column_types = []
         for col_attr in table_attributes["columns"]:
             if col_attr:
-                col_attr = self._complete_attributes(
-                    col_attr, column_attributes_reference
-                )
-
-                col_name = sql.Identifier(col_attr["name"].lower())
-                col_text = f" {col_attr['data_type'].upper()}"
-                if col_attr["default"]:
-                    col_text += f" DEFAULT {col_attr['default'].upper()}"
-                if not col_attr["is_null"]:
-                    col_text += " NOT NULL"
-                if col_attr["constraint"]:
-                    col_text += f" {col_attr['constraint'].upper()}"
-                column_types.append(col_name.as_string(context) + col_text)
+                column_types.append(self._column_definition(context, col_attr))
 
         field_attributes = sql.SQL(", ".join(column_types))
 
@@ -167,6 +351,140 @@ class STPOCursor(psycopg2.extensions.cursor):
 
         self.execute(query)
 
+        if with_indexes and table_attributes.get("indexes"):
+            self.create_indexes(context, table_attributes, verbose=verbose)
+
+    def create_indexes(self, context, table_attributes: dict, verbose=False) -> None:
+        """Create the "indexes" of a create_table model, if they don't exist."""
+        for index_attr in table_attributes.get("indexes", []):
+            index_text = (
+                "CREATE UNIQUE INDEX" if index_attr.get("unique") else ("CREATE INDEX")
+            )
+            index_text += " IF NOT EXISTS {index_name} ON {table_name} ({columns});"
+            query = sql.SQL(index_text).format(
+                index_name=sql.Identifier(index_attr["name"]),
+                table_name=sql.Identifier(table_attributes["name"]),
+                columns=sql.SQL(", ").join(
+                    [sql.Identifier(col) for col in index_attr["columns"]]
+                ),
+            )
+
+            if verbose:
+                print(query.as_string(context))
+
+            self.execute(query)
+
+    def add_table_columns(self, context, table_attributes: dict, verbose=False) -> None:
+        """
+        Bring an existing table up to date with its model. Columns missing from
+        the table are added, columns the model marks as nullable have their
+        NOT NULL constraint dropped, and missing indexes are created. Uses the
+        same table attributes as create_table.
+        """
+        table_name = sql.Identifier(table_attributes["name"])
+        for col_attr in table_attributes["columns"]:
+            if not col_attr or col_attr.get("constraint"):
+                continue
+            query = sql.SQL("ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS ")
+            query = query.format(table_name=table_name)
+            query += sql.SQL(self._column_definition(context, dict(col_attr)))
+            if col_attr.get("is_null"):
+                query += sql.SQL(", ALTER COLUMN {col_name} DROP NOT NULL").format(
+                    col_name=sql.Identifier(col_attr["name"].lower())
+                )
+            query += sql.SQL(";")
+
+            if verbose:
+                print(query.as_string(context))
+
+            self.execute(query)
+
+        if table_attributes.get("indexes"):
+            self.create_indexes(context, table_attributes, verbose=verbose)
+
+    def select_schema(self, context, table_names: list, verbose=False) -> dict:
+        """
+        The existing columns and indexes of <table_names>, in the current
+        schema, from one catalog query. Missing tables are left out.
+
+        schema = {
+            "<table_name>": {
+                "columns": {"<column_name>": <is_nullable>, ...},
+                "indexes": {"<index_name>", ...}
+            },
+            ...
+        }
+        """
+        query = (
+            "SELECT table_name, column_name, is_nullable = 'YES'"
+            " FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND table_name = ANY(%s)"
+            " UNION ALL"
+            " SELECT tablename, indexname, NULL FROM pg_indexes"
+            " WHERE schemaname = current_schema() AND tablename = ANY(%s);"
+        )
+
+        if verbose:
+            print(query)
+
+        self.execute(query, [table_names, table_names])
+        schema = {}
+        for table_name, name, is_nullable in self.fetchall():
+            table = schema.setdefault(table_name, {"columns": {}, "indexes": set()})
+            if is_nullable is None:
+                table["indexes"].add(name)
+            else:
+                table["columns"][name] = is_nullable
+        return schema
+
+    def bootstrap_schema(self, context, table_models: list, verbose=False) -> list:
+        """
+        Bring every table in <table_models> up to date with its model, as
+        create_table and add_table_columns would, after checking the schema
+        with a single select_schema query. DDL only runs for missing tables,
+        missing columns and indexes, and NOT NULL constraints the model
+        drops. Returns the names of the tables created or altered.
+        """
+        schema = self.select_schema(
+            context, [model["name"] for model in table_models], verbose=verbose
+        )
+
+        changed_tables = []
+        for table_attributes in table_models:
+            table = schema.get(table_attributes["name"])
+            if table is None:
+                self.create_table(context, table_attributes, verbose=verbose)
+                changed_tables.append(table_attributes["name"])
+                continue
+
+            missing_columns = []
+            for col_attr in table_attributes["columns"]:
+                if not col_attr or col_attr.get("constraint"):
+                    continue
+                col_name = col_attr["name"].lower()
+                if col_name not in table["columns"] or (
+                    col_attr.get("is_null") and not table["columns"][col_name]
+                ):
+                    missing_columns.append(col_attr)
+            missing_indexes = [
+                index_attr
+                for index_attr in table_attributes.get("indexes", [])
+                if index_attr["name"] not in table["indexes"]
+            ]
+            if missing_columns or missing_indexes:
+                self.add_table_columns(
+                    context,
+                    {
+                        **table_attributes,
+                        "columns": missing_columns,
+                        "indexes": missing_indexes,
+                    },
+                    verbose=verbose,
+                )
+                changed_tables.append(table_attributes["name"])
+
+        return changed_tables
+
     def insert_into_table(self, context, table_row: dict, verbose=False) -> None:
         """
         table_row = {
@@ -181,26 +499,207 @@ class STPOCursor(psycopg2.extensions.cursor):
             ]
         }
         """
-        insert_statement = sql.SQL(
-            "INSERT INTO {table_name} ({col_names}) VALUES ({col_values});"
+        col_names = [col["name"] for col in table_row["column_data"]]
+        col_values = [col["value"] for col in table_row["column_data"]]
+
+        def build_query():
+            insert_statement = sql.SQL(
+                "INSERT INTO {table_name} ({col_names}) VALUES ({col_values});"
+            )
+            return insert_statement.format(
+                table_name=sql.Identifier(table_row["table_name"]),
+                col_names=sql.SQL(", ").join(
+                    [sql.Identifier(col_name) for col_name in col_names]
+                ),
+                col_values=sql.SQL(", ").join(sql.Placeholder() * len(col_names)),
+            )
+
+        statement_key = ("insert", table_row["table_name"], tuple(col_names))
+        self.execute_cached(
+            context, statement_key, build_query, col_values, verbose=verbose
         )
 
-        table_name = sql.Identifier(table_row["table_name"])
-        col_names = [sql.Identifier(col["name"]) for col in table_row["column_data"]]
-        col_values = [col["value"] for col in table_row["column_data"]]
+    def _copy_text_value(self, value) -> str:
+        """
+        For use with copy_into_table (COPY text format). Postgres text can't
+        hold NUL, so it's stripped.
+        """
+        if value is None:
+            return "\\N"
+        if isinstance(value, list):
+            # Array literal of quoted elements
+            value = [
+                '"' + str(element).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                for element in value
+            ]
+            value = "{" + ",".join(value) + "}"
+        value = str(value).replace("\x00", "")
+        for character, escaped in [
+            ("\\", "\\\\"),
+            ("\t", "\\t"),
+            ("\n", "\\n"),
+            ("\r", "\\r"),
+        ]:
+            value = value.replace(character, escaped)
+        return value
+
+    def copy_into_table(
+        self, context, table_name: str, columns: list, rows, verbose=False
+    ) -> None:
+        """
+        Bulk load rows with COPY ... FROM STDIN instead of one INSERT per row.
 
-        query = insert_statement.format(
-            table_name=table_name,
-            col_names=sql.SQL(", ").join(col_names),
-            col_values=sql.SQL(", ").join(
-                sql.Placeholder() * len(table_row["column_data"])
-            ),
+        columns = ["<col_name>", ...]
+        rows = iterable of tuples in column order
+        """
+        query = sql.SQL("COPY {table_name} ({columns}) FROM STDIN;").format(
+            table_name=sql.Identifier(table_name),
+            columns=sql.SQL(", ").join([sql.Identifier(col) for col in columns]),
         )
 
         if verbose:
             print(query.as_string(context))
 
-        self.execute(query, col_values)
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(self._copy_text_value(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        try:
+            self.copy_expert(query, buffer)
+        except Exception as exc:
+            print(f"{exc.__class__.__name__} {exc}")
+            raise
+
+    def update_post_tokens(
+        self, context, post_tokens: list, normalizer_version: int, verbose=False
+    ) -> None:
+        """
+        Store re-normalized tokens for existing raw posts in one statement.
+
+        post_tokens = [(<raw_post_id>, [<token>, ...]), ...]
+        """
+        query = sql.SQL(
+            "UPDATE {table_name} AS raw SET post_tokens = tokens.post_tokens,"
+            " normalizer_version = {normalizer_version}"
+            " FROM (VALUES %s) AS tokens (id, post_tokens)"
+            " WHERE raw.id = tokens.id;"
+        ).format(
+            table_name=sql.Identifier(RAW_POSTS_TABLE_MODEL["name"]),
+            normalizer_version=sql.Literal(normalizer_version),
+        )
+
+        if verbose:
+            print(query.as_string(context))
+
+        try:
+            psycopg2.extras.execute_values(
+                self, query, post_tokens, template="(%s, %s::text[])"
+            )
+        except Exception as exc:
+            print(f"{exc.__class__.__name__} {exc}")
+            raise
+
+    def select_posts_after(
+        self, context, after_id: int, limit: int, verbose=False
+    ) -> list:
+        """[(<raw_post_id>, <raw_post_text>), ...] of the next posts by id."""
+        query = sql.SQL(
+            "SELECT id, raw_post_text FROM {table_name}"
+            " WHERE id > %s ORDER BY id LIMIT %s;"
+        ).format(table_name=sql.Identifier(RAW_POSTS_TABLE_MODEL["name"]))
+
+        if verbose:
+            print(query.as_string(context))
+
+        self.execute(query, [after_id, limit])
+        return self.fetchall()
+
+    def update_post_scores(
+        self, context, post_scores: list, snapshot_id: int, verbose=False
+    ) -> None:
+        """
+        Store scores for existing raw posts in one statement.
+
+        post_scores = [(<raw_post_id>, <score>), ...]
+        """
+        query = sql.SQL(
+            "UPDATE {table_name} AS raw SET stpo_score = scores.stpo_score,"
+            " score_snapshot_id = {snapshot_id}"
+            " FROM (VALUES %s) AS scores (id, stpo_score)"
+            " WHERE raw.id = scores.id;"
+        ).format(
+            table_name=sql.Identifier(RAW_POSTS_TABLE_MODEL["name"]),
+            snapshot_id=sql.Literal(snapshot_id),
+        )
+
+        if verbose:
+            print(query.as_string(context))
+
+        try:
+            psycopg2.extras.execute_values(
+                self, query, post_scores, template="(%s, %s::double precision)"
+            )
+        except Exception as exc:
+            print(f"{exc.__class__.__name__} {exc}")
+            raise
+
+    def upsert_post_families(self, context, families: list, verbose=False) -> None:
+        """
+        Insert or refresh family index rows in one statement.
+
+        families = [
+            (<family_name>, [<unique_word>, ...], <member_count>, <last_seen>),
+            ...
+        ]
+        """
+        query = sql.SQL(
+            "INSERT INTO {table_name}"
+            " (family_name, unique_words, member_count, last_seen) VALUES %s"
+            " ON CONFLICT (family_name) DO UPDATE SET"
+            " member_count = EXCLUDED.member_count,"
+            " last_seen = EXCLUDED.last_seen;"
+        ).format(table_name=sql.Identifier(STPO_FAMILY_INDEX_MODEL["name"]))
+
+        if verbose:
+            print(query.as_string(context))
+
+        try:
+            psycopg2.extras.execute_values(
+                self, query, families, template="(%s, %s::text[], %s, %s)"
+            )
+        except Exception as exc:
+            print(f"{exc.__class__.__name__} {exc}")
+            raise
+
+    def delete_post_families(self, context, last_seen_before, verbose=False) -> int:
+        """Drop family index rows not seen since <last_seen_before>."""
+        query = sql.SQL("DELETE FROM {table_name} WHERE last_seen <= %s;").format(
+            table_name=sql.Identifier(STPO_FAMILY_INDEX_MODEL["name"])
+        )
+
+        if verbose:
+            print(query.as_string(context))
+
+        self.execute(query, [last_seen_before])
+        return self.rowcount
+
+    def upsert_firehose_checkpoint(
+        self, context, checkpoint_name: str, seq: int, updated_at, verbose=False
+    ) -> None:
+        query = sql.SQL(
+            "INSERT INTO {table_name} (checkpoint_name, seq, updated_at)"
+            " VALUES (%s, %s, %s)"
+            " ON CONFLICT (checkpoint_name) DO UPDATE SET"
+            " seq = EXCLUDED.seq,"
+            " updated_at = EXCLUDED.updated_at;"
+        ).format(table_name=sql.Identifier(FIREHOSE_CHECKPOINT_MODEL["name"]))
+
+        if verbose:
+            print(query.as_string(context))
+
+        self.execute(query, [checkpoint_name, seq, updated_at])
 
     def _output_tuples_to_dicitonaries(self, columns, output_rows):
         """For use with select_from_table."""
@@ -229,49 +728,68 @@ class STPOCursor(psycopg2.extensions.cursor):
             "limit" <optional>: <int>
         }
         """
-        if "columns" in select_attrs.keys():
-            query = sql.SQL("SELECT {columns} FROM {table_name}").format(
-                columns=sql.SQL(", ").join(
-                    [sql.Identifier(col) for col in select_attrs["columns"]]
-                ),
-                table_name=sql.Identifier(select_attrs["table_name"]),
-            )
-        else:
-            query_text = f"SELECT {select_attrs['text']} "
-            query_text += "FROM {table_name}"
-            query = sql.SQL(query_text).format(
-                table_name=sql.Identifier(select_attrs["table_name"])
-            )
-        execution_values = []
-
-        if "where" in select_attrs.keys():
-            query += sql.SQL(" WHERE ")
-            where_conditions = []
-            for where_element in select_attrs["where"]:
-                if "text" in where_element.keys():
-                    # Don't use this if you can avoid it
-                    where_conditions.append(sql.SQL(where_element["text"]))
-                else:
-                    where_text = "{where_column} "
-                    where_text += where_element["operator"]
-                    where_condition = sql.SQL(where_text).format(
-                        where_column=sql.Identifier(where_element["column"])
-                    )
-                    where_condition += sql.SQL(" %s")
-                    where_conditions.append(where_condition)
-                    execution_values.append(where_element["value"])
-
-            query += sql.SQL(" AND").join(where_conditions)
-
-        if "limit" in select_attrs.keys():
-            query += sql.SQL(f" LIMIT {select_attrs['limit']}")
-
-        query += sql.SQL(";")
+        where_elements = select_attrs.get("where", [])
+        execution_values = [
+            where_element["value"]
+            for where_element in where_elements
+            if "text" not in where_element.keys()
+        ]
 
-        if verbose:
-            print(query.as_string(context))
+        def build_query():
+            if "columns" in select_attrs.keys():
+                query = sql.SQL("SELECT {columns} FROM {table_name}").format(
+                    columns=sql.SQL(", ").join(
+                        [sql.Identifier(col) for col in select_attrs["columns"]]
+                    ),
+                    table_name=sql.Identifier(select_attrs["table_name"]),
+                )
+            else:
+                query_text = f"SELECT {select_attrs['text']} "
+                query_text += "FROM {table_name}"
+                query = sql.SQL(query_text).format(
+                    table_name=sql.Identifier(select_attrs["table_name"])
+                )
 
-        self.execute(query, execution_values)
+            if where_elements:
+                query += sql.SQL(" WHERE ")
+                where_conditions = []
+                for where_element in where_elements:
+                    if "text" in where_element.keys():
+                        # Don't use this if you can avoid it
+                        where_conditions.append(sql.SQL(where_element["text"]))
+                    else:
+                        where_text = "{where_column} "
+                        where_text += where_element["operator"]
+                        where_condition = sql.SQL(where_text).format(
+                            where_column=sql.Identifier(where_element["column"])
+                        )
+                        where_condition += sql.SQL(" %s")
+                        where_conditions.append(where_condition)
+
+                query += sql.SQL(" AND").join(where_conditions)
+
+            if "limit" in select_attrs.keys():
+                query += sql.SQL(f" LIMIT {select_attrs['limit']}")
+
+            query += sql.SQL(";")
+            return query
+
+        statement_key = (
+            "select",
+            select_attrs["table_name"],
+            tuple(select_attrs["columns"])
+            if "columns" in select_attrs.keys()
+            else select_attrs["text"],
+            tuple(
+                where_element.get("text")
+                or (where_element["column"], where_element["operator"])
+                for where_element in where_elements
+            ),
+            select_attrs.get("limit"),
+        )
+        self.execute_cached(
+            context, statement_key, build_query, execution_values, verbose=verbose
+        )
 
         results = self.fetchall()
 
@@ -284,3 +802,174 @@ class STPOCursor(psycopg2.extensions.cursor):
         #     print(results)
 
         return results
+
+    def upsert_vocabulary(self, context, words, verbose=False) -> dict:
+        """
+        Add any new words to the STPO vocabulary and return {word: word_id}.
+        Pruned maps' reserved PRUNED_MASS_KEY successor is stored like a word,
+        so relational snapshots keep row totals.
+        """
+        words = list(words)
+        query_args = {
+            "vocabulary": sql.Identifier(STPO_VOCABULARY_MODEL["name"]),
+        }
+        insert_query = sql.SQL(
+            "INSERT INTO {vocabulary} (word) SELECT unnest(%s::text[])"
+            " ON CONFLICT (word) DO NOTHING;"
+        ).format(**query_args)
+        select_query = sql.SQL(
+            "SELECT word, id FROM {vocabulary} WHERE word = ANY(%s::text[]);"
+        ).format(**query_args)
+
+        if verbose:
+            print(insert_query.as_string(context))
+            print(select_query.as_string(context))
+
+        self.execute(insert_query, [words])
+        self.execute(select_query, [words])
+        return dict(self.fetchall())
+
+    def insert_stpo_pairs(
+        self, context, snapshot_id, stpo_map: dict, verbose=False
+    ) -> None:
+        """Bulk load an STPO map into stpo_pairs under <snapshot_id>."""
+        words = set()
+        for first_words in stpo_map.values():
+            words.update(first_words.keys())
+            for second_words in first_words.values():
+                words.update(second_words.keys())
+        word_ids = self.upsert_vocabulary(context, words, verbose=verbose)
+
+        rows = (
+            (
+                snapshot_id,
+                int(separation),
+                word_ids[first_word],
+                word_ids[second_word],
+                occurrences,
+            )
+            for separation, first_words in stpo_map.items()
+            for first_word, second_words in first_words.items()
+            for second_word, occurrences in second_words.items()
+        )
+        columns = [col["name"] for col in STPO_PAIRS_MODEL["columns"]]
+        self.copy_into_table(
+            context, STPO_PAIRS_MODEL["name"], columns, rows, verbose=verbose
+        )
+
+    def _stpo_pairs_query(self, query_text, **query_args):
+        """For use with the stpo_pairs query helpers."""
+        return sql.SQL(query_text).format(
+            stpo_map=sql.Identifier(STPO_MAP_MODEL["name"]),
+            pairs=sql.Identifier(STPO_PAIRS_MODEL["name"]),
+            vocabulary=sql.Identifier(STPO_VOCABULARY_MODEL["name"]),
+            **query_args,
+        )
+
+    def _latest_relational_snapshot(self):
+        """For use with the stpo_pairs query helpers."""
+        return sql.SQL(
+            "(SELECT max(id) FROM {stpo_map} WHERE snapshot_format = 'relational')"
+        ).format(stpo_map=sql.Identifier(STPO_MAP_MODEL["name"]))
+
+    def select_stpo_pairs(
+        self, context, snapshot_id, include_pruned=False, verbose=False
+    ) -> dict:
+        """
+        Rebuild the full STPO map of a relational snapshot. Rows' pruned mass
+        (PRUNED_MASS_KEY) is left out unless <include_pruned>, as a scoring
+        model needs it for its row totals.
+        """
+        query = self._stpo_pairs_query(
+            "SELECT p.separation, f.word, s.word, p.count FROM {pairs} p"
+            " JOIN {vocabulary} f ON f.id = p.first_word_id"
+            " JOIN {vocabulary} s ON s.id = p.second_word_id"
+            " WHERE p.snapshot_id = %s"
+            + ("" if include_pruned else " AND s.word <> %s")
+            + ";"
+        )
+        execution_values = [snapshot_id]
+        if not include_pruned:
+            execution_values.append(PRUNED_MASS_KEY)
+
+        if verbose:
+            print(query.as_string(context))
+
+        self.execute(query, execution_values)
+
+        stpo_map = {}
+        for separation, first_word, second_word, occurrences in self.fetchall():
+            first_words = stpo_map.setdefault(separation, {})
+            first_words.setdefault(first_word, {})[second_word] = occurrences
+        return stpo_map
+
+    def select_stpo_pair_counts(
+        self,
+        context,
+        separation,
+        first_word,
+        second_word,
+        since=None,
+        until=None,
+        verbose=False,
+    ) -> list:
+        """
+        Count of one pair in every relational snapshot, oldest first, without
+        loading any full map.
+
+        output = [(<snapshot_id>, <created_at>, <occurrences>), ...]
+        """
+        query = self._stpo_pairs_query(
+            "SELECT m.id, m.created_at, p.count FROM {pairs} p"
+            " JOIN {stpo_map} m ON m.id = p.snapshot_id"
+            " WHERE p.separation = %s"
+            " AND p.first_word_id = (SELECT id FROM {vocabulary} WHERE word = %s)"
+            " AND p.second_word_id = (SELECT id FROM {vocabulary} WHERE word = %s)"
+        )
+        execution_values = [separation, first_word, second_word]
+        if since is not None:
+            query += sql.SQL(" AND m.created_at >= %s")
+            execution_values.append(since)
+        if until is not None:
+            query += sql.SQL(" AND m.created_at < %s")
+            execution_values.append(until)
+        query += sql.SQL(" ORDER BY m.created_at;")
+
+        if verbose:
+            print(query.as_string(context))
+
+        self.execute(query, execution_values)
+        return self.fetchall()
+
+    def select_top_successors(
+        self, context, separation, first_word, k=10, snapshot_id=None, verbose=False
+    ) -> list:
+        """
+        The <k> most frequent second words after <first_word> in a relational
+        snapshot (the latest one if <snapshot_id> isn't given), without the
+        row's pruned mass.
+
+        output = [(<second_word>, <occurrences>), ...]
+        """
+        if snapshot_id is None:
+            snapshot = self._latest_relational_snapshot()
+            execution_values = []
+        else:
+            snapshot = sql.Placeholder()
+            execution_values = [snapshot_id]
+        query = self._stpo_pairs_query(
+            "SELECT s.word, p.count FROM {pairs} p"
+            " JOIN {vocabulary} s ON s.id = p.second_word_id"
+            " WHERE p.snapshot_id = {snapshot} AND p.separation = %s"
+            " AND p.first_word_id = (SELECT id FROM {vocabulary} WHERE word = %s)"
+            " AND s.word <> %s"
+            " ORDER BY p.count DESC LIMIT %s;",
+            snapshot=snapshot,
+        )
+        execution_values += [separation, first_word, PRUNED_MASS_KEY, k]
+
+        if verbose:
+            print(query.as_string(context))
+
+        self.execute(query, execution_values)
+        return self.fetchall()
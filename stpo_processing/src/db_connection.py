@@ -0,0 +1,22 @@
+import importlib
+
+# Names resolved from .database on first access, so importing this module
+# leaves psycopg2 to the first connection (or the first error handler that
+# actually runs)
+DATABASE_EXPORTS = ["CONNECTION_ERRORS", "PGDataError", "PGError"]
+
+
+def _database():
+    return importlib.import_module(".database", __package__)
+
+
+def get_connection_and_cursor():
+    return _database().get_connection_and_cursor()
+
+
+def __getattr__(name):
+    if name in DATABASE_EXPORTS:
+        value = getattr(_database(), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,180 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+from .constants import FAMILY_DETECTOR_MAX_POSTS, FAMILY_DETECTOR_MAX_SINGLETONS
+from .logging import set_local_logger
+from .raw_post_processing import (
+    format_post,
+    get_unique_length_range,
+    is_family_match,
+)
+
+logger = set_local_logger(__name__)
+
+
+class OnlineFamilyDetector:
+    """
+    Groups posts into families as they arrive, with the same matching rules
+    as build_post_families, so repetitive posts are known at ingest time.
+
+    Families are indexed by word. A family must hold every word of a post
+    to match it, so a post is only compared with the families holding its
+    rarest word. Posts older than <window> are expired, past
+    <max_singletons> single-post families the oldest are dropped, and past
+    <max_posts> stored posts the least recently matched families are
+    evicted.
+
+    families = {
+        "family_name": {
+            "unique_words": <set_of_unique_words>,
+            "posts": [(<created_at>, <post_words>), ...],
+            "last_seen": <created_at>
+        },
+        ...
+    }
+
+    Every listener is called with a family-membership event per post:
+        event = {
+            "family_name": <family_name>,
+            "family_size": <posts_in_family>,
+            "is_new_family": <bool>,
+            "post_words": <post_words>,
+            "created_at": <created_at>
+        }
+    """
+
+    def __init__(
+        self,
+        window=timedelta(days=1),
+        max_posts=FAMILY_DETECTOR_MAX_POSTS,
+        max_singletons=FAMILY_DETECTOR_MAX_SINGLETONS,
+        min_length=1,
+        margin=0.01,
+    ):
+        self.window = window
+        self.max_posts = max_posts
+        self.max_singletons = max_singletons
+        self.min_length = min_length
+        self.margin = margin
+
+        self.families = OrderedDict()
+        # {<word>: {<family_name>, ...}}
+        self.families_by_word = {}
+        # Single-post families, oldest first
+        self.singletons = OrderedDict()
+        self.post_count = 0
+        self.listeners = []
+        self._lock = Lock()
+
+    def _remove_family(self, family_name):
+        """For use with expire and add_post. Caller holds the lock."""
+        family_traits = self.families.pop(family_name)
+        for word in family_traits["unique_words"]:
+            word_families = self.families_by_word[word]
+            word_families.discard(family_name)
+            if not word_families:
+                del self.families_by_word[word]
+        self.singletons.pop(family_name, None)
+        self.post_count -= len(family_traits["posts"])
+
+    def _find_family(self, unique_post_words):
+        """For use with add_post. Caller holds the lock."""
+        word_families = [
+            self.families_by_word.get(word, ()) for word in unique_post_words
+        ]
+        rarest_word_families = min(word_families, key=len)
+        unique_length_range = get_unique_length_range(
+            len(unique_post_words), self.margin
+        )
+        for family_name in rarest_word_families:
+            family_unique_words = self.families[family_name]["unique_words"]
+            if is_family_match(
+                family_unique_words, unique_post_words, unique_length_range
+            ):
+                return family_name
+        return None
+
+    def add_post(self, post, created_at=None):
+        """Add a post to its family and return the membership event."""
+        post_words = format_post(post).split()
+        if len(post_words) <= self.min_length:
+            return None
+        created_at = created_at or datetime.now(timezone.utc)
+        unique_post_words = set(post_words)
+
+        with self._lock:
+            family_name = self._find_family(unique_post_words)
+            is_new_family = family_name is None
+            if is_new_family:
+                family_name = post
+                self.families[family_name] = {
+                    "unique_words": unique_post_words,
+                    "posts": [],
+                }
+                for word in unique_post_words:
+                    self.families_by_word.setdefault(word, set()).add(family_name)
+                self.singletons[family_name] = None
+            else:
+                self.singletons.pop(family_name, None)
+
+            family_traits = self.families[family_name]
+            family_traits["posts"].append((created_at, post_words))
+            family_traits["last_seen"] = created_at
+            self.families.move_to_end(family_name)
+            self.post_count += 1
+
+            while len(self.singletons) > self.max_singletons:
+                self._remove_family(next(iter(self.singletons)))
+            while self.post_count > self.max_posts and len(self.families) > 1:
+                self._remove_family(next(iter(self.families)))
+
+            event = {
+                "family_name": family_name,
+                "family_size": len(family_traits["posts"]),
+                "is_new_family": is_new_family,
+                "post_words": post_words,
+                "created_at": created_at,
+            }
+
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning("Exception in family listener:", e)
+
+        return event
+
+    def expire(self, now=None):
+        """Drop posts older than the window, and families left empty."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - self.window
+        with self._lock:
+            for family_name in list(self.families.keys()):
+                family_traits = self.families[family_name]
+                if family_traits["last_seen"] <= cutoff:
+                    self._remove_family(family_name)
+                    continue
+                posts = family_traits["posts"]
+                kept_posts = [post for post in posts if post[0] > cutoff]
+                self.post_count -= len(posts) - len(kept_posts)
+                family_traits["posts"] = kept_posts
+                if len(kept_posts) == 1:
+                    self.singletons[family_name] = None
+
+    def get_repetitive_posts(self, min_family_size=2, now=None) -> list:
+        """
+        Word lists of every post in families of at least <min_family_size>
+        within the window, shaped like build_post_families output (each
+        family also contributes its formatted family name).
+        """
+        self.expire(now)
+        repetitive_posts = []
+        with self._lock:
+            for family_name, family_traits in self.families.items():
+                if len(family_traits["posts"]) >= min_family_size:
+                    repetitive_posts.append(format_post(family_name).split())
+                    repetitive_posts += [
+                        post_words for _, post_words in family_traits["posts"]
+                    ]
+        return repetitive_posts
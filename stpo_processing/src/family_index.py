@@ -0,0 +1,168 @@
+from datetime import datetime, timezone
+
+from .constants import FAMILY_INDEX_TTL, STPO_FAMILY_INDEX_MODEL
+from .logging import set_local_logger
+from .raw_post_processing import (
+    get_unique_length_range,
+    is_family_match,
+    orchestrate_stpo,
+)
+
+logger = set_local_logger(__name__)
+
+
+class FamilyIndex:
+    """
+    Post families known from earlier cycles, so build_post_families can
+    match a post against them before scanning the cycle's own families.
+    Persisted to the family index table (see load and save) to survive
+    restarts. Families not seen for <ttl> are evicted.
+
+    families = {
+        "family_name": {
+            "unique_words": <set_of_unique_words>,
+            "member_count": <posts_matched_in_the_latest_cycle>,
+            "last_seen": <datetime>
+        },
+        ...
+    }
+    """
+
+    def __init__(self, ttl=FAMILY_INDEX_TTL, margin=0.01, min_member_count=2):
+        self.ttl = ttl
+        self.margin = margin
+        # One-off posts are left out, or the index would hold every post
+        self.min_member_count = min_member_count
+
+        self.families = {}
+        self.families_by_length = {}
+        self._updated_families = set()
+
+    def __len__(self):
+        return len(self.families)
+
+    def _add_family(self, family_name, unique_words, member_count, last_seen):
+        self.families[family_name] = {
+            "unique_words": set(unique_words),
+            "member_count": member_count,
+            "last_seen": last_seen,
+        }
+        self.families_by_length.setdefault(len(unique_words), set()).add(family_name)
+
+    def _remove_family(self, family_name):
+        family_traits = self.families.pop(family_name)
+        unique_words_length = len(family_traits["unique_words"])
+        self.families_by_length[unique_words_length].discard(family_name)
+        if not self.families_by_length[unique_words_length]:
+            del self.families_by_length[unique_words_length]
+        self._updated_families.discard(family_name)
+
+    def match(self, unique_post_words):
+        """The indexed family a post belongs to, or None."""
+        unique_length_range = get_unique_length_range(
+            len(unique_post_words), self.margin
+        )
+        for unique_words_length in unique_length_range:
+            for family_name in self.families_by_length.get(unique_words_length, []):
+                if is_family_match(
+                    self.families[family_name]["unique_words"],
+                    unique_post_words,
+                    unique_length_range,
+                ):
+                    return family_name
+        return None
+
+    def update(self, post_family_chunks, now=None):
+        """
+        Record a cycle's families (chunks of build_post_families' internal
+        format, with "weights") as seen at <now>. Cycles read overlapping
+        windows, so a family's member count is replaced by the cycle's, not
+        added to.
+        """
+        now = now or datetime.now(timezone.utc)
+        member_counts = {}
+        family_unique_words = {}
+        for post_families in post_family_chunks:
+            for family_name, family_traits in post_families.items():
+                member_counts[family_name] = member_counts.get(family_name, 0) + sum(
+                    family_traits["weights"]
+                )
+                family_unique_words.setdefault(
+                    family_name, family_traits["unique_words"]
+                )
+
+        for family_name, member_count in member_counts.items():
+            if family_name in self.families:
+                self.families[family_name]["member_count"] = member_count
+                self.families[family_name]["last_seen"] = now
+            elif member_count < self.min_member_count:
+                continue
+            else:
+                self._add_family(
+                    family_name, family_unique_words[family_name], member_count, now
+                )
+            self._updated_families.add(family_name)
+
+    def expire(self, now=None) -> int:
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - self.ttl
+        expired_families = [
+            family_name
+            for family_name, family_traits in self.families.items()
+            if family_traits["last_seen"] <= cutoff
+        ]
+        for family_name in expired_families:
+            self._remove_family(family_name)
+        return len(expired_families)
+
+    def load(self, cur, now=None):
+        """Replace the index with the unexpired families in the database."""
+        now = now or datetime.now(timezone.utc)
+        select_families = {
+            "table_name": STPO_FAMILY_INDEX_MODEL["name"],
+            "columns": ["family_name", "unique_words", "member_count", "last_seen"],
+            "where": [
+                {"column": "last_seen", "operator": ">", "value": now - self.ttl}
+            ],
+        }
+        self.families = {}
+        self.families_by_length = {}
+        self._updated_families = set()
+        for family_name, unique_words, member_count, last_seen in cur.select_from_table(
+            cur, select_families
+        ):
+            self._add_family(family_name, unique_words, member_count, last_seen)
+        logger.info(f"Family index loaded with {len(self.families)} families")
+
+    def save(self, cur, now=None):
+        """Write families updated since the last save, and drop expired rows."""
+        now = now or datetime.now(timezone.utc)
+        self.expire(now)
+        updated_families = [
+            (
+                family_name,
+                sorted(self.families[family_name]["unique_words"]),
+                self.families[family_name]["member_count"],
+                self.families[family_name]["last_seen"],
+            )
+            for family_name in self._updated_families
+        ]
+        if updated_families:
+            cur.upsert_post_families(cur, updated_families)
+        cur.delete_post_families(cur, now - self.ttl)
+        self._updated_families = set()
+
+
+def orchestrate_indexed_stpo(posts, family_index, post_tokens=None, cycle_time=None):
+    """
+    orchestrate_stpo with a family index, returning the updated index too for
+    callers running it in another process.
+    """
+    stpo_map = orchestrate_stpo(
+        posts,
+        verbose=True,
+        post_tokens=post_tokens,
+        family_index=family_index,
+        cycle_time=cycle_time,
+    )
+    return stpo_map, family_index
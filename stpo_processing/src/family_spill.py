@@ -0,0 +1,92 @@
+import pickle
+import tempfile
+
+from .constants import POST_FAMILY_MAX_BYTES
+from .logging import set_local_logger
+
+logger = set_local_logger(__name__)
+
+# Rough in-memory cost of one word of a stored post (list slot and str)
+BYTES_PER_POST_WORD = 64
+
+
+def estimate_post_families_bytes(post_families: dict) -> int:
+    word_count = 0
+    for family_traits in post_families.values():
+        word_count += len(family_traits["unique_words"])
+        for post_words in family_traits["posts"]:
+            word_count += len(post_words)
+    return word_count * BYTES_PER_POST_WORD
+
+
+class PostFamilyStore:
+    """
+    Stands in for build_post_families' post_family_collection, keeping the
+    finalized family chunks in RAM up to <max_bytes> (estimated) and spilling
+    the rest to an anonymous temp file. Chunks are read back one at a time,
+    in order, when iterated.
+
+    Only finalized chunks are bounded: the families build_post_families is
+    still matching against stay in memory.
+    """
+
+    def __init__(self, max_bytes=POST_FAMILY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # Each chunk: {"post_families": <dict>} in RAM or {"offset": <int>} spilled
+        self.chunks = []
+        self.memory_bytes = 0
+        self.spilled_chunks = 0
+        self._spill_file = None
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _spill(self, post_families) -> int:
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="stpo_families_")
+        self._spill_file.seek(0, 2)
+        offset = self._spill_file.tell()
+        pickle.dump(post_families, self._spill_file, pickle.HIGHEST_PROTOCOL)
+        self.spilled_chunks += 1
+        return offset
+
+    def append(self, post_families: dict):
+        chunk_bytes = estimate_post_families_bytes(post_families)
+        if self.memory_bytes + chunk_bytes > self.max_bytes:
+            self.chunks.append({"offset": self._spill(post_families)})
+            logger.debug(f"Spilled post family chunk {len(self.chunks)} to disk")
+        else:
+            self.chunks.append({"post_families": post_families})
+            self.memory_bytes += chunk_bytes
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if "post_families" in chunk:
+                yield chunk["post_families"]
+            else:
+                self._spill_file.seek(chunk["offset"])
+                yield pickle.load(self._spill_file)
+
+    def iter_members(self):
+        """
+        (post_words, weight) for every repetitive post, in
+        combine_post_families order, without building the combined list.
+        """
+        for post_families in self:
+            for family_traits in post_families.values():
+                # The first post is the family name, already normalized
+                yield family_traits["posts"][0], 1
+                yield from zip(family_traits["posts"], family_traits["weights"])
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self.chunks = []
+        self.memory_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,43 +1,273 @@
+import time
+
 from atproto import CAR, models
+from atproto.exceptions import AtProtocolError  # noqa: F401 (re-exported)
 from atproto.firehose import FirehoseSubscribeReposClient, parse_subscribe_repos_message
 
-from src.constants import RAW_POSTS_TABLE_MODEL
-from src.database import get_connection_and_cursor
+from src.commit_filter import commit_filter_stats, should_decode
+from src.constants import (
+    FIREHOSE_FLUSH_INTERVAL,
+    FIREHOSE_FLUSH_POSTS,
+    NORMALIZE_AT_INGEST,
+    RAW_POSTS_TABLE_MODEL,
+)
+from src.database import get_connection_and_cursor, PGDataError, PGError
+from src.firehose_checkpoint import parse_commit_time
+from src.ingest_filters import get_post_fields, get_post_lang, passes_ingest_filters
 from src.logging import set_local_logger
+from src.raw_post_processing import NORMALIZER_VERSION, normalize_post
 
 logger = set_local_logger(__name__)
 
 
+def parse_commit(message):
+    """The repo commit in a firehose message, or None for other messages."""
+    commit = parse_subscribe_repos_message(message)
+    # Make sure that it's commit message with .blocks inside
+    if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit):
+        return None
+    return commit
+
+
+def get_commit_posts(commit) -> list:
+    """
+    Every new post in a repo commit that passes the ingest filters, as
+    get_post_fields dicts. Commits without post creates (likes, follows,
+    reposts, ...) are skipped from their ops, before decoding their blocks.
+    """
+    if not should_decode(commit):
+        return []
+    start = time.thread_time()
+    car = CAR.from_bytes(commit.blocks)
+
+    posts = []
+    for block in car.blocks.values():
+        if "$type" in block.keys():
+            if block["$type"] == "app.bsky.feed.post":
+                post = get_post_fields(block)
+                if passes_ingest_filters(post):
+                    posts.append(post)
+    commit_filter_stats.record_decoded(time.thread_time() - start)
+    return posts
+
+
+def get_posts(message) -> list:
+    """Every new post in a firehose message that passes the ingest filters."""
+    commit = parse_commit(message)
+    if commit is None:
+        return []
+    return get_commit_posts(commit)
+
+
+def get_post_texts(message) -> list:
+    """Text of every new post in a firehose message that passes the filters."""
+    return [post["text"] for post in get_posts(message)]
+
+
+def get_post_column_data(post, created_at=None) -> list:
+    """
+    Raw posts table column data for a post (see get_post_fields). created_at
+    (naive UTC) defaults to the insert time.
+    """
+    column_data = [
+        {"name": "raw_post_text", "value": post["text"]},
+        {"name": "lang", "value": get_post_lang(post)},
+        {"name": "langs", "value": post["langs"]},
+        {"name": "is_reply", "value": post["is_reply"]},
+        {"name": "has_embed", "value": post["has_embed"]},
+    ]
+    if NORMALIZE_AT_INGEST:
+        column_data += [
+            {"name": "post_tokens", "value": normalize_post(post["text"])},
+            {"name": "normalizer_version", "value": NORMALIZER_VERSION},
+        ]
+    if created_at is not None:
+        column_data.append({"name": "created_at", "value": created_at})
+    return column_data
+
+
+def insert_post_batch(cur, posts: list, created_ats=None) -> None:
+    """Bulk load many posts into the raw posts table in one COPY."""
+    if not posts:
+        return
+    created_ats = created_ats or [None] * len(posts)
+    post_rows = [
+        get_post_column_data(post, created_at)
+        for post, created_at in zip(posts, created_ats)
+    ]
+    cur.copy_into_table(
+        cur,
+        RAW_POSTS_TABLE_MODEL["name"],
+        [col["name"] for col in post_rows[0]],
+        [[col["value"] for col in post_row] for post_row in post_rows],
+    )
+
+
+def flush_post_batch(cur, posts: list, checkpoint=None, seq=None) -> None:
+    """
+    Insert posts and, with a checkpoint, the last firehose seq they cover,
+    in one transaction.
+    """
+    if checkpoint is None:
+        insert_post_batch(cur, posts)
+        return
+    cur.execute("BEGIN;")
+    try:
+        insert_post_batch(cur, posts)
+        checkpoint.save(cur, seq)
+        cur.execute("COMMIT;")
+    except Exception:
+        try:
+            cur.execute("ROLLBACK;")
+        except PGError:
+            pass
+        raise
+
+
+def flush_posts_singly(cur, posts: list, checkpoint=None, seq=None) -> int:
+    """
+    After the database rejected a batch's data, insert its posts one at a
+    time, dropping those rejected, then save the checkpoint. Returns posts
+    dropped.
+    """
+    rejected_posts = 0
+    for post in posts:
+        try:
+            flush_post_batch(cur, [post])
+        except PGDataError as e:
+            rejected_posts += 1
+            logger.error(f"Dropped post rejected by the database: {e}")
+    if checkpoint is not None:
+        flush_post_batch(cur, [], checkpoint, seq)
+    return rejected_posts
+
+
 class FirehoseClient(FirehoseSubscribeReposClient):
-    def __init__(self):
+    """
+    Writes new posts to the raw posts table in batches of up to
+    <flush_posts>, or every <flush_interval> seconds.
+
+    With a checkpoint (see firehose_checkpoint.py), the client subscribes
+    from the last saved seq and each batch is written in one transaction
+    with the seq it covers. Without a post spool, a failed batch stops the
+    client so it's restarted from the checkpoint rather than losing posts.
+    A batch the database rejects for its data is written again one post at
+    a time, dropping the posts rejected, so replaying it can't fail again.
+
+    With a post_spool (see post_spool.py), batches the database can't take
+    are spooled instead, and batches keep being spooled, in order, until the
+    spool drains; the connection is then reopened.
+    """
+
+    def __init__(
+        self,
+        family_detector=None,
+        post_spool=None,
+        checkpoint=None,
+        flush_posts=FIREHOSE_FLUSH_POSTS,
+        flush_interval=FIREHOSE_FLUSH_INTERVAL,
+    ):
         try:
-            FirehoseSubscribeReposClient.__init__(self)
-            self.con, self.cur = get_connection_and_cursor()
+            self.family_detector = family_detector
+            self.post_spool = post_spool
+            self.checkpoint = checkpoint
+            self.flush_posts = flush_posts
+            self.flush_interval = flush_interval
+
+            self.con, self.cur = None, None
+            try:
+                self.con, self.cur = get_connection_and_cursor()
+            except RuntimeError:
+                if post_spool is None:
+                    raise
+
+            params = None
+            if checkpoint is not None:
+                if self.cur is not None:
+                    checkpoint.load(self.cur)
+                cursor = checkpoint.resume_cursor()
+                if cursor is not None:
+                    params = models.ComAtprotoSyncSubscribeRepos.Params(cursor=cursor)
+            FirehoseSubscribeReposClient.__init__(self, params)
+
+            self.post_buffer = []
+            self.buffer_seq = None
+            self.buffer_commit_time = None
+            self.last_flush = time.monotonic()
+            self.rejected_posts = 0
         except Exception as e:
             logger.warning("Exception in client init:", e)
             raise
 
+    def _is_database_ready(self) -> bool:
+        """Whether to insert (True) or spool (False) posts."""
+        if not self.post_spool.is_empty():
+            return False
+        if self.cur is None:
+            try:
+                self.con, self.cur = get_connection_and_cursor()
+            except RuntimeError:
+                return False
+        return True
+
+    def flush(self):
+        """Write the buffered posts, and checkpoint the last seq received."""
+        if self.buffer_seq is None:
+            return
+        posts, seq = self.post_buffer, self.buffer_seq
+        if self.checkpoint is not None:
+            delay = self.checkpoint.flush_delay(
+                len(posts),
+                parse_commit_time(self.buffer_commit_time),
+                time.monotonic() - self.last_flush,
+            )
+            if delay:
+                time.sleep(delay)
+        self.post_buffer, self.buffer_seq = [], None
+        self.last_flush = time.monotonic()
+
+        if self.post_spool is not None and not self._is_database_ready():
+            self.post_spool.append(posts)
+        else:
+            try:
+                try:
+                    flush_post_batch(self.cur, posts, self.checkpoint, seq)
+                except PGDataError as e:
+                    logger.warning(f"Post batch rejected, writing posts singly: {e}")
+                    self.rejected_posts += flush_posts_singly(
+                        self.cur, posts, self.checkpoint, seq
+                    )
+            except PGError as e:
+                if self.post_spool is None:
+                    if self.checkpoint is not None:
+                        logger.error(f"Post flush failed, restarting at seq: {e}")
+                        self.stop()
+                    raise
+                logger.warning(f"Spooling posts, database unavailable: {e}")
+                self.post_spool.append(posts)
+                self.close_db_connection()
+        if self.checkpoint is not None:
+            self.checkpoint.mark_saved(seq)
+
     def on_message_handler(self, message):
         try:
-            commit = parse_subscribe_repos_message(message)
-            # Make sure that it's commit message with .blocks inside
-            if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit):
+            commit = parse_commit(message)
+            if commit is None:
                 return
-
-            car = CAR.from_bytes(commit.blocks)
-
-            for block in car.blocks.values():
-                if "$type" in block.keys():
-                    if block["$type"] == "app.bsky.feed.post":
-                        text = block["text"]
-                        if len(text) > 2:
-                            table_row = {
-                                "table_name": RAW_POSTS_TABLE_MODEL["name"],
-                                "column_data": [
-                                    {"name": "raw_post_text", "value": text}
-                                ],
-                            }
-                            self.cur.insert_into_table(self.cur, table_row)
+            if self.checkpoint is not None and not self.checkpoint.observe(commit.seq):
+                return
+            posts = get_commit_posts(commit)
+            self.post_buffer += posts
+            self.buffer_seq = commit.seq
+            self.buffer_commit_time = commit.time
+            if self.family_detector:
+                for post in posts:
+                    self.family_detector.add_post(post["text"])
+            if (
+                len(self.post_buffer) >= self.flush_posts
+                or time.monotonic() - self.last_flush >= self.flush_interval
+            ):
+                self.flush()
         except Exception as e:
             logger.warning("Exception in message handler:", e)
 
@@ -49,8 +279,13 @@ class FirehoseClient(FirehoseSubscribeReposClient):
             raise
 
     def close_db_connection(self):
+        if self.con is None:
+            return
         try:
             self.con.close()
         except Exception as e:
             logger.warning("Exception closing db connection:", e)
-            raise
+            if self.post_spool is None:
+                raise
+        finally:
+            self.con, self.cur = None, None
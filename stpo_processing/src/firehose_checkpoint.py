@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+
+from .constants import (
+    FIREHOSE_CATCHUP_LAG,
+    FIREHOSE_CATCHUP_MAX_POSTS_PER_SECOND,
+    FIREHOSE_CHECKPOINT_MODEL,
+    FIREHOSE_CHECKPOINT_NAME,
+    FIREHOSE_RESUME_MAX_AGE,
+    FIREHOSE_SKIP_REPLAYED,
+)
+from .logging import set_local_logger
+
+logger = set_local_logger(__name__)
+
+
+def parse_commit_time(time_text):
+    """Commit time ("2024-01-01T00:00:00.000Z") as an aware datetime."""
+    try:
+        return datetime.fromisoformat(time_text.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+class FirehoseCheckpoint:
+    """
+    Where FirehoseClient is in the firehose, kept across client restarts and
+    in the firehose checkpoint table across process restarts.
+
+    saved_seq: last seq whose posts are stored, in the database or the post
+        spool. Its database row is written in the same transaction as the
+        posts it covers, so a restart resumes just after them.
+    seen_seq: last seq received, stored or still buffered. With
+        <skip_replayed>, commits at or before it are dropped (the firehose
+        client replays from its starting cursor when it reconnects).
+
+    Posts spooled during an outage advance saved_seq only in memory; if the
+    process stops before the next flush, the spooled commits are replayed.
+    """
+
+    def __init__(
+        self,
+        name=FIREHOSE_CHECKPOINT_NAME,
+        resume_max_age=FIREHOSE_RESUME_MAX_AGE,
+        skip_replayed=FIREHOSE_SKIP_REPLAYED,
+        catchup_lag=FIREHOSE_CATCHUP_LAG,
+        catchup_max_posts_per_second=FIREHOSE_CATCHUP_MAX_POSTS_PER_SECOND,
+    ):
+        self.name = name
+        self.resume_max_age = resume_max_age
+        self.skip_replayed = skip_replayed
+        self.catchup_lag = catchup_lag
+        self.catchup_max_posts_per_second = catchup_max_posts_per_second
+
+        self.saved_seq = None
+        self.saved_at = None
+        self.seen_seq = None
+        self.replayed_commits = 0
+
+    def load(self, cur):
+        """Read the stored checkpoint, unless this process already has one."""
+        if self.saved_seq is not None:
+            return
+        select_checkpoint = {
+            "table_name": FIREHOSE_CHECKPOINT_MODEL["name"],
+            "columns": ["seq", "updated_at"],
+            "where": [
+                {"column": "checkpoint_name", "operator": "=", "value": self.name}
+            ],
+        }
+        results = cur.select_from_table(cur, select_checkpoint)
+        if results:
+            self.saved_seq, self.saved_at = results[0]
+            logger.info(f"Firehose checkpoint loaded at seq {self.saved_seq}")
+
+    def resume_cursor(self, now=None):
+        """
+        The cursor to subscribe from, or None to start live when there's no
+        checkpoint or it's older than <resume_max_age>. Forgets seen but
+        unsaved commits, which a restarted client receives again.
+        """
+        now = now or datetime.now(timezone.utc)
+        self.seen_seq = self.saved_seq
+        if self.saved_seq is None:
+            return None
+        if (
+            self.resume_max_age is not None
+            and now - self.saved_at > self.resume_max_age
+        ):
+            logger.warning(
+                f"Firehose checkpoint from {self.saved_at} is too old,"
+                f" skipping from seq {self.saved_seq} to live"
+            )
+            return None
+        logger.info(f"Resuming firehose after seq {self.saved_seq}")
+        return self.saved_seq
+
+    def observe(self, seq) -> bool:
+        """Record a received commit. False if it's a replay to drop."""
+        if self.skip_replayed and self.seen_seq is not None and seq <= self.seen_seq:
+            self.replayed_commits += 1
+            return False
+        self.seen_seq = seq if self.seen_seq is None else max(self.seen_seq, seq)
+        return True
+
+    def save(self, cur, seq, now=None):
+        """Write the checkpoint; run inside the posts' transaction."""
+        now = now or datetime.now(timezone.utc)
+        cur.upsert_firehose_checkpoint(cur, self.name, seq, now)
+
+    def mark_saved(self, seq, now=None):
+        self.saved_seq = seq
+        self.saved_at = now or datetime.now(timezone.utc)
+
+    def flush_delay(self, post_count, commit_time, seconds_since_flush, now=None):
+        """
+        Seconds to wait before flushing <post_count> posts so catch-up (commits
+        lagging by more than <catchup_lag>) stays under
+        <catchup_max_posts_per_second>. Live commits are never delayed.
+        """
+        if self.catchup_max_posts_per_second is None or commit_time is None:
+            return 0
+        now = now or datetime.now(timezone.utc)
+        if now - commit_time <= self.catchup_lag:
+            return 0
+        return max(
+            post_count / self.catchup_max_posts_per_second - seconds_since_flush, 0
+        )
@@ -0,0 +1,83 @@
+from .constants import (
+    INGEST_EMBEDS,
+    INGEST_LANGS,
+    INGEST_MAX_TEXT_LENGTH,
+    INGEST_MIN_TEXT_LENGTH,
+    INGEST_REPLIES,
+    INGEST_UNTAGGED_LANGS,
+)
+
+
+def get_post_fields(record: dict) -> dict:
+    """
+    The raw posts table fields of an app.bsky.feed.post record.
+
+    post = {
+        "text": "<post_text>",
+        "langs": ["<language_tag>", ...],
+        "is_reply": <bool>,
+        "has_embed": <bool>
+    }
+    """
+    return {
+        "text": record["text"],
+        "langs": list(record.get("langs") or []),
+        "is_reply": record.get("reply") is not None,
+        "has_embed": record.get("embed") is not None,
+    }
+
+
+def make_post(text, langs=None, is_reply=False, has_embed=False) -> dict:
+    """A post (see get_post_fields) from known fields."""
+    return {
+        "text": text,
+        "langs": list(langs or []),
+        "is_reply": is_reply,
+        "has_embed": has_embed,
+    }
+
+
+def _primary_subtag(lang_tag) -> str:
+    """The primary language subtag: "en" for "en", "en-US" or "EN-gb"."""
+    return lang_tag.split("-")[0].lower()
+
+
+def get_post_lang(post: dict):
+    """
+    The primary language of a post's first language tag, or None when
+    untagged. Stored as the raw posts table's indexed lang column.
+    """
+    return _primary_subtag(post["langs"][0]) if post["langs"] else None
+
+
+def passes_ingest_filters(
+    post: dict,
+    langs=INGEST_LANGS,
+    untagged_langs=INGEST_UNTAGGED_LANGS,
+    replies=INGEST_REPLIES,
+    embeds=INGEST_EMBEDS,
+    min_text_length=INGEST_MIN_TEXT_LENGTH,
+    max_text_length=INGEST_MAX_TEXT_LENGTH,
+) -> bool:
+    """
+    Whether a post is stored. A post matches <langs> if any of its language
+    tags, or their primary language ("en" of "en-US"), is in it.
+    """
+    text_length = len(post["text"])
+    if text_length < min_text_length:
+        return False
+    if max_text_length is not None and text_length > max_text_length:
+        return False
+    if not replies and post["is_reply"]:
+        return False
+    if not embeds and post["has_embed"]:
+        return False
+    if langs is not None:
+        if not post["langs"]:
+            return untagged_langs
+        if not any(
+            lang_tag in langs or _primary_subtag(lang_tag) in langs
+            for lang_tag in post["langs"]
+        ):
+            return False
+    return True
@@ -2,7 +2,7 @@ import logging
 import sys
 
 
-from .database import get_connection_and_cursor
+from .db_connection import get_connection_and_cursor
 from .constants import DEBUG, LOGGING_MODEL
 
 
@@ -51,14 +51,21 @@ class LogDBHandler(logging.Handler):
     }
     """
 
-    def __init__(self, table_name):
+    def __init__(self, table_name, connection=None):
+        """
+        connection <optional>: (<con>, <cur>) to log through, whose schema is
+        already bootstrapped, instead of opening a new one
+        """
         try:
             logging.Handler.__init__(self)
-            con, cur = get_connection_and_cursor()
+            if connection is None:
+                con, cur = get_connection_and_cursor()
+                cur.create_table(cur, LOGGING_MODEL)
+            else:
+                con, cur = connection
             self.cur = cur
             self.con = con
             self.table_name = table_name
-            cur.create_table(cur, LOGGING_MODEL)
         except Exception as e:
             logger.critical("ERROR CREATING HANDLER:", e)
             raise
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from .constants import (
+    MODEL_CACHE_CHECK_INTERVAL,
+    MODEL_CACHE_MAX_BYTES,
+    MODEL_CACHE_MAX_MODELS,
+)
+from .logging import set_local_logger
+from .stpo_model import STPOModel
+from .stpo_snapshot import (
+    STPOSnapshot,
+    select_latest_snapshot_id,
+    select_stpo_snapshot,
+)
+
+logger = set_local_logger(__name__)
+
+
+class STPOModelCache:
+    """
+    LRU cache of scoring models (see STPOModel) keyed by stpo_map snapshot
+    id, bounded by model count and memory. The newest snapshot's model is
+    never evicted, however large.
+
+    cache = {
+        <snapshot_id>: {
+            "model": <STPOModel>,
+            "bytes": <model_bytes>
+        },
+        ...
+    }
+    """
+
+    def __init__(
+        self,
+        max_models=MODEL_CACHE_MAX_MODELS,
+        max_bytes=MODEL_CACHE_MAX_BYTES,
+        check_interval=MODEL_CACHE_CHECK_INTERVAL,
+        load_snapshot=select_stpo_snapshot,
+        get_latest_snapshot_id=select_latest_snapshot_id,
+    ):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._load_snapshot = load_snapshot
+        self._get_latest_snapshot_id = get_latest_snapshot_id
+
+        self.cache = OrderedDict()
+        self.latest_snapshot_id = None
+        self._latest_checked_at = None
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self.cache.values())
+
+    def _store(self, snapshot_id, model):
+        """
+        For use with get_model and publish. Caller holds the lock. Evicts
+        least recently used models, sparing the newest snapshot's and the
+        one just stored.
+        """
+        self.cache[snapshot_id] = {"model": model, "bytes": model.nbytes}
+        self.cache.move_to_end(snapshot_id)
+
+        pinned_ids = {snapshot_id, self.latest_snapshot_id}
+        for cached_id in list(self.cache.keys()):
+            if not (
+                len(self.cache) > self.max_models or self.total_bytes > self.max_bytes
+            ):
+                break
+            if cached_id in pinned_ids:
+                continue
+            del self.cache[cached_id]
+            logger.debug(f"Evicted STPO model {cached_id} from cache")
+
+        return model
+
+    def _latest_id(self, cur):
+        """For use with get_model. Caller holds the lock."""
+        now = time.monotonic()
+        is_stale = (
+            self._latest_checked_at is None
+            or now - self._latest_checked_at >= self.check_interval
+        )
+        if is_stale:
+            latest_snapshot_id = self._get_latest_snapshot_id(cur)
+            if latest_snapshot_id is not None:
+                self.latest_snapshot_id = latest_snapshot_id
+            self._latest_checked_at = now
+        return self.latest_snapshot_id
+
+    def get_model(self, cur, snapshot_id=None):
+        """
+        Scoring model for <snapshot_id>, or for the newest snapshot if not
+        given. The newest id is looked up at most once per check_interval
+        seconds, so repeated calls cost a dict lookup.
+        """
+        with self._lock:
+            if snapshot_id is None:
+                snapshot_id = self._latest_id(cur)
+                if snapshot_id is None:
+                    return None
+
+            if snapshot_id in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(snapshot_id)
+                return self.cache[snapshot_id]["model"]
+
+            self.misses += 1
+
+        # Loaded and built outside the lock, so other scorers aren't blocked
+        logger.debug(f"Loading STPO model {snapshot_id}")
+        stpo_map = self._load_snapshot(cur, snapshot_id)
+        if stpo_map is None:
+            return None
+        model = STPOModel.from_stpo_map(stpo_map)
+        if isinstance(stpo_map, STPOSnapshot):
+            stpo_map.close()
+
+        with self._lock:
+            if snapshot_id in self.cache:
+                # Another caller loaded it meanwhile
+                return self.cache[snapshot_id]["model"]
+            return self._store(snapshot_id, model)
+
+    def get_published_model(self):
+        """
+        (snapshot_id, model) for the newest snapshot already in the cache,
+        without touching the database. (None, None) before the first one.
+        """
+        with self._lock:
+            snapshot_id = self.latest_snapshot_id
+            if snapshot_id not in self.cache:
+                return None, None
+            return snapshot_id, self.cache[snapshot_id]["model"]
+
+    def publish(self, snapshot_id, stpo_map):
+        """
+        Called by the snapshot writer after it saves <snapshot_id>, so
+        scorers in this process get the new model without a database read.
+        """
+        model = STPOModel.from_stpo_map(stpo_map)
+        with self._lock:
+            if self.latest_snapshot_id is None or snapshot_id > self.latest_snapshot_id:
+                self.latest_snapshot_id = snapshot_id
+                self._latest_checked_at = time.monotonic()
+            self._store(snapshot_id, model)
+
+
+model_cache = STPOModelCache()
@@ -0,0 +1,273 @@
+from datetime import datetime, timezone
+import os
+import struct
+from threading import Lock
+import time
+
+from .constants import (
+    POST_SPOOL_DIR,
+    POST_SPOOL_MAX_ATTEMPTS,
+    POST_SPOOL_MAX_BYTES,
+    POST_SPOOL_SEGMENT_BYTES,
+)
+from .ingest_filters import make_post
+from .logging import set_local_logger
+
+logger = set_local_logger(__name__)
+
+# Record: <created_at unix seconds (float64)><text length (uint32)>
+# <langs length (uint16)><flags (uint8)><utf-8 text><utf-8 comma-joined langs>
+RECORD_HEADER = struct.Struct("<dIHB")
+SEGMENT_SUFFIX = ".spool"
+DEAD_LETTER_SUFFIX = ".dead"
+IS_REPLY_FLAG = 1
+HAS_EMBED_FLAG = 2
+
+
+def _post_record(post, timestamp) -> bytes:
+    text_bytes = post["text"].encode("utf-8")
+    # The post lexicon allows 3 language tags
+    langs_bytes = ",".join(post["langs"][:3]).encode("utf-8")
+    flags = (IS_REPLY_FLAG if post["is_reply"] else 0) | (
+        HAS_EMBED_FLAG if post["has_embed"] else 0
+    )
+    header = RECORD_HEADER.pack(timestamp, len(text_bytes), len(langs_bytes), flags)
+    return header + text_bytes + langs_bytes
+
+
+def _segment_name(segment_number) -> str:
+    return f"{segment_number:012d}{SEGMENT_SUFFIX}"
+
+
+def read_segment(path) -> tuple:
+    """
+    (posts, created_ats) of every complete record in a segment. A record
+    cut short by a crash mid-write ends the segment.
+    """
+    posts, created_ats = [], []
+    with open(path, "rb") as segment:
+        data = segment.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        timestamp, text_length, langs_length, flags = RECORD_HEADER.unpack_from(
+            data, offset
+        )
+        text_start = offset + RECORD_HEADER.size
+        langs_start = text_start + text_length
+        record_end = langs_start + langs_length
+        if record_end > len(data):
+            logger.warning(f"Truncated record at byte {offset} of {path}")
+            break
+        langs_text = data[langs_start:record_end].decode("utf-8")
+        posts.append(
+            make_post(
+                data[text_start:langs_start].decode("utf-8"),
+                langs=langs_text.split(",") if langs_text else [],
+                is_reply=bool(flags & IS_REPLY_FLAG),
+                has_embed=bool(flags & HAS_EMBED_FLAG),
+            )
+        )
+        created_ats.append(
+            datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+        )
+        offset = record_end
+    return posts, created_ats
+
+
+class PostSpool:
+    """
+    Append-only local log of raw posts the database couldn't take, so an
+    outage or ingest burst doesn't drop them. Posts are appended to the open
+    segment file in <directory>, rolling to a new segment past
+    <segment_bytes>. drain() seals the open segment and bulk-loads segments
+    oldest first, deleting each once it's loaded.
+
+    Disk use is bounded by <max_bytes>: posts past it are dropped and
+    counted. Segments left by a previous run are drained too. Delivery is at
+    least once: a crash between loading a segment and deleting it loads it
+    again.
+
+    Each post keeps the time it was spooled, stored as its created_at, so
+    windows of posts aren't skewed by when the spool drained.
+
+    A segment that fails to load <max_attempts> times is renamed to a
+    DEAD_LETTER_SUFFIX file, kept for inspection but no longer drained or
+    counted towards <max_bytes>, so one bad post can't block the spool.
+    """
+
+    def __init__(
+        self,
+        directory=POST_SPOOL_DIR,
+        segment_bytes=POST_SPOOL_SEGMENT_BYTES,
+        max_bytes=POST_SPOOL_MAX_BYTES,
+        max_attempts=POST_SPOOL_MAX_ATTEMPTS,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_attempts = max_attempts
+        os.makedirs(directory, exist_ok=True)
+
+        # Sealed segments, oldest first: [(<segment_number>, <bytes>), ...]
+        self.segments = []
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(SEGMENT_SUFFIX):
+                segment_number = int(file_name[: -len(SEGMENT_SUFFIX)])
+                segment_bytes = os.path.getsize(os.path.join(directory, file_name))
+                self.segments.append((segment_number, segment_bytes))
+        self.next_segment_number = self.segments[-1][0] + 1 if self.segments else 0
+        self.total_bytes = sum(segment_bytes for _, segment_bytes in self.segments)
+
+        self._open_segment = None
+        self._open_segment_number = None
+        self._open_segment_bytes = 0
+        self._lock = Lock()
+        # Held for a whole drain, so segments load in order
+        self._drain_lock = Lock()
+        # Failed loads per sealed segment: {<segment_number>: <attempts>}
+        self._failed_attempts = {}
+
+        self.spooled_posts = 0
+        self.drained_posts = 0
+        self.dropped_posts = 0
+        self.dead_letter_posts = 0
+        self.last_drain = None
+
+    def __len__(self):
+        """Segments waiting to drain, including the open one."""
+        with self._lock:
+            return len(self.segments) + (self._open_segment is not None)
+
+    def is_empty(self) -> bool:
+        return len(self) == 0
+
+    def _segment_path(self, segment_number) -> str:
+        return os.path.join(self.directory, _segment_name(segment_number))
+
+    def _seal_segment(self):
+        if self._open_segment is None:
+            return
+        self._open_segment.close()
+        self.segments.append((self._open_segment_number, self._open_segment_bytes))
+        self._open_segment = None
+        self._open_segment_number = None
+        self._open_segment_bytes = 0
+
+    def append(self, posts: list, created_at=None) -> int:
+        """
+        Spool posts (see get_post_fields) created at <created_at> (default
+        now). Returns posts kept.
+        """
+        timestamp = (created_at or datetime.now(timezone.utc)).timestamp()
+        records = [_post_record(post, timestamp) for post in posts]
+
+        kept_posts = 0
+        with self._lock:
+            for record in records:
+                if self.total_bytes + len(record) > self.max_bytes:
+                    self.dropped_posts += 1
+                    continue
+                if self._open_segment is None:
+                    self._open_segment_number = self.next_segment_number
+                    self.next_segment_number += 1
+                    self._open_segment = open(
+                        self._segment_path(self._open_segment_number), "ab"
+                    )
+                self._open_segment.write(record)
+                self._open_segment_bytes += len(record)
+                self.total_bytes += len(record)
+                kept_posts += 1
+                if self._open_segment_bytes >= self.segment_bytes:
+                    self._seal_segment()
+            if self._open_segment is not None:
+                self._open_segment.flush()
+            self.spooled_posts += kept_posts
+
+        dropped_posts = len(records) - kept_posts
+        if dropped_posts:
+            logger.warning(f"Post spool full, dropped {dropped_posts} posts")
+        return kept_posts
+
+    def _dead_letter(self, segment_number, segment_bytes, post_count):
+        """For use with drain. Caller holds the drain lock."""
+        path = self._segment_path(segment_number)
+        dead_letter_path = path[: -len(SEGMENT_SUFFIX)] + DEAD_LETTER_SUFFIX
+        os.replace(path, dead_letter_path)
+        with self._lock:
+            self.segments.remove((segment_number, segment_bytes))
+            self.total_bytes -= segment_bytes
+            self.dead_letter_posts += post_count
+        logger.error(
+            f"Post spool segment failed {self.max_attempts} times, "
+            f"{post_count} posts moved to {dead_letter_path}"
+        )
+
+    def drain(self, write_posts, max_segments=None, transient_errors=()) -> int:
+        """
+        Load spooled segments, oldest first, with
+        write_posts(posts, created_ats). Stops at the first failed
+        segment, which stays spooled until it has failed <max_attempts>
+        times; failures from <transient_errors> (a lost connection) don't
+        count. Returns posts drained.
+        """
+        with self._drain_lock:
+            with self._lock:
+                self._seal_segment()
+                segments = list(self.segments[:max_segments])
+
+            start = time.monotonic()
+            drained_posts = 0
+            for segment_number, segment_bytes in segments:
+                path = self._segment_path(segment_number)
+                posts, created_ats = read_segment(path)
+                try:
+                    if posts:
+                        write_posts(posts, created_ats)
+                except transient_errors as e:
+                    logger.warning(f"Could not drain post spool: {e}")
+                    break
+                except Exception as e:
+                    logger.warning(f"Could not drain post spool: {e}")
+                    attempts = self._failed_attempts.get(segment_number, 0) + 1
+                    if attempts < self.max_attempts:
+                        self._failed_attempts[segment_number] = attempts
+                        break
+                    self._failed_attempts.pop(segment_number, None)
+                    self._dead_letter(segment_number, segment_bytes, len(posts))
+                    continue
+                self._failed_attempts.pop(segment_number, None)
+                os.remove(path)
+                with self._lock:
+                    self.segments.remove((segment_number, segment_bytes))
+                    self.total_bytes -= segment_bytes
+                    self.drained_posts += len(posts)
+                drained_posts += len(posts)
+
+            duration = time.monotonic() - start
+            self.last_drain = {
+                "posts": drained_posts,
+                "duration": duration,
+                "rate": drained_posts / duration if duration > 0 else None,
+            }
+        if drained_posts:
+            logger.debug(f"Drained {drained_posts} posts from the post spool")
+        return drained_posts
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "segments": len(self.segments) + (self._open_segment is not None),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "spooled_posts": self.spooled_posts,
+                "drained_posts": self.drained_posts,
+                "dropped_posts": self.dropped_posts,
+                "dead_letter_posts": self.dead_letter_posts,
+                "last_drain_rate": (
+                    self.last_drain["rate"] if self.last_drain else None
+                ),
+            }
+
+    def close(self):
+        with self._lock:
+            self._seal_segment()
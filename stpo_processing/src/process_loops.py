@@ -1,13 +1,51 @@
-import concurrent.futures
 from datetime import datetime, timedelta, timezone
-import json
+import functools
 import time
 
-from src.constants import RAW_POSTS_TABLE_MODEL, STPO_MAP_MODEL
-from src.database import get_connection_and_cursor, PGError
-from src.firehose import FirehoseClient, AtProtocolError
+from src.commit_filter import commit_filter_stats
+from src.constants import (
+    ANALYSIS_INTERVAL,
+    COUNT_POSTS_INTERVAL,
+    DEBUG,
+    FIREHOSE_CHECKPOINT,
+    FIREHOSE_RESTART_DELAY,
+    NORMALIZE_AT_INGEST,
+    PERSIST_FAMILY_INDEX,
+    POST_SPOOL_DRAIN_INTERVAL,
+    PROCESS_POSTS_INTERVAL,
+    PROCESS_POSTS_OVERLAP,
+    RAW_POSTS_TABLE_MODEL,
+    SCORING_BATCH_SIZE,
+    SCORING_ENABLED,
+    SCORING_INTERVAL,
+    SCORING_MAX_BATCHES,
+    STPO_MODE,
+    STPO_SEGMENT,
+    STPO_WINDOWS,
+)
+from src import db_connection
+from src.db_connection import get_connection_and_cursor
+from src.family_index import FamilyIndex
+from src.firehose_checkpoint import FirehoseCheckpoint
 from src.logging import set_local_logger
-from src.raw_post_processing import orchestrate_stpo
+from src.model_cache import model_cache
+from src.raw_post_processing import (
+    NORMALIZER_VERSION,
+    build_post_families,
+    build_weighted_stpo_map,
+    get_post_word_separation,
+    normalize_post,
+    orchestrate_stpo,
+)
+from src.scoring_pool import ScoringPool
+from src.stpo_buckets import STPOBucketStore
+from src.stpo_sketch import SlidingWindowSTPOSketch
+from src.stpo_snapshot import (
+    DeltaSnapshotWriter,
+    STPOSnapshot,
+    select_latest_snapshot_id,
+    select_stpo_snapshot,
+)
 
 logger = set_local_logger(__name__)
 
@@ -15,140 +53,466 @@ logger = set_local_logger(__name__)
 # a systemic issue and/or a runaway loop
 
 
-def package_message_handler():
+def package_message_handler(family_detector=None, post_spool=None):
+    # atproto takes most of startup to import, so only the firehose thread
+    # loads it
+    from src.firehose import AtProtocolError, FirehoseClient
+
     logger.info("Starting message handler")
+    # Outlives each client, so restarts resume where the last client stopped
+    checkpoint = FirehoseCheckpoint() if FIREHOSE_CHECKPOINT else None
     try:
         while True:
+            client = None
             try:
-                client = FirehoseClient()
+                client = FirehoseClient(
+                    family_detector=family_detector,
+                    post_spool=post_spool,
+                    checkpoint=checkpoint,
+                )
                 client.drink_from_firehose()
             except AtProtocolError as e:
                 logger.error("Message Handler error:", e)
                 logger.error("Restarting.")
-            except PGError as e:
+            except db_connection.PGError as e:
                 logger.error("Posgres Error:", e)
                 logger.error("Restarting.")
+            except RuntimeError as e:
+                # No database connection; the checkpoint covers the gap
+                if checkpoint is None:
+                    raise
+                logger.error(f"Could not connect, restarting: {e}")
+                time.sleep(FIREHOSE_RESTART_DELAY)
             finally:
-                client.close_db_connection()
+                if client is not None:
+                    client.close_db_connection()
 
     except Exception as e:
         logger.critical("MESSAGE HANDLER EXCEPTION:", e)
         raise
 
 
-def count_posts():
-    logger.info("Starting post counter")
-    interval = 0.2
-    previous_post_count = 0
-    previous_time = datetime.now(timezone.utc)
-    two_seconds = timedelta(seconds=2)
-    while True:
-        current_time = datetime.now(timezone.utc)
-        loop_interval = current_time - previous_time
-        is_over_two_sec = loop_interval > two_seconds
-        is_new_minute = current_time.second == 0
+class SpoolDrainer:
+    """
+    Scheduled task bulk-loading the post spool into the raw posts table,
+    on its own connection, whenever it holds posts.
+    """
 
-        if is_over_two_sec and is_new_minute:
-            try:
-                con, cur = get_connection_and_cursor()
-                previous_time = datetime.now(timezone.utc)
+    def __init__(self, post_spool):
+        self.post_spool = post_spool
+
+    def __call__(self, scheduled_at=None):
+        if self.post_spool.is_empty():
+            return
+        from src.firehose import insert_post_batch
+
+        try:
+            con, cur = get_connection_and_cursor()
+        except RuntimeError:
+            logger.debug(f"Post spool waiting: {self.post_spool.stats()}")
+            return
+        try:
+            self.post_spool.drain(
+                functools.partial(insert_post_batch, cur),
+                transient_errors=db_connection.CONNECTION_ERRORS,
+            )
+            logger.debug(f"Post spool: {self.post_spool.stats()}")
+        finally:
+            con.close()
+
+
+class PostScorer:
+    """
+    Scheduled task scoring posts stored since the last run in a ScoringPool
+    (see scoring_pool.py), against the newest STPO snapshot. Scores are
+    written back in batches of <batch_size>, at most <max_batches> per run.
+    Starts from the posts stored after it's created.
+    """
+
+    def __init__(
+        self,
+        scoring_pool,
+        batch_size=SCORING_BATCH_SIZE,
+        max_batches=SCORING_MAX_BATCHES,
+    ):
+        self.scoring_pool = scoring_pool
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.last_scored_id = None
+        self.scored_posts = 0
 
-                select_post_num = {
+    def _update_model(self, cur) -> bool:
+        """Publish a newer snapshot to the pool. False if there's none yet."""
+        snapshot_id = select_latest_snapshot_id(cur)
+        if snapshot_id is None:
+            return False
+        if snapshot_id != self.scoring_pool.snapshot_id:
+            stpo_map = select_stpo_snapshot(cur, snapshot_id)
+            self.scoring_pool.publish(snapshot_id, stpo_map)
+            if isinstance(stpo_map, STPOSnapshot):
+                stpo_map.close()
+        return True
+
+    def __call__(self, scheduled_at=None):
+        con, cur = get_connection_and_cursor()
+        try:
+            if self.last_scored_id is None:
+                select_max_id = {
                     "table_name": RAW_POSTS_TABLE_MODEL["name"],
-                    "text": "count(*)",
+                    "text": "coalesce(max(id), 0)",
                 }
-                results = cur.select_from_table(cur, select_post_num)
-                if results:
-                    count = results[0][0]
-                    intermediate_posts = count - previous_post_count
-                    previous_post_count = count
-                    logger.debug(f"Posts in last minute: {intermediate_posts}")
-                    logger.debug(f"Total post count: {count}")
-            except PGError as e:
-                logger.error("Postgres Error. Likely non-critical:", e)
-                logger.error("Restarting.")
-            except Exception as e:
-                logger.critical("Unknown Error counting posts:", e)
-                raise
-            finally:
-                con.close()
+                self.last_scored_id = cur.select_from_table(cur, select_max_id)[0][0]
+            if not self._update_model(cur):
+                return
 
-        time.sleep(interval)
+            for _ in range(self.max_batches):
+                posts = cur.select_posts_after(
+                    cur, self.last_scored_id, self.batch_size
+                )
+                if not posts:
+                    break
+                scores = self.scoring_pool.score([post for _, post in posts])
+                cur.update_post_scores(
+                    cur,
+                    [
+                        (raw_post_id, score)
+                        for (raw_post_id, _), score in zip(posts, scores)
+                    ],
+                    self.scoring_pool.snapshot_id,
+                )
+                self.last_scored_id = posts[-1][0]
+                self.scored_posts += len(posts)
+                if len(posts) < self.batch_size:
+                    break
+            logger.debug(f"Posts scored: {self.scored_posts}")
+        except db_connection.PGError as e:
+            logger.error("Postgres Error scoring posts:", e)
+        finally:
+            con.close()
 
 
-def process_posts():
-    logger.info("Starting post processor")
-    interval = 1
-    previous_time = datetime.now(timezone.utc)
-    two_minutes = timedelta(seconds=120)
+class PostCounter:
+    """Scheduled task logging the posts stored since its last run."""
 
-    while True:
-        # Check if it's a ten and if it's greater than two mins
-        current_time = datetime.now(timezone.utc)
-        loop_interval = current_time - previous_time
-        is_over_two_min = loop_interval > two_minutes
-        is_ten = current_time.minute % 10 == 0
+    def __init__(self):
+        self.previous_post_count = 0
+
+    def __call__(self, scheduled_at):
+        con, cur = get_connection_and_cursor()
+        try:
+            select_post_num = {
+                "table_name": RAW_POSTS_TABLE_MODEL["name"],
+                "text": "count(*)",
+            }
+            results = cur.select_from_table(cur, select_post_num)
+            if results:
+                count = results[0][0]
+                intermediate_posts = count - self.previous_post_count
+                self.previous_post_count = count
+                logger.debug(f"Posts in last minute: {intermediate_posts}")
+                logger.debug(f"Total post count: {count}")
+                logger.debug(f"Commit filter: {commit_filter_stats.stats()}")
+        except db_connection.PGError as e:
+            logger.error("Postgres Error. Likely non-critical:", e)
+        finally:
+            con.close()
+
+
+def _post_selection(since, until=None, segment=None) -> list:
+    """
+    Where clause for posts created in (since, until] and matching every
+    {<column>: <value>} of <segment> (see STPO_SEGMENT).
+    """
+    where = [{"column": "created_at", "operator": ">", "value": since}]
+    if until is not None:
+        where.append({"column": "created_at", "operator": "<=", "value": until})
+    for column, value in (segment or {}).items():
+        where.append({"column": column, "operator": "=", "value": value})
+    return where
+
+
+def select_posts_since(cur, since, until=None, segment=STPO_SEGMENT) -> list:
+    posts_since = {
+        "table_name": RAW_POSTS_TABLE_MODEL["name"],
+        "columns": ["raw_post_text"],
+        "where": _post_selection(since, until, segment),
+    }
+    results = cur.select_from_table(cur, posts_since, verbose=False)
+    return [result[0] for result in results]
+
+
+def select_post_tokens_since(cur, since, until=None, segment=STPO_SEGMENT):
+    """
+    Posts and their stored tokens. Rows normalized by an older (or no)
+    NORMALIZER_VERSION are re-normalized here and updated in place.
+    """
+    posts_since = {
+        "table_name": RAW_POSTS_TABLE_MODEL["name"],
+        "columns": ["id", "raw_post_text", "post_tokens", "normalizer_version"],
+        "where": _post_selection(since, until, segment),
+    }
+    results = cur.select_from_table(cur, posts_since, verbose=False)
+
+    posts = []
+    post_tokens = []
+    stale_post_tokens = []
+    for raw_post_id, post, tokens, normalizer_version in results:
+        if normalizer_version != NORMALIZER_VERSION:
+            tokens = normalize_post(post)
+            stale_post_tokens.append((raw_post_id, tokens))
+        posts.append(post)
+        post_tokens.append(tokens)
+
+    if stale_post_tokens:
+        logger.debug(f"Re-normalizing {len(stale_post_tokens)} posts")
+        cur.update_post_tokens(cur, stale_post_tokens, NORMALIZER_VERSION)
+
+    return posts, post_tokens
+
+
+def build_detected_stpo_map(family_detector):
+    repetitive_posts = family_detector.get_repetitive_posts()
+    logger.debug(f"Number of repetitive posts: {len(repetitive_posts)}")
+    return build_weighted_stpo_map(repetitive_posts)
+
+
+def update_stpo_sketch(stpo_sketch, timed_posts, now):
+    """
+    Count new posts (see select_timed_posts_since) into the sketch, each
+    sketch bucket's posts at their own time, and snapshot its window.
+    """
+    for bucket_time, posts in stpo_sketch.group_by_bucket(timed_posts):
+        repetitive_posts = build_post_families(posts)
+        logger.debug(f"Number of repetitive posts: {len(repetitive_posts)}")
+        stpo_sketch.add_pairs(get_post_word_separation(repetitive_posts), bucket_time)
+    return stpo_sketch.to_stpo_map(now)
+
+
+def select_bucket_posts(cur, start, end):
+    """Posts created in a bucket, as STPOBucketStore.update loads them."""
+    # created_at > start, so nudge start back to include posts exactly on it
+    since = start - timedelta(microseconds=1)
+    until = end - timedelta(microseconds=1)
+    if NORMALIZE_AT_INGEST:
+        return select_post_tokens_since(cur, since, until)
+    return select_posts_since(cur, since, until), None
+
+
+def select_timed_posts_since(cur, since, until=None, segment=STPO_SEGMENT) -> list:
+    """[(<raw_post_text>, <created_at>), ...] in creation order, UTC aware."""
+    posts_since = {
+        "table_name": RAW_POSTS_TABLE_MODEL["name"],
+        "columns": ["raw_post_text", "created_at"],
+        "where": _post_selection(since, until, segment),
+    }
+    results = cur.select_from_table(cur, posts_since, verbose=False)
+    timed_posts = [
+        (post, created_at.replace(tzinfo=created_at.tzinfo or timezone.utc))
+        for post, created_at in results
+    ]
+    return sorted(timed_posts, key=lambda timed_post: timed_post[1])
+
+
+def warm_family_detector(family_detector):
+    """
+    Refill a fresh detector with the posts still inside its window, at
+    their creation times, so they expire when they would have at ingest.
+    """
+    logger.info("Warming family detector")
+    con, cur = get_connection_and_cursor()
+    try:
+        since = datetime.now(timezone.utc) - family_detector.window
+        # Every stored post, as the detector sees them at ingest
+        for post, created_at in select_timed_posts_since(cur, since, segment={}):
+            family_detector.add_post(post, created_at=created_at)
+        logger.info(f"Family detector warmed with {family_detector.post_count} posts")
+    finally:
+        con.close()
+
+
+def load_family_index():
+    """A FamilyIndex holding the families persisted by earlier runs."""
+    family_index = FamilyIndex()
+    con, cur = get_connection_and_cursor()
+    try:
+        family_index.load(cur)
+    finally:
+        con.close()
+    return family_index
+
+
+class PostProcessor:
+    """
+    Scheduled task building and saving one STPO snapshot per run, over the
+    posts of the last <analysis_interval> (or from the family detector or
+    sketch, per the runtime settings).
+
+    Exact builds that keep no state between runs (no family index) run in
+    <build_executor> when given, such as the async runtime's process pool.
+    """
+
+    def __init__(
+        self,
+        family_detector=None,
+        analysis_interval=ANALYSIS_INTERVAL,
+        build_executor=None,
+    ):
+        logger.info("Starting post processor")
+        self.family_detector = family_detector
+        self.analysis_interval = analysis_interval
+        self.build_executor = build_executor
+        if family_detector:
+            warm_family_detector(family_detector)
+        self.family_index = None
+        if PERSIST_FAMILY_INDEX:
+            self.family_index = load_family_index()
+        self.snapshot_writer = DeltaSnapshotWriter()
+        self.stpo_buckets = None
+        if STPO_MODE == "bucketed":
+            self.stpo_buckets = STPOBucketStore(STPO_WINDOWS)
+            # Each window's snapshots are a separate delta chain
+            self.window_writers = {
+                window: DeltaSnapshotWriter() for window in STPO_WINDOWS
+            }
+        self.stpo_sketch = None
+        if STPO_MODE == "approximate":
+            self.stpo_sketch = SlidingWindowSTPOSketch()
+            logger.info(f"STPO sketch memory: {self.stpo_sketch.memory_bytes} bytes")
+            # Posts created up to here are counted; None backfills the window
+            self.sketch_since = None
+
+    def __call__(self, scheduled_at):
+        current_time = scheduled_at
+        analysis_interval = self.analysis_interval
+        logger.info("Begin STPO processing")
+        con, cur = get_connection_and_cursor()
+        try:
+            if self.stpo_buckets:
+                self.save_window_snapshots(cur, current_time)
+                return
+            is_stateless_build = False
+            if self.stpo_sketch:
+                logger.debug("Getting new posts.")
+                since = self.sketch_since or current_time - self.stpo_sketch.window
+                timed_posts = select_timed_posts_since(cur, since, current_time)
+                post_count = len(timed_posts)
+                build_task = [
+                    update_stpo_sketch,
+                    self.stpo_sketch,
+                    timed_posts,
+                    current_time,
+                ]
+            elif self.family_detector:
+                # Families were built at ingest, no posts to fetch
+                post_count = self.family_detector.post_count
+                build_task = [build_detected_stpo_map, self.family_detector]
+            else:
+                since = current_time - analysis_interval
+                post_tokens = None
+                if NORMALIZE_AT_INGEST:
+                    logger.debug("Getting posts and tokens.")
+                    posts, post_tokens = select_post_tokens_since(cur, since)
+                else:
+                    logger.debug("Getting posts.")
+                    posts = select_posts_since(cur, since)
+                post_count = len(posts)
+                is_stateless_build = self.family_index is None
+                build_task = [
+                    functools.partial(
+                        orchestrate_stpo,
+                        posts,
+                        True,
+                        post_tokens=post_tokens,
+                        family_index=self.family_index,
+                        cycle_time=current_time,
+                    )
+                ]
+            logger.debug(f"{post_count} posts retrieved")
+            if not post_count:
+                logger.warning("NO POSTS COMING THROUGH")
+                return
+
+            logger.debug("Building STPO map.")
+            process_start = datetime.now()
+            if self.build_executor is not None and is_stateless_build:
+                stpo_map = self.build_executor.submit(*build_task).result()
+            else:
+                stpo_map = build_task[0](*build_task[1:])
+            if self.stpo_sketch:
+                # The posts are in the sketch now, so a failed save below
+                # leaves them for the next snapshot rather than losing them
+                self.sketch_since = current_time
+            process_interval = datetime.now() - process_start
+            logger.info(f"STPO map built in {process_interval.seconds} seconds")
+
+            if "post" in stpo_map.keys():
+                logger.debug("Word: post")
+                logger.debug(stpo_map[1]["post"])
+
+            snapshot_id = self.snapshot_writer.insert(
+                cur, stpo_map, analysis_interval, current_time
+            )
+            logger.info("STPO snapshot successfully saved.")
+            model_cache.publish(snapshot_id, stpo_map)
+            if self.family_index is not None:
+                self.family_index.save(cur, current_time)
+                logger.debug(f"Family index: {len(self.family_index)} families")
+        except db_connection.PGError as e:
+            logger.error("Postgres Error:", e)
+        finally:
+            con.close()
+
+    def save_window_snapshots(self, cur, current_time):
+        """Bucketed mode: one snapshot per configured window."""
+        process_start = datetime.now()
+        self.stpo_buckets.update(
+            lambda start, end: select_bucket_posts(cur, start, end), current_time
+        )
+        window_maps = self.stpo_buckets.window_maps(current_time)
+        process_interval = datetime.now() - process_start
+        logger.info(f"STPO window maps built in {process_interval.seconds} seconds")
+
+        for window, stpo_map in window_maps.items():
+            if not stpo_map:
+                logger.warning(f"NO POSTS COMING THROUGH for {window} window")
+                continue
+            snapshot_id = self.window_writers[window].insert(
+                cur, stpo_map, window, current_time
+            )
+            logger.info(f"STPO snapshot for {window} window successfully saved.")
+            if window == self.analysis_interval:
+                model_cache.publish(snapshot_id, stpo_map)
 
-        if is_ten and is_over_two_min:
-            try:
-                logger.info("Begin STPO processing")
-                con, cur = get_connection_and_cursor()
-                previous_time = current_time
-                analysis_interval = timedelta(days=1)
-
-                last_day_of_posts = {
-                    "table_name": "raw_post_data",
-                    "columns": ["post_text"],
-                    "where": [
-                        {
-                            "column": "created_at",
-                            "operator": ">",
-                            "value": current_time - analysis_interval,
-                        }
-                    ],
-                }
-                logger.debug("Getting posts.")
-                results = cur.select_from_table(cur, last_day_of_posts, verbose=False)
-                if results:
-                    logger.debug("Building STPO map.")
-                    process_start = datetime.now()
-                    posts = [result[0] for result in results]
-                    logger.debug(f"{len(posts)} posts retrieved")
-                    if not posts:
-                        logger.warning("NO POSTS COMING THROUGH")
-                    else:
-                        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-                        process = executor.submit(orchestrate_stpo, posts, True)
-                        stpo_map = process.result()
-
-                        process_end = datetime.now()
-                        process_interval = process_end - process_start
-                        logger.info(
-                            f"STPO map built in {process_interval.seconds} seconds"
-                        )
-
-                        if "post" in stpo_map.keys():
-                            logger.debug("Word: post")
-                            logger.debug(stpo_map[1]["post"])
-
-                        stpo_json = json.dumps(stpo_map)
-                        table_row = {
-                            "table_name": STPO_MAP_MODEL["name"],
-                            "column_data": [
-                                {"name": "stpo_snapshot", "value": stpo_json},
-                                {
-                                    "name": "snapshot_interval",
-                                    "value": analysis_interval,
-                                },
-                                {"name": "created_at", "value": current_time},
-                            ],
-                        }
-                        cur.insert_into_table(cur, table_row)
-                        logger.info("JSON successfully saved.")
-            except PGError as e:
-                logger.error("Postgres Error:", e)
-                logger.info("Restarting.")
-            finally:
-                con.close()
 
-        time.sleep(interval)
+def schedule_tasks(
+    scheduler, family_detector=None, post_spool=None, build_executor=None
+):
+    """
+    Add every periodic task, per the runtime settings, to <scheduler>.
+    Returns the ScoringPool to close once the scheduler stops, or None.
+    """
+    scheduler.add_task(
+        "process_posts",
+        PostProcessor(family_detector, build_executor=build_executor),
+        PROCESS_POSTS_INTERVAL,
+        overlap=PROCESS_POSTS_OVERLAP,
+    )
+    if post_spool is not None:
+        scheduler.add_task(
+            "drain_post_spool",
+            SpoolDrainer(post_spool),
+            POST_SPOOL_DRAIN_INTERVAL,
+            mode="fixed_delay",
+        )
+    scoring_pool = None
+    if SCORING_ENABLED:
+        scoring_pool = ScoringPool()
+        scheduler.add_task(
+            "score_posts",
+            PostScorer(scoring_pool),
+            SCORING_INTERVAL,
+            mode="fixed_delay",
+        )
+    if DEBUG:
+        scheduler.add_task("count_posts", PostCounter(), COUNT_POSTS_INTERVAL)
+    return scoring_pool
@@ -1,12 +1,19 @@
+from itertools import repeat
 import re
 from time import perf_counter
 
-import nltk
-
+from .constants import DEDUPLICATE_POSTS, SPILL_POST_FAMILIES
+from .family_spill import PostFamilyStore
 from .logging import set_local_logger
+from .stpo_merge import combine_stpo_maps  # noqa: F401 (re-exported)
+from .stpo_pruning import truncate_stpo_map
 
 logger = set_local_logger(__name__)
 
+# Bump whenever format_post's rules change, so tokens stored at ingest are
+# re-normalized (see normalize_post)
+NORMALIZER_VERSION = 1
+
 
 def format_post(
     post, uncommon_consonants="ndthsgngkwh", special_item_signifier="32123"
@@ -55,66 +62,167 @@ def format_post(
     return post_format
 
 
-def combine_post_families(post_family_collection):
+def normalize_post(post) -> list:
+    """Token form of a post, as stored at ingest with NORMALIZER_VERSION."""
+    return format_post(post).split()
+
+
+def deduplicate_posts(posts: list, post_tokens=None):
+    """
+    Collapse duplicate posts, first by exact text and then by normalized
+    tokens, keeping the first occurrence of each.
+
+    returns unique_posts, unique_post_tokens, post_weights
+        post_weights[idx] = <copies_of_unique_posts[idx]>
+    """
+    text_to_idx = {}
+    tokens_to_idx = {}
+    unique_posts = []
+    unique_post_tokens = []
+    post_weights = []
+    for post_idx, post in enumerate(posts):
+        unique_idx = text_to_idx.get(post)
+        if unique_idx is None:
+            if post_tokens is None:
+                post_words = normalize_post(post)
+            else:
+                post_words = post_tokens[post_idx]
+            tokens_key = tuple(post_words)
+            unique_idx = tokens_to_idx.get(tokens_key)
+            if unique_idx is None:
+                unique_idx = len(unique_posts)
+                tokens_to_idx[tokens_key] = unique_idx
+                unique_posts.append(post)
+                unique_post_tokens.append(post_words)
+                post_weights.append(0)
+            text_to_idx[post] = unique_idx
+        post_weights[unique_idx] += 1
+
+    return unique_posts, unique_post_tokens, post_weights
+
+
+def combine_post_families(post_family_collection, weighted=False):
     repetitive_posts = []
+    repetitive_weights = []
     for post_families in post_family_collection:
         for family_name, family_traits in post_families.items():
-            repetitive_posts.append(format_post(family_name).split())
-            repetitive_posts = [*repetitive_posts, *family_traits["posts"]]
+            # The first post is the family name, already normalized
+            repetitive_posts.append(family_traits["posts"][0])
+            repetitive_posts += family_traits["posts"]
+            if weighted:
+                repetitive_weights.append(1)
+                repetitive_weights += family_traits["weights"]
+    if weighted:
+        return repetitive_posts, repetitive_weights
     return repetitive_posts
 
 
 # async def process_single_post(post, post_family_collection, post_families):
 
 
+def get_unique_length_range(unique_words_length, margin=0.01):
+    """Unique word counts a post's family may have, for is_family_match."""
+    if margin > 0:
+        range_cutoff = round(margin * unique_words_length) + 1
+        return range(
+            unique_words_length - range_cutoff,
+            unique_words_length + range_cutoff,
+        )
+    return [unique_words_length]
+
+
+def is_family_match(family_unique_words, unique_post_words, unique_length_range):
+    """A post joins a family when the family contains every unique post word."""
+    if len(family_unique_words) in unique_length_range:
+        overlapping_words = family_unique_words.intersection(unique_post_words)
+        if len(overlapping_words) in unique_length_range:
+            if len(overlapping_words) == len(unique_post_words):
+                return True
+    return False
+
+
 def build_post_families(
-    posts: list, min_length=1, family_cutoff=1000, family_append=100, margin=0.01
+    posts: list,
+    min_length=1,
+    family_cutoff=1000,
+    family_append=100,
+    margin=0.01,
+    post_tokens=None,
+    post_weights=None,
+    family_index=None,
+    family_store=None,
+    cycle_time=None,
 ):
     """
     "family_name": {
         "unique_words": <set_of_unique_words>,
-        "posts": [<list_of_posts>]
+        "posts": [<list_of_posts>],
+        "weights": [<list_of_post_weights>]
     }
+
+    post_tokens <optional>: normalize_post output for each post, to skip
+    normalizing here
+    post_weights <optional>: copies of each post (see deduplicate_posts).
+    When given, returns repetitive_posts, repetitive_weights
+    family_index <optional>: FamilyIndex of earlier cycles' families, matched
+    before this cycle's families and updated with them, as seen at
+    <cycle_time> (default now)
+    family_store <optional>: PostFamilyStore to collect the families in. When
+    given, it is returned instead of the combined posts, for streaming with
+    family_store.iter_members()
     """
-    post_family_collection = []
+    post_family_collection = [] if family_store is None else family_store
     post_families = {}
-    for post in posts:
-        post_format = format_post(post)
-        post_words = post_format.split()
+    for post_idx, post in enumerate(posts):
+        if post_tokens is None:
+            post_words = normalize_post(post)
+        else:
+            post_words = post_tokens[post_idx]
         post_words_length = len(post_words)
         if post_words_length > min_length:
             unique_post_words = set(post_words)
             unique_words_length = len(unique_post_words)
             family_name = post
-            if margin > 0:
-                range_cutoff = round(margin * unique_words_length) + 1
-                unique_length_range = range(
-                    unique_words_length - range_cutoff,
-                    unique_words_length + range_cutoff,
-                )
+            indexed_family_name = None
+            if family_index is not None:
+                indexed_family_name = family_index.match(unique_post_words)
+            if indexed_family_name is not None:
+                family_name = indexed_family_name
+                if family_name not in post_families.keys():
+                    post_families[family_name] = {
+                        "unique_words": family_index.families[family_name][
+                            "unique_words"
+                        ],
+                        "posts": [],
+                        "weights": [],
+                    }
             else:
-                unique_length_range = [unique_words_length]
-            for post_family_name, family_traits in post_families.items():
-                if len(family_traits["unique_words"]) in unique_length_range:
-                    overlapping_words = family_traits["unique_words"].intersection(
-                        unique_post_words
-                    )
-                    if len(overlapping_words) in unique_length_range:
-                        if len(overlapping_words) == len(unique_post_words):
-                            family_name = post_family_name
-                            break
+                unique_length_range = get_unique_length_range(
+                    unique_words_length, margin
+                )
+                for post_family_name, family_traits in post_families.items():
+                    if is_family_match(
+                        family_traits["unique_words"],
+                        unique_post_words,
+                        unique_length_range,
+                    ):
+                        family_name = post_family_name
+                        break
+            post_weight = 1 if post_weights is None else post_weights[post_idx]
             if family_name in post_families.keys():
                 post_families[family_name]["posts"].append(post_words)
+                post_families[family_name]["weights"].append(post_weight)
             else:
                 post_families[family_name] = {
                     "unique_words": unique_post_words,
                     "posts": [post_words],
+                    "weights": [post_weight],
                 }
 
             if len(post_families.keys()) > family_cutoff:
                 trimmed_post_families = {}
                 for post_family, family_traits in post_families.items():
-                    if len(family_traits["posts"]) > 1:
+                    if sum(family_traits["weights"]) > 1:
                         trimmed_post_families[post_family] = family_traits
                 if len(trimmed_post_families.keys()) > family_append:
                     post_family_collection.append(trimmed_post_families)
@@ -123,9 +231,12 @@ def build_post_families(
                     post_families = trimmed_post_families
     post_family_collection.append(post_families)
 
-    repetitive_posts = combine_post_families(post_family_collection)
+    if family_index is not None:
+        family_index.update(post_family_collection, now=cycle_time)
 
-    return repetitive_posts
+    if family_store is not None:
+        return family_store
+    return combine_post_families(post_family_collection, post_weights is not None)
 
 
 def get_post_word_separation(posts, verbose=False):
@@ -146,7 +257,23 @@ def get_post_word_separation(posts, verbose=False):
     return separation_indexed_word_pairs
 
 
-def build_stpo_map(separation_idexed_post_words, max_separation=20):
+def add_post_pairs(stpo_map, post_words, weight=1, max_separation=20):
+    """Count <weight> copies of a post's word pairs into <stpo_map>, in place."""
+    post_len = len(post_words)
+    for first_idx, first_word in enumerate(post_words):
+        for second_idx in range(
+            first_idx + 1, min(post_len, first_idx + max_separation)
+        ):
+            second_words = stpo_map.setdefault(second_idx - first_idx, {}).setdefault(
+                first_word, {}
+            )
+            second_word = post_words[second_idx]
+            second_words[second_word] = second_words.get(second_word, 0) + weight
+
+
+def build_stpo_map(
+    separation_idexed_post_words, max_separation=20, pair_weights=None, stpo_map=None
+):
     """
     Separation to Pair Occurrences Map (STPO Map)
 
@@ -162,67 +289,115 @@ def build_stpo_map(separation_idexed_post_words, max_separation=20):
         {...},
         ...
     }
+
+    pair_weights <optional>: occurrences to count for each pair (default 1)
+    stpo_map <optional>: existing map to count into, in place
     """
-    separation_to_pair_occurrences = {}
-    for separation, first_word, second_word in separation_idexed_post_words:
+    separation_to_pair_occurrences = {} if stpo_map is None else stpo_map
+    if pair_weights is None:
+        pair_weights = repeat(1)
+    for (separation, first_word, second_word), weight in zip(
+        separation_idexed_post_words, pair_weights
+    ):
         if separation < max_separation:
-            if separation not in separation_to_pair_occurrences.keys():
-                separation_to_pair_occurrences[separation] = {
-                    first_word: {second_word: 1}
-                }
-            elif first_word not in separation_to_pair_occurrences[separation].keys():
-                separation_to_pair_occurrences[separation][first_word] = {
-                    second_word: 1
-                }
-            elif (
-                second_word
-                not in separation_to_pair_occurrences[separation][first_word].keys()
-            ):
-                separation_to_pair_occurrences[separation][first_word][second_word] = 1
-            else:
-                separation_to_pair_occurrences[separation][first_word][second_word] += 1
+            second_words = separation_to_pair_occurrences.setdefault(
+                separation, {}
+            ).setdefault(first_word, {})
+            second_words[second_word] = second_words.get(second_word, 0) + weight
 
     return separation_to_pair_occurrences
 
 
-def combine_stpo_maps(stpo_maps: list) -> dict:
+def build_weighted_stpo_map(posts, post_weights=None, max_separation=20, stpo_map=None):
     """
-    Combine list of stpo maps into single stpo map
+    build_stpo_map(get_post_word_separation(posts)) where post_weights[idx]
+    copies of posts[idx] are counted without expanding their pairs.
+
+    stpo_map <optional>: existing map to count into, in place
+    """
+    separation_to_pair_occurrences = {} if stpo_map is None else stpo_map
+    if post_weights is None:
+        post_weights = repeat(1)
+    for post_words, post_weight in zip(posts, post_weights):
+        add_post_pairs(
+            separation_to_pair_occurrences, post_words, post_weight, max_separation
+        )
+
+    return separation_to_pair_occurrences
+
+
+def orchestrate_stpo(
+    posts,
+    verbose=False,
+    post_tokens=None,
+    deduplicate=DEDUPLICATE_POSTS,
+    family_index=None,
+    prune=False,
+    spill=SPILL_POST_FAMILIES,
+    cycle_time=None,
+):
+    """
+    cycle_time: when the family index sees this cycle's families
+    prune: truncate the map's long tail with the STPO_PRUNE_* settings (see
+    truncate_stpo_map). Snapshot writers also prune, so this only matters
+    for maps that aren't saved.
+    spill: collect families in a memory-bounded PostFamilyStore and count
+    their pairs as they are read back
     """
-    super_stpo_map = {}
-    for stpo_map in stpo_maps:
-        for sep, first_words in stpo_map.items():
-            if sep not in super_stpo_map.keys():
-                super_stpo_map[sep] = first_words
-            else:
-                for first_word, second_words in first_words:
-                    if first_word not in super_stpo_map[sep].keys():
-                        super_stpo_map[sep][first_word] = second_words
-                    else:
-                        for second_word, occ in second_words.items():
-                            if (
-                                second_word
-                                not in super_stpo_map[sep][first_word].keys()
-                            ):
-                                super_stpo_map[sep][first_word][second_word] = occ
-                            else:
-                                super_stpo_map[sep][first_word][second_word] += occ
-
-    return super_stpo_map
-
-
-def orchestrate_stpo(posts, verbose=False):
     if verbose:
         logger.debug(f"Number of posts: {len(posts)}")
-    repetitive_posts = build_post_families(posts)
-    if verbose:
-        logger.debug(f"Number of repetitive posts: {len(repetitive_posts)}")
-    separation_indexed_word_pairs = get_post_word_separation(repetitive_posts)
-    stpo_map = build_stpo_map(separation_indexed_word_pairs)
+    post_weights = None
+    if deduplicate:
+        posts, post_tokens, post_weights = deduplicate_posts(posts, post_tokens)
+        if verbose:
+            logger.debug(f"Number of unique posts: {len(posts)}")
+
+    if spill:
+        stpo_map = {}
+        with PostFamilyStore() as family_store:
+            build_post_families(
+                posts,
+                post_tokens=post_tokens,
+                post_weights=post_weights,
+                family_index=family_index,
+                family_store=family_store,
+                cycle_time=cycle_time,
+            )
+            if verbose:
+                logger.debug(
+                    f"Family chunks spilled: {family_store.spilled_chunks}"
+                    f" of {len(family_store)}"
+                )
+            for post_words, post_weight in family_store.iter_members():
+                add_post_pairs(stpo_map, post_words, post_weight)
+    elif deduplicate:
+        repetitive_posts, repetitive_weights = build_post_families(
+            posts,
+            post_tokens=post_tokens,
+            post_weights=post_weights,
+            family_index=family_index,
+            cycle_time=cycle_time,
+        )
+        stpo_map = build_weighted_stpo_map(repetitive_posts, repetitive_weights)
+    else:
+        repetitive_posts = build_post_families(
+            posts,
+            post_tokens=post_tokens,
+            family_index=family_index,
+            cycle_time=cycle_time,
+        )
+        if verbose:
+            logger.debug(f"Number of repetitive posts: {len(repetitive_posts)}")
+        stpo_map = build_weighted_stpo_map(repetitive_posts)
+    if prune:
+        truncate_stpo_map(stpo_map)
     return stpo_map
 
 
 def pairs_to_cfdist_map(separation_idexed_post_words):
+    # nltk is slow to import and only these reference models use it
+    import nltk
+
     separation_to_cfdist = {}
     for separation, first_word, second_word in separation_idexed_post_words:
         if separation not in separation_to_cfdist.keys():
@@ -234,6 +409,13 @@ def pairs_to_cfdist_map(separation_idexed_post_words):
 
 
 def stpo_map_to_cfdist_map(separation_to_pair_occurrences):
+    """
+    The nltk ConditionalFreqDist form of an STPO map. Scoring uses the
+    flat STPOModel (see stpo_model.py); this remains the reference model
+    for tests and benchmarks.
+    """
+    import nltk
+
     separation_to_cfdist = {}
     for separation, first_words in separation_to_pair_occurrences.items():
         if separation not in separation_to_cfdist.keys():
@@ -245,9 +427,11 @@ def stpo_map_to_cfdist_map(separation_to_pair_occurrences):
     return separation_to_cfdist
 
 
-def get_post_score(post, separation_to_cfdist, verbose=False, very_verbose=False):
-    post_format = format_post(post)
-    post_words = post_format.split()
+def get_post_score(
+    post, separation_to_cfdist, verbose=False, very_verbose=False, post_words=None
+):
+    if post_words is None:
+        post_words = normalize_post(post)
     if verbose or very_verbose:
         print(post_words)
     post_len = len(post_words)
@@ -0,0 +1,229 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+import time
+
+from .logging import set_local_logger
+
+logger = set_local_logger(__name__)
+
+SCHEDULE_MODES = ["fixed_rate", "fixed_delay"]
+OVERLAP_POLICIES = ["skip", "queue", "cancel"]
+
+
+def next_tick(interval: timedelta, now=None) -> datetime:
+    """The next multiple of <interval> since the epoch (UTC) after <now>."""
+    now = now or datetime.now(timezone.utc)
+    interval_seconds = interval.total_seconds()
+    elapsed = now.timestamp() % interval_seconds
+    return now + timedelta(seconds=interval_seconds - elapsed)
+
+
+class ScheduledTask:
+    """
+    A periodic task and its run history.
+
+    mode:
+        "fixed_rate": run at every multiple of <interval> since the epoch
+            (10 minute tasks run at :00, :10, ...), however long runs take
+        "fixed_delay": wait <interval> after each run ends before the next
+    overlap (fixed_rate only), when a run is due while the last still runs:
+        "skip": record the due run as missed
+        "queue": start it as soon as the last run ends (at most one queued)
+        "cancel": set the last run's cancel_event and start anyway; the
+            task function is called with cancel_event=<threading.Event> and
+            should stop when it is set
+
+    The task function is called with the run's scheduled time. Each run is
+    recorded as:
+        run = {
+            "scheduled_at": <datetime>,
+            "started_at": <datetime>,
+            "lag": <seconds_started_late>,
+            "duration": <seconds>,
+            "status": "ok" | "error" | "cancelled"
+        }
+    """
+
+    def __init__(
+        self, name, function, interval, mode="fixed_rate", overlap="skip", history=100
+    ):
+        if mode not in SCHEDULE_MODES:
+            raise ValueError(f"Unknown schedule mode: {mode}")
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError(f"Unknown overlap policy: {overlap}")
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.mode = mode
+        self.overlap = overlap
+
+        self.runs = deque(maxlen=history)
+        self.missed_runs = 0
+        self.active_runs = 0
+        self.queued_run = None
+        self._cancel_events = []
+        self._lock = Lock()
+
+    @property
+    def last_run(self):
+        return self.runs[-1] if self.runs else None
+
+    def run(self, scheduled_at):
+        """Run the task function once, recording the run."""
+        cancel_event = None
+        kwargs = {}
+        if self.overlap == "cancel":
+            cancel_event = kwargs["cancel_event"] = Event()
+            with self._lock:
+                self._cancel_events.append(cancel_event)
+
+        started_at = datetime.now(timezone.utc)
+        start = time.monotonic()
+        status = "ok"
+        try:
+            self.function(scheduled_at, **kwargs)
+        except Exception as e:
+            status = "error"
+            logger.error(f"Scheduled task {self.name} failed:", e)
+        if cancel_event is not None:
+            with self._lock:
+                self._cancel_events.remove(cancel_event)
+            if cancel_event.is_set():
+                status = "cancelled"
+
+        run = {
+            "scheduled_at": scheduled_at,
+            "started_at": started_at,
+            "lag": (started_at - scheduled_at).total_seconds(),
+            "duration": time.monotonic() - start,
+            "status": status,
+        }
+        self.runs.append(run)
+        logger.debug(
+            f"{self.name} {status} in {run['duration']:.1f} seconds"
+            f" (lag {run['lag']:.1f} seconds)"
+        )
+        return run
+
+    def _run_in_thread(self, scheduled_at):
+        with self._lock:
+            self.active_runs += 1
+        try:
+            self.run(scheduled_at)
+            while True:
+                with self._lock:
+                    scheduled_at = self.queued_run
+                    self.queued_run = None
+                if scheduled_at is None:
+                    break
+                self.run(scheduled_at)
+        finally:
+            with self._lock:
+                self.active_runs -= 1
+
+    def dispatch(self, scheduled_at):
+        """Start a fixed-rate run due at <scheduled_at>, following <overlap>."""
+        with self._lock:
+            is_running = self.active_runs > 0
+            if is_running and self.overlap == "skip":
+                self.missed_runs += 1
+                logger.warning(f"{self.name} still running, skipped a run")
+                return
+            if is_running and self.overlap == "queue":
+                if self.queued_run is not None:
+                    self.missed_runs += 1
+                    logger.warning(f"{self.name} still running, skipped a run")
+                self.queued_run = scheduled_at
+                return
+            if is_running and self.overlap == "cancel":
+                logger.warning(f"{self.name} still running, cancelling it")
+                for cancel_event in self._cancel_events:
+                    cancel_event.set()
+        Thread(
+            target=self._run_in_thread,
+            args=[scheduled_at],
+            name=f"{self.name}-run",
+            daemon=True,
+        ).start()
+
+    def stats(self) -> dict:
+        last_run = self.last_run
+        return {
+            "name": self.name,
+            "runs": len(self.runs),
+            "missed_runs": self.missed_runs,
+            "is_running": self.active_runs > 0,
+            "last_duration": last_run["duration"] if last_run else None,
+            "last_lag": last_run["lag"] if last_run else None,
+            "last_status": last_run["status"] if last_run else None,
+        }
+
+
+class Scheduler:
+    """
+    Runs ScheduledTasks, each timed by its own thread so a slow task never
+    delays another.
+
+        scheduler = Scheduler()
+        scheduler.add_task("process_posts", process, timedelta(minutes=10))
+        scheduler.run()  # until stop()
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self._stopping = Event()
+        self._threads = []
+
+    def add_task(self, name, function, interval, **task_options) -> ScheduledTask:
+        task = ScheduledTask(name, function, interval, **task_options)
+        self.tasks[name] = task
+        return task
+
+    def _run_fixed_rate(self, task):
+        scheduled_at = next_tick(task.interval)
+        while True:
+            wait = (scheduled_at - datetime.now(timezone.utc)).total_seconds()
+            if self._stopping.wait(max(wait, 0)):
+                return
+            task.dispatch(scheduled_at)
+
+            # Next tick from the schedule, not the clock, so timing never
+            # drifts. Ticks already past (a suspended host) count as missed.
+            scheduled_at += task.interval
+            now = datetime.now(timezone.utc)
+            if scheduled_at <= now:
+                missed_runs = int((now - scheduled_at) / task.interval) + 1
+                task.missed_runs += missed_runs
+                logger.warning(f"{task.name} missed {missed_runs} runs")
+                scheduled_at = next_tick(task.interval, now)
+
+    def _run_fixed_delay(self, task):
+        while not self._stopping.wait(task.interval.total_seconds()):
+            task.run(datetime.now(timezone.utc))
+
+    def start(self):
+        for task in self.tasks.values():
+            target = (
+                self._run_fixed_rate
+                if task.mode == "fixed_rate"
+                else self._run_fixed_delay
+            )
+            thread = Thread(target=target, args=[task], name=task.name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop scheduling new runs. Runs already started finish on their own."""
+        self._stopping.set()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def run(self):
+        self.start()
+        self.join()
+
+    def stats(self) -> list:
+        return [task.stats() for task in self.tasks.values()]
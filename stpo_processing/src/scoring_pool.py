@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from time import perf_counter
+
+from .constants import SCORING_CHUNK_SIZE, SCORING_WORKERS
+from .logging import set_local_logger
+from .raw_post_processing import get_post_score, stpo_map_to_cfdist_map
+from .stpo_model import SharedModelPublisher, SharedModelReader
+
+logger = set_local_logger(__name__)
+
+
+# Each worker process's reader of the pool's published models
+_model_reader = None
+
+
+def _init_worker(model_name):
+    global _model_reader
+    _model_reader = SharedModelReader(model_name)
+
+
+def _score_chunk(posts) -> list:
+    model = _model_reader.get()
+    return [get_post_score(post, model) for post in posts]
+
+
+class ScoringPool:
+    """
+    Scores posts with get_post_score across <workers> processes (None uses
+    every core), <chunk_size> posts per task.
+
+    The model is published once into shared memory as a flat STPOModel
+    (see stpo_model.py), which every worker maps in place, so tasks carry
+    only post text. A worker swaps to a newly published model on its next
+    task, when it sees the model generation change.
+    """
+
+    def __init__(self, workers=SCORING_WORKERS, chunk_size=SCORING_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.publisher = SharedModelPublisher()
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.publisher.name,),
+        )
+        self.workers = workers or os.cpu_count()
+        self.snapshot_id = None
+
+    def publish(self, snapshot_id, stpo_map):
+        """Publish <stpo_map> as the model workers score with from now on."""
+        generation = self.publisher.publish(stpo_map)
+        self.snapshot_id = snapshot_id
+        logger.info(
+            f"Scoring model {snapshot_id} published to {self.workers} workers"
+            f" as generation {generation}"
+        )
+
+    def score(self, posts: list) -> list:
+        """Scores of <posts>, in order."""
+        if self.snapshot_id is None:
+            raise RuntimeError("No scoring model published.")
+        chunks = [
+            posts[chunk_start : chunk_start + self.chunk_size]
+            for chunk_start in range(0, len(posts), self.chunk_size)
+        ]
+        scores = []
+        for chunk_scores in self.executor.map(_score_chunk, chunks):
+            scores += chunk_scores
+        return scores
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.publisher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Performance testing tool
+def benchmark_scoring(
+    posts,
+    stpo_map,
+    worker_counts=(1, 2, 4),
+    chunk_size=SCORING_CHUNK_SIZE,
+):
+    """
+    Posts scored per second in this process (workers 0, the cfdist model)
+    and by a ScoringPool of each size in <worker_counts>. Pool start-up and
+    each worker's first model mapping are excluded.
+    """
+    results = []
+
+    model = stpo_map_to_cfdist_map(stpo_map)
+    start_time = perf_counter()
+    for post in posts:
+        get_post_score(post, model)
+    results.append({"workers": 0, "seconds": perf_counter() - start_time})
+
+    for workers in worker_counts:
+        with ScoringPool(workers, chunk_size) as scoring_pool:
+            scoring_pool.publish("benchmark", stpo_map)
+            # Warm up: start every worker and map the model
+            scoring_pool.score(posts[: chunk_size * workers])
+            start_time = perf_counter()
+            scoring_pool.score(posts)
+            results.append({"workers": workers, "seconds": perf_counter() - start_time})
+
+    for result in results:
+        result["posts"] = len(posts)
+        result["posts_per_second"] = round(len(posts) / result["seconds"])
+        logger.debug(
+            f"Workers: {result['workers']},"
+            f" posts per second: {result['posts_per_second']}"
+        )
+    return results
@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+
+from .constants import STPO_BUCKET_DURATION, STPO_WINDOWS
+from .logging import set_local_logger
+from .raw_post_processing import orchestrate_stpo
+from .stpo_merge import merge_stpo_map
+
+logger = set_local_logger(__name__)
+
+
+class STPOBucketStore:
+    """
+    Partial STPO maps over fixed <bucket_duration> buckets of posts, shared
+    by every window in <windows>, so a window's map is a merge of buckets
+    rather than a rebuild over all of its posts. Families are found within
+    each bucket.
+
+    Ended buckets are built only once; only the open bucket is rebuilt
+    every update. Buckets older than the longest window are dropped.
+
+    buckets = {
+        <bucket_start>: {
+            "stpo_map": <partial_stpo_map>,
+            "is_complete": <bool>
+        },
+        ...
+    }
+    """
+
+    def __init__(
+        self,
+        windows=STPO_WINDOWS,
+        bucket_duration=STPO_BUCKET_DURATION,
+        build_stpo_map=orchestrate_stpo,
+    ):
+        self.windows = sorted(windows)
+        self.bucket_duration = bucket_duration
+        self.build_stpo_map = build_stpo_map
+        self.buckets = {}
+
+    def _bucket_start(self, time):
+        bucket_seconds = self.bucket_duration.total_seconds()
+        timestamp = time.timestamp() // bucket_seconds * bucket_seconds
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+
+    def _window_bucket_starts(self, window, now):
+        """
+        Starts of the buckets from the one holding <now> - <window> up to
+        and including the open one at <now>, so the window is never short.
+        """
+        open_bucket_start = self._bucket_start(now)
+        oldest_bucket_start = self._bucket_start(now - window)
+        bucket_count = (
+            open_bucket_start - oldest_bucket_start
+        ) // self.bucket_duration + 1
+        return [
+            open_bucket_start - bucket_idx * self.bucket_duration
+            for bucket_idx in reversed(range(bucket_count))
+        ]
+
+    def update(self, load_posts, now=None):
+        """
+        Build any missing or open buckets, and drop expired ones.
+
+        load_posts(start, end) returns the posts created in [start, end) as
+        (posts, post_tokens), with post_tokens None when not stored.
+        """
+        now = now or datetime.now(timezone.utc)
+        bucket_starts = self._window_bucket_starts(self.windows[-1], now)
+        for bucket_start in list(self.buckets.keys()):
+            if bucket_start < bucket_starts[0]:
+                del self.buckets[bucket_start]
+
+        built_buckets = 0
+        for bucket_start in bucket_starts:
+            bucket = self.buckets.get(bucket_start)
+            if bucket is not None and bucket["is_complete"]:
+                continue
+            bucket_end = bucket_start + self.bucket_duration
+            posts, post_tokens = load_posts(bucket_start, bucket_end)
+            self.buckets[bucket_start] = {
+                "stpo_map": (
+                    self.build_stpo_map(posts, post_tokens=post_tokens) if posts else {}
+                ),
+                "is_complete": bucket_end <= now,
+            }
+            built_buckets += 1
+        logger.debug(f"Built {built_buckets} of {len(bucket_starts)} STPO buckets")
+
+    def window_map(self, window, now=None) -> dict:
+        """
+        STPO map of the <window> before <now>, extended back to the start of
+        its oldest bucket.
+        """
+        now = now or datetime.now(timezone.utc)
+        stpo_map = {}
+        for bucket_start in self._window_bucket_starts(window, now):
+            bucket = self.buckets.get(bucket_start)
+            if bucket is not None:
+                merge_stpo_map(stpo_map, bucket["stpo_map"])
+        return stpo_map
+
+    def window_maps(self, now=None) -> dict:
+        """{<window>: <stpo_map>} for every configured window."""
+        return {window: self.window_map(window, now) for window in self.windows}
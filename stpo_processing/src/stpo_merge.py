@@ -0,0 +1,199 @@
+from array import array
+
+from .logging import set_local_logger
+from .stpo_snapshot import STPOSnapshot, sorted_pairs_to_bytes
+
+logger = set_local_logger(__name__)
+
+
+def merge_stpo_map(target: dict, source, sign=1, min_count=1) -> dict:
+    """
+    Add (sign=1) or subtract (sign=-1) the counts of <source> into <target>
+    in place. Pairs left below <min_count> are removed, along with any rows
+    and separations they leave empty. <source> is never aliased or changed,
+    and may be an STPO map or an STPOSnapshot.
+    """
+    for separation, first_words in source.items():
+        target_first_words = target.get(separation)
+        if target_first_words is None:
+            if sign < 0:
+                continue
+            target_first_words = target[separation] = {}
+        for first_word, second_words in first_words.items():
+            target_second_words = target_first_words.get(first_word)
+            if target_second_words is None:
+                if sign < 0:
+                    continue
+                target_second_words = target_first_words[first_word] = {}
+            for second_word, occurrences in second_words.items():
+                occurrences = target_second_words.get(second_word, 0) + (
+                    sign * occurrences
+                )
+                if occurrences >= min_count:
+                    target_second_words[second_word] = occurrences
+                else:
+                    target_second_words.pop(second_word, None)
+            if not target_second_words:
+                del target_first_words[first_word]
+        if not target_first_words:
+            del target[separation]
+
+    return target
+
+
+def subtract_stpo_map(target: dict, source, min_count=1) -> dict:
+    """Remove the counts of <source> (e.g. an expired window) from <target>."""
+    return merge_stpo_map(target, source, sign=-1, min_count=min_count)
+
+
+def prune_stpo_map(stpo_map: dict, min_count) -> dict:
+    """Drop pairs counted fewer than <min_count> times, in place."""
+    for separation in list(stpo_map.keys()):
+        first_words = stpo_map[separation]
+        for first_word in list(first_words.keys()):
+            second_words = first_words[first_word]
+            for second_word in [
+                second_word
+                for second_word, occurrences in second_words.items()
+                if occurrences < min_count
+            ]:
+                del second_words[second_word]
+            if not second_words:
+                del first_words[first_word]
+        if not first_words:
+            del stpo_map[separation]
+
+    return stpo_map
+
+
+def combine_stpo_maps(stpo_maps: list, min_count=1) -> dict:
+    """
+    Combine list of stpo maps into single stpo map. The inputs are left
+    untouched.
+    """
+    super_stpo_map = {}
+    for stpo_map in stpo_maps:
+        merge_stpo_map(super_stpo_map, stpo_map)
+    if min_count > 1:
+        prune_stpo_map(super_stpo_map, min_count)
+    return super_stpo_map
+
+
+def _merge_two_sorted(left, right):
+    """
+    Merge two ascending streams of (key, occurrences), summing equal keys.
+    """
+    left = iter(left)
+    right = iter(right)
+    left_item = next(left, None)
+    right_item = next(right, None)
+    while left_item is not None and right_item is not None:
+        if left_item[0] < right_item[0]:
+            yield left_item
+            left_item = next(left, None)
+        elif right_item[0] < left_item[0]:
+            yield right_item
+            right_item = next(right, None)
+        else:
+            yield left_item[0], left_item[1] + right_item[1]
+            left_item = next(left, None)
+            right_item = next(right, None)
+    if left_item is not None:
+        yield left_item
+        yield from left
+    if right_item is not None:
+        yield right_item
+        yield from right
+
+
+def merge_sorted_pairs(sorted_streams: list):
+    """
+    k-way merge of ascending (key, occurrences) streams, summing equal keys.
+    Streams are merged pairwise in a balanced tree, so every item passes
+    through about log2(k) two-way merges and no heap is needed.
+    """
+    sorted_streams = list(sorted_streams)
+    if not sorted_streams:
+        return iter([])
+    while len(sorted_streams) > 1:
+        merged_streams = [
+            _merge_two_sorted(sorted_streams[idx], sorted_streams[idx + 1])
+            for idx in range(0, len(sorted_streams) - 1, 2)
+        ]
+        if len(sorted_streams) % 2:
+            merged_streams.append(sorted_streams[-1])
+        sorted_streams = merged_streams
+    return iter(sorted_streams[0])
+
+
+def _merge_vocabularies(vocabularies: list):
+    """Sorted union of sorted vocabularies, and each one's old -> new word ids."""
+    merged_vocabulary = [
+        word
+        for word, _ in merge_sorted_pairs(
+            [((word, 0) for word in vocabulary) for vocabulary in vocabularies]
+        )
+    ]
+
+    word_id_maps = []
+    for vocabulary in vocabularies:
+        word_id_map = array("I")
+        merged_idx = 0
+        for word in vocabulary:
+            while merged_vocabulary[merged_idx] != word:
+                merged_idx += 1
+            word_id_map.append(merged_idx)
+        word_id_maps.append(word_id_map)
+    return merged_vocabulary, word_id_maps
+
+
+def _snapshot_sorted_pairs(snapshot: STPOSnapshot, word_id_map, sign=1):
+    """
+    A snapshot's pairs as ascending ((separation, first_word_id,
+    second_word_id), occurrences), with word ids remapped by <word_id_map>.
+    The map is monotonic, so remapping keeps the order.
+    """
+    for separation in sorted(snapshot.keys()):
+        separation_view = snapshot[separation]
+        pair_offsets = separation_view.pair_offsets
+        second_word_ids = separation_view.second_word_ids
+        counts = separation_view.counts
+        for row_idx, first_word_id in enumerate(separation_view.first_word_ids):
+            first_word_id = word_id_map[first_word_id]
+            for pair_idx in range(pair_offsets[row_idx], pair_offsets[row_idx + 1]):
+                yield (
+                    separation,
+                    first_word_id,
+                    word_id_map[second_word_ids[pair_idx]],
+                ), sign * counts[pair_idx]
+
+
+def merge_stpo_snapshots(snapshots: list, signs=None, min_count=1) -> bytes:
+    """
+    Merge binary snapshots (STPOSnapshot, or their bytes) into a new binary
+    snapshot with sorted-key merges over their count arrays, never building
+    an STPO map. signs[idx] = -1 subtracts snapshots[idx] instead of adding
+    it. Pairs left below <min_count> are dropped.
+    """
+    snapshots = [
+        snapshot if isinstance(snapshot, STPOSnapshot) else STPOSnapshot(snapshot)
+        for snapshot in snapshots
+    ]
+    signs = signs or [1] * len(snapshots)
+    vocabulary, word_id_maps = _merge_vocabularies(
+        [snapshot.vocabulary for snapshot in snapshots]
+    )
+    merged_pairs = merge_sorted_pairs(
+        [
+            _snapshot_sorted_pairs(snapshot, word_id_map, sign)
+            for snapshot, word_id_map, sign in zip(snapshots, word_id_maps, signs)
+        ]
+    )
+    return sorted_pairs_to_bytes(
+        vocabulary,
+        (
+            (*key, occurrences)
+            for key, occurrences in merged_pairs
+            if occurrences >= min_count
+        ),
+    )
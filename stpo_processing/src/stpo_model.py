@@ -0,0 +1,499 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from functools import lru_cache
+from multiprocessing import shared_memory
+from secrets import token_hex
+import struct
+import sys
+import zlib
+
+from .constants import STPO_MODEL_LOOKUP_CACHE_SIZE
+from .logging import set_local_logger
+from .stpo_pruning import PRUNED_MASS_KEY
+from .stpo_snapshot import _UINT_SIZE, _padding, _uint_bytes
+
+logger = set_local_logger(__name__)
+
+MODEL_MAGIC = b"STPM"
+MODEL_VERSION = 1
+
+_HEADER = struct.Struct("<4sHHIIII")
+_SEPARATION_HEADER = struct.Struct("<III")
+_GENERATION = struct.Struct("<Q")
+
+
+def _hash_slot_count(word_count) -> int:
+    """Power of two at least twice <word_count>, so probes stay short."""
+    slot_count = 1
+    while slot_count < 2 * word_count:
+        slot_count *= 2
+    return slot_count
+
+
+def stpo_map_to_model_bytes(stpo_map) -> bytes:
+    """
+    Encode an STPO map (see build_stpo_map), or an STPOSnapshot, as a flat
+    scoring model. Unlike a binary snapshot, the vocabulary is stored
+    uncompressed with a hash table over it, and every row's total is
+    precomputed, so a reader needs no per-process structures to score.
+
+    layout (little endian, every section 4-byte aligned) = {
+        header: <magic "STPM"> <version: u16> <reserved: u16>
+            <word_count: u32> <hash_slot_count: u32> <vocabulary_bytes: u32>
+            <separation_count: u32>,
+        word_offsets: u32[word_count + 1] (into the vocabulary),
+        hash_slots: u32[hash_slot_count] (word_id + 1 by crc32, 0 empty),
+        vocabulary: utf-8 words of the sorted vocabulary, zero padded,
+        separation_headers: [<separation: u32> <first_count: u32> <pair_count: u32>],
+        per separation, in header order: {
+            first_word_ids: u32[first_count] (sorted),
+            pair_offsets: u32[first_count + 1] (row start of each first word),
+            row_totals: u32[first_count],
+            second_word_ids: u32[pair_count] (sorted within each row),
+            counts: u32[pair_count],
+        },
+    }
+    """
+    words = set()
+    for first_words in stpo_map.values():
+        for first_word, second_words in first_words.items():
+            words.add(first_word)
+            words.update(second_words.keys())
+    vocabulary = sorted(words)
+    word_ids = {word: word_id for word_id, word in enumerate(vocabulary)}
+
+    encoded_words = [word.encode("utf-8") for word in vocabulary]
+    word_offsets = array("I", [0])
+    for encoded_word in encoded_words:
+        word_offsets.append(word_offsets[-1] + len(encoded_word))
+    vocabulary_bytes = b"".join(encoded_words)
+
+    hash_slots = array("I", bytes(_UINT_SIZE * _hash_slot_count(len(vocabulary))))
+    slot_mask = len(hash_slots) - 1
+    for word_id, encoded_word in enumerate(encoded_words):
+        slot = zlib.crc32(encoded_word) & slot_mask
+        while hash_slots[slot]:
+            slot = (slot + 1) & slot_mask
+        hash_slots[slot] = word_id + 1
+
+    separation_headers = []
+    separation_sections = []
+    for separation in sorted(stpo_map.keys(), key=int):
+        first_word_ids = array("I")
+        pair_offsets = array("I", [0])
+        row_totals = array("I")
+        second_word_ids = array("I")
+        counts = array("I")
+        rows = sorted(
+            (word_ids[first_word], second_words)
+            for first_word, second_words in stpo_map[separation].items()
+        )
+        for first_word_id, second_words in rows:
+            row = sorted(
+                (word_ids[second_word], occurrences)
+                for second_word, occurrences in second_words.items()
+            )
+            first_word_ids.append(first_word_id)
+            for second_word_id, occurrences in row:
+                second_word_ids.append(second_word_id)
+                counts.append(occurrences)
+            pair_offsets.append(len(counts))
+            row_totals.append(sum(occurrences for _, occurrences in row))
+
+        separation_headers.append(
+            _SEPARATION_HEADER.pack(int(separation), len(first_word_ids), len(counts))
+        )
+        separation_sections.extend(
+            _uint_bytes(uints)
+            for uints in [
+                first_word_ids,
+                pair_offsets,
+                row_totals,
+                second_word_ids,
+                counts,
+            ]
+        )
+
+    return b"".join(
+        [
+            _HEADER.pack(
+                MODEL_MAGIC,
+                MODEL_VERSION,
+                0,
+                len(vocabulary),
+                len(hash_slots),
+                len(vocabulary_bytes),
+                len(separation_headers),
+            ),
+            _uint_bytes(word_offsets),
+            _uint_bytes(hash_slots),
+            vocabulary_bytes,
+            b"\0" * _padding(len(vocabulary_bytes)),
+            *separation_headers,
+            *separation_sections,
+        ]
+    )
+
+
+class _ModelFreqDist(Mapping):
+    """
+    second_word -> occurrences for one first word, with the FreqDist
+    methods scoring and the query service use. Missing words count 0. The
+    row's pruned mass (PRUNED_MASS_KEY) counts towards N() only.
+    """
+
+    def __init__(self, model, separation_view, idx):
+        self._model = model
+        self._second_word_ids = separation_view.second_word_ids
+        self._counts = separation_view.counts
+        self._lo = separation_view.pair_offsets[idx]
+        self._hi = separation_view.pair_offsets[idx + 1]
+        self._total = separation_view.row_totals[idx]
+        self._pruned_idx = None
+        pruned_word_id = model.pruned_word_id
+        if pruned_word_id is not None:
+            pruned_idx = bisect_left(
+                self._second_word_ids, pruned_word_id, self._lo, self._hi
+            )
+            if (
+                pruned_idx < self._hi
+                and self._second_word_ids[pruned_idx] == pruned_word_id
+            ):
+                self._pruned_idx = pruned_idx
+
+    def _pair_idx(self, second_word):
+        second_word_id = self._model.word_id(second_word)
+        if second_word_id is None or second_word_id == self._model.pruned_word_id:
+            return None
+        idx = bisect_left(self._second_word_ids, second_word_id, self._lo, self._hi)
+        if idx < self._hi and self._second_word_ids[idx] == second_word_id:
+            return idx
+        return None
+
+    def __getitem__(self, second_word):
+        idx = self._pair_idx(second_word)
+        return 0 if idx is None else self._counts[idx]
+
+    def __contains__(self, second_word):
+        return self._pair_idx(second_word) is not None
+
+    def __iter__(self):
+        for idx in range(self._lo, self._hi):
+            if idx != self._pruned_idx:
+                yield self._model.word(self._second_word_ids[idx])
+
+    def __len__(self):
+        return self._hi - self._lo - (self._pruned_idx is not None)
+
+    def N(self) -> int:
+        return self._total
+
+    def freq(self, second_word) -> float:
+        # get_post_score's inner loop, so _pair_idx is inlined
+        second_word_id = self._model.word_id(second_word)
+        if second_word_id is None or not self._total:
+            return 0
+        idx = bisect_left(self._second_word_ids, second_word_id, self._lo, self._hi)
+        if idx < self._hi and self._second_word_ids[idx] == second_word_id:
+            return self._counts[idx] / self._total
+        return 0
+
+    def most_common(self, k=None) -> list:
+        counts = self._counts
+        idxs = sorted(
+            (idx for idx in range(self._lo, self._hi) if idx != self._pruned_idx),
+            key=lambda idx: -counts[idx],
+        )
+        return [
+            (self._model.word(self._second_word_ids[idx]), counts[idx])
+            for idx in idxs[:k]
+        ]
+
+
+class _EmptyFreqDist(Mapping):
+    def __getitem__(self, second_word):
+        return 0
+
+    def __contains__(self, second_word):
+        return False
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def N(self) -> int:
+        return 0
+
+    def freq(self, second_word) -> float:
+        return 0
+
+    def most_common(self, k=None) -> list:
+        return []
+
+
+_EMPTY_FREQ_DIST = _EmptyFreqDist()
+
+
+class _ModelCFDist(Mapping):
+    """
+    first_word -> _ModelFreqDist for one separation. Like a
+    ConditionalFreqDist, an unseen first word gets an empty distribution.
+    """
+
+    def __init__(
+        self, model, first_word_ids, pair_offsets, row_totals, second_word_ids, counts
+    ):
+        self._model = model
+        self.first_word_ids = first_word_ids
+        self.pair_offsets = pair_offsets
+        self.row_totals = row_totals
+        self.second_word_ids = second_word_ids
+        self.counts = counts
+        self._freq_dist = lru_cache(model.lookup_cache_size)(self._make_freq_dist)
+
+    def _row_idx(self, first_word):
+        word_id = self._model.word_id(first_word)
+        if word_id is None:
+            return None
+        idx = bisect_left(self.first_word_ids, word_id)
+        if idx == len(self.first_word_ids) or self.first_word_ids[idx] != word_id:
+            return None
+        return idx
+
+    def _make_freq_dist(self, first_word):
+        idx = self._row_idx(first_word)
+        if idx is None:
+            return _EMPTY_FREQ_DIST
+        return _ModelFreqDist(self._model, self, idx)
+
+    def __getitem__(self, first_word):
+        return self._freq_dist(first_word)
+
+    def __contains__(self, first_word):
+        return self._row_idx(first_word) is not None
+
+    def __iter__(self):
+        for word_id in self.first_word_ids:
+            yield self._model.word(word_id)
+
+    def __len__(self):
+        return len(self.first_word_ids)
+
+
+class STPOModel(Mapping):
+    """
+    Read-only scoring model over a buffer from stpo_map_to_model_bytes,
+    indexed like the separation_to_cfdist of stpo_map_to_cfdist_map:
+        model[<separation>][<first_word>].freq(<second_word>)
+
+    Everything is read in place from the buffer (bytes or a shared memory
+    block), so opening a model costs only its section offsets, and
+    processes mapping the same block share one copy. Word ids and rows are
+    looked up through LRU caches of <lookup_cache_size> entries, so each
+    process keeps only the words it actually scores.
+    """
+
+    def __init__(self, buffer, lookup_cache_size=STPO_MODEL_LOOKUP_CACHE_SIZE):
+        self.lookup_cache_size = lookup_cache_size
+        self.word_id = lru_cache(lookup_cache_size)(self._find_word_id)
+        self._views = []
+        view = self._view(memoryview(buffer))
+        self.nbytes = view.nbytes
+
+        (
+            magic,
+            version,
+            _,
+            word_count,
+            hash_slot_count,
+            vocabulary_size,
+            separation_count,
+        ) = _HEADER.unpack_from(view, 0)
+        if magic != MODEL_MAGIC:
+            raise ValueError("Buffer is not an STPO model.")
+        if version != MODEL_VERSION:
+            raise ValueError(f"Unsupported STPO model version: {version}")
+
+        offset = _HEADER.size
+        self._word_offsets = self._uint_array(view, offset, word_count + 1)
+        offset += (word_count + 1) * _UINT_SIZE
+        self._hash_slots = self._uint_array(view, offset, hash_slot_count)
+        self._slot_mask = hash_slot_count - 1
+        offset += hash_slot_count * _UINT_SIZE
+        self._vocabulary = self._view(view[offset : offset + vocabulary_size])
+        offset += vocabulary_size + _padding(vocabulary_size)
+
+        separation_headers = []
+        for _ in range(separation_count):
+            separation_headers.append(_SEPARATION_HEADER.unpack_from(view, offset))
+            offset += _SEPARATION_HEADER.size
+        self.pruned_word_id = self._find_word_id(PRUNED_MASS_KEY)
+
+        self._separations = {}
+        for separation, first_count, pair_count in separation_headers:
+            arrays = []
+            for length in [
+                first_count,
+                first_count + 1,
+                first_count,
+                pair_count,
+                pair_count,
+            ]:
+                arrays.append(self._uint_array(view, offset, length))
+                offset += length * _UINT_SIZE
+            self._separations[separation] = _ModelCFDist(self, *arrays)
+
+    @classmethod
+    def from_stpo_map(cls, stpo_map):
+        return cls(stpo_map_to_model_bytes(stpo_map))
+
+    def _view(self, view):
+        self._views.append(view)
+        return view
+
+    def _uint_array(self, view, offset, length):
+        uints = self._view(view[offset : offset + length * _UINT_SIZE].cast("I"))
+        if sys.byteorder == "big":
+            uints = array("I", uints)
+            uints.byteswap()
+        return uints
+
+    def close(self):
+        """Release the buffer views, so a shared memory block can close."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._separations = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, separation):
+        return self._separations[separation]
+
+    def __iter__(self):
+        return iter(self._separations)
+
+    def __len__(self):
+        return len(self._separations)
+
+    def _find_word_id(self, word):
+        encoded_word = word.encode("utf-8")
+        slot = zlib.crc32(encoded_word) & self._slot_mask
+        while True:
+            entry = self._hash_slots[slot]
+            if not entry:
+                return None
+            word_start = self._word_offsets[entry - 1]
+            word_end = self._word_offsets[entry]
+            if self._vocabulary[word_start:word_end] == encoded_word:
+                return entry - 1
+            slot = (slot + 1) & self._slot_mask
+
+    def word(self, word_id) -> str:
+        word_start = self._word_offsets[word_id]
+        word_end = self._word_offsets[word_id + 1]
+        return str(self._vocabulary[word_start:word_end], "utf-8")
+
+
+class SharedModelPublisher:
+    """
+    Publishes STPO models into shared memory for SharedModelReaders in
+    other processes. Each model is written once to its own block, then a
+    generation counter in a small control block is bumped; the previous
+    model's block is unlinked, and readers still mapping it keep it until
+    they swap.
+
+    Shared memory is tracked by the publishing process, so readers must run
+    in processes it started (e.g. a ProcessPoolExecutor's workers).
+    """
+
+    def __init__(self, name=None):
+        self.name = name or f"stpo_{token_hex(4)}"
+        self._control = shared_memory.SharedMemory(
+            name=f"{self.name}_gen", create=True, size=_GENERATION.size
+        )
+        _GENERATION.pack_into(self._control.buf, 0, 0)
+        self.generation = 0
+        self._block = None
+
+    def publish(self, stpo_map) -> int:
+        """Publish <stpo_map> as the next generation, and return it."""
+        model_bytes = stpo_map_to_model_bytes(stpo_map)
+        generation = self.generation + 1
+        block = shared_memory.SharedMemory(
+            name=f"{self.name}_{generation}", create=True, size=len(model_bytes)
+        )
+        block.buf[: len(model_bytes)] = model_bytes
+        _GENERATION.pack_into(self._control.buf, 0, generation)
+
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+        self._block = block
+        self.generation = generation
+        logger.debug(f"Published STPO model generation {generation}")
+        return generation
+
+    def close(self):
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+        self._control.close()
+        self._control.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedModelReader:
+    """
+    The newest model a SharedModelPublisher named <name> has published.
+    get() checks the generation counter and maps a new model only when it
+    changed, so calling it per task costs one read of shared memory.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._control = shared_memory.SharedMemory(name=f"{name}_gen")
+        self.generation = 0
+        self._block = None
+        self._model = None
+
+    def _release(self):
+        if self._model is not None:
+            self._model.close()
+            self._model = None
+        if self._block is not None:
+            self._block.close()
+            self._block = None
+
+    def get(self):
+        """The newest model, or None before the first publish."""
+        while True:
+            (generation,) = _GENERATION.unpack_from(self._control.buf, 0)
+            if generation == self.generation:
+                return self._model
+            try:
+                block = shared_memory.SharedMemory(name=f"{self.name}_{generation}")
+            except FileNotFoundError:
+                # Superseded and unlinked before we got to it
+                continue
+            self._release()
+            self._block = block
+            self._model = STPOModel(block.buf)
+            self.generation = generation
+
+    def close(self):
+        self._release()
+        self._control.close()
@@ -0,0 +1,116 @@
+from bisect import bisect_left
+
+from .constants import (
+    BYTES_PER_PAIR,
+    PRUNED_MASS_KEY,
+    STPO_PRUNE_MAX_BYTES,
+    STPO_PRUNE_MIN_COUNT,
+    STPO_PRUNE_TOP_K,
+)
+from .logging import set_local_logger
+
+logger = set_local_logger(__name__)
+
+
+def _drop_successors(second_words: dict, dropped_words: list) -> int:
+    """Move <dropped_words>' occurrences into the row's pruned mass."""
+    if not dropped_words:
+        return 0
+    dropped_mass = sum(second_words.pop(word) for word in dropped_words)
+    second_words[PRUNED_MASS_KEY] = second_words.get(PRUNED_MASS_KEY, 0) + dropped_mass
+    return len(dropped_words)
+
+
+def _fit_byte_budget(rows: list, max_pairs: int) -> int:
+    """
+    Keep the most frequent pairs of <rows> (the first found on ties) such
+    that they and the PRUNED_MASS_KEY entries of rows losing any fit in
+    <max_pairs>. Returns the number of pairs pruned.
+    """
+    # Real pairs by descending count, stable in row order
+    pairs = sorted(
+        (
+            (occurrences, row_idx, second_word)
+            for row_idx, second_words in enumerate(rows)
+            for second_word, occurrences in second_words.items()
+            if second_word != PRUNED_MASS_KEY
+        ),
+        key=lambda pair: -pair[0],
+    )
+    mass_rows = sum(PRUNED_MASS_KEY in second_words for second_words in rows)
+    if len(pairs) + mass_rows <= max_pairs:
+        return 0
+
+    # A row without pruned mass gains an entry once its last pair is dropped
+    last_positions = {}
+    for position, (_, row_idx, _) in enumerate(pairs):
+        if PRUNED_MASS_KEY not in rows[row_idx]:
+            last_positions[row_idx] = position
+    last_positions = sorted(last_positions.values())
+
+    kept_pairs = min(len(pairs), max_pairs)
+    while kept_pairs > 0:
+        # Rows with a pair at or past kept_pairs are pruned
+        new_mass_rows = len(last_positions) - bisect_left(last_positions, kept_pairs)
+        if kept_pairs + mass_rows + new_mass_rows <= max_pairs:
+            break
+        kept_pairs -= 1
+
+    dropped_words = {}
+    for _, row_idx, second_word in pairs[kept_pairs:]:
+        dropped_words.setdefault(row_idx, []).append(second_word)
+    return sum(
+        _drop_successors(rows[row_idx], row_dropped_words)
+        for row_idx, row_dropped_words in dropped_words.items()
+    )
+
+
+def truncate_stpo_map(
+    stpo_map: dict,
+    min_count=STPO_PRUNE_MIN_COUNT,
+    top_k=STPO_PRUNE_TOP_K,
+    max_bytes=STPO_PRUNE_MAX_BYTES,
+) -> dict:
+    """
+    Prune the long tail of an STPO map in place, in order:
+        pairs counted fewer than <min_count> times,
+        all but the <top_k> most frequent successors of each
+            (separation, first_word),
+        the least frequent pairs left, until the estimated scoring model
+            (BYTES_PER_PAIR per pair, PRUNED_MASS_KEY entries included)
+            fits in <max_bytes>.
+
+    Dropped occurrences are added to the row's PRUNED_MASS_KEY successor,
+    so each first word's total, and with it every successor frequency
+    get_post_score sees, is unchanged. Pruning an already pruned map again
+    is safe.
+    """
+    if min_count <= 1 and top_k is None and max_bytes is None:
+        return stpo_map
+
+    rows = [
+        second_words
+        for first_words in stpo_map.values()
+        for second_words in first_words.values()
+    ]
+    pruned_pairs = 0
+    for second_words in rows:
+        dropped_words = []
+        kept_successors = []
+        for second_word, occurrences in second_words.items():
+            if second_word == PRUNED_MASS_KEY:
+                continue
+            if occurrences < min_count:
+                dropped_words.append(second_word)
+            else:
+                kept_successors.append((occurrences, second_word))
+        if top_k is not None and len(kept_successors) > top_k:
+            kept_successors.sort(reverse=True)
+            dropped_words += [second_word for _, second_word in kept_successors[top_k:]]
+        pruned_pairs += _drop_successors(second_words, dropped_words)
+
+    if max_bytes is not None:
+        pruned_pairs += _fit_byte_budget(rows, max_bytes // BYTES_PER_PAIR)
+
+    logger.debug(f"Pruned {pruned_pairs} STPO pairs")
+    return stpo_map
@@ -0,0 +1,220 @@
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Lock, Thread
+import time
+from urllib.parse import parse_qs, urlparse
+
+from .constants import (
+    STPO_SERVICE_FRESH_TTL,
+    STPO_SERVICE_HOST,
+    STPO_SERVICE_PORT,
+)
+from .logging import set_local_logger
+from .model_cache import model_cache
+from .raw_post_processing import build_weighted_stpo_map, get_post_score
+from .stpo_model import STPOModel
+
+logger = set_local_logger(__name__)
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class STPOService:
+    """
+    Answers STPO queries from this process's in-memory state instead of the
+    database: the newest model published to the model cache or, with
+    fresh=True and a family detector, a map built from the detector's live
+    families (reused for <fresh_ttl> seconds).
+    """
+
+    def __init__(
+        self, cache=model_cache, family_detector=None, fresh_ttl=STPO_SERVICE_FRESH_TTL
+    ):
+        self.cache = cache
+        self.family_detector = family_detector
+        self.fresh_ttl = fresh_ttl
+
+        self._fresh_model = None
+        self._fresh_built_at = None
+        self._fresh_lock = Lock()
+
+    def _build_fresh_model(self):
+        with self._fresh_lock:
+            now = time.monotonic()
+            if (
+                self._fresh_built_at is None
+                or now - self._fresh_built_at >= self.fresh_ttl
+            ):
+                repetitive_posts = self.family_detector.get_repetitive_posts()
+                self._fresh_model = STPOModel.from_stpo_map(
+                    build_weighted_stpo_map(repetitive_posts)
+                )
+                self._fresh_built_at = now
+            return self._fresh_model
+
+    def get_model(self, fresh=False):
+        """
+        model_info = {
+            "snapshot_id": <snapshot_id or None when fresh>,
+            "fresh": <bool>,
+            "model": <STPOModel>
+        }
+        """
+        if fresh and self.family_detector is not None:
+            model_info = {
+                "snapshot_id": None,
+                "fresh": True,
+                "model": self._build_fresh_model(),
+            }
+        else:
+            snapshot_id, model = self.cache.get_published_model()
+            model_info = {"snapshot_id": snapshot_id, "fresh": False, "model": model}
+        if not model_info["model"]:
+            raise ServiceError(HTTPStatus.SERVICE_UNAVAILABLE, "No STPO model yet.")
+        return model_info
+
+    def get_map(self, fresh=False) -> dict:
+        model_info = self.get_model(fresh)
+        return {
+            "snapshot_id": model_info["snapshot_id"],
+            "fresh": model_info["fresh"],
+            "stpo_map": {
+                separation: {
+                    first_word: dict(freq_dist)
+                    for first_word, freq_dist in cfdist.items()
+                }
+                for separation, cfdist in model_info["model"].items()
+            },
+        }
+
+    def score_posts(self, posts: list, fresh=False) -> dict:
+        if not isinstance(posts, list) or not all(
+            isinstance(post, str) for post in posts
+        ):
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "posts must be a list of text.")
+        model_info = self.get_model(fresh)
+        return {
+            "snapshot_id": model_info["snapshot_id"],
+            "fresh": model_info["fresh"],
+            "scores": [get_post_score(post, model_info["model"]) for post in posts],
+        }
+
+    def top_pairs(self, word, separation=None, k=10, fresh=False) -> dict:
+        """The <k> most frequent successors of <word> at each separation."""
+        model_info = self.get_model(fresh)
+        model = model_info["model"]
+        separations = sorted(model.keys()) if separation is None else [separation]
+        pairs = {}
+        for pair_separation in separations:
+            cfdist = model.get(pair_separation)
+            if cfdist is not None and word in cfdist:
+                pairs[pair_separation] = cfdist[word].most_common(k)
+        return {
+            "snapshot_id": model_info["snapshot_id"],
+            "fresh": model_info["fresh"],
+            "word": word,
+            "pairs": pairs,
+        }
+
+
+def _get_flag(query, name) -> bool:
+    return query.get(name, ["false"])[0].lower() in ["1", "true", "yes"]
+
+
+def _get_int(query, name, default):
+    if name not in query:
+        return default
+    try:
+        return int(query[name][0])
+    except ValueError:
+        raise ServiceError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer.")
+
+
+class STPORequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /map[?fresh=1]
+    POST /score[?fresh=1] with {"posts": ["<post_text>", ...]}
+    GET /pairs?word=<word>[&separation=<int>][&k=<int>][&fresh=1]
+    """
+
+    service = None
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, route):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            self._send_json(HTTPStatus.OK, route(url.path, query))
+        except ServiceError as e:
+            self._send_json(e.status, {"error": e.message})
+        except Exception as e:
+            logger.exception(f"STPO service error: {e}")
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+
+    def _get_route(self, path, query):
+        fresh = _get_flag(query, "fresh")
+        if path == "/map":
+            return self.service.get_map(fresh)
+        if path == "/pairs":
+            if "word" not in query:
+                raise ServiceError(HTTPStatus.BAD_REQUEST, "word is required.")
+            return self.service.top_pairs(
+                query["word"][0],
+                separation=_get_int(query, "separation", None),
+                k=_get_int(query, "k", 10),
+                fresh=fresh,
+            )
+        raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown path: {path}")
+
+    def _post_route(self, path, query):
+        if path != "/score":
+            raise ServiceError(HTTPStatus.NOT_FOUND, f"Unknown path: {path}")
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(content_length) or b"{}")
+        except ValueError:
+            raise ServiceError(HTTPStatus.BAD_REQUEST, "Body must be JSON.")
+        return self.service.score_posts(
+            body.get("posts"), fresh=_get_flag(query, "fresh")
+        )
+
+    def do_GET(self):
+        self._handle(self._get_route)
+
+    def do_POST(self):
+        self._handle(self._post_route)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_stpo_service(
+    family_detector=None,
+    host=STPO_SERVICE_HOST,
+    port=STPO_SERVICE_PORT,
+    cache=model_cache,
+):
+    """Serve STPO queries on a daemon thread. Returns the server."""
+    handler = type(
+        "BoundSTPORequestHandler",
+        (STPORequestHandler,),
+        {"service": STPOService(cache=cache, family_detector=family_detector)},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="stpo_service", daemon=True).start()
+    logger.info(f"STPO service listening on {host}:{server.server_port}")
+    return server
@@ -0,0 +1,216 @@
+from array import array
+from datetime import datetime, timezone
+import heapq
+from itertools import count as counter
+import math
+from operator import sub
+
+from .constants import (
+    SKETCH_BUCKET_DURATION,
+    SKETCH_DELTA,
+    SKETCH_EPSILON,
+    SKETCH_HEAVY_HITTERS,
+    SKETCH_WINDOW,
+)
+from .logging import set_local_logger
+
+logger = set_local_logger(__name__)
+
+
+class CountMinSketch:
+    """
+    Approximate counts in fixed memory. With width = ceil(e / epsilon) and
+    depth = ceil(ln(1 / delta)), an estimate exceeds the true count by more
+    than epsilon * <total count> with probability at most delta, and never
+    underestimates.
+    """
+
+    def __init__(self, epsilon=SKETCH_EPSILON, delta=SKETCH_DELTA):
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.rows = [array("I", bytes(4 * self.width)) for _ in range(self.depth)]
+        self.total = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.width * self.depth * 4
+
+    def _indexes(self, key):
+        width = self.width
+        return [hash((seed, key)) % width for seed in range(self.depth)]
+
+    def add(self, key, count=1):
+        for row, idx in zip(self.rows, self._indexes(key)):
+            row[idx] += count
+        self.total += count
+
+    def estimate(self, key) -> int:
+        return min(row[idx] for row, idx in zip(self.rows, self._indexes(key)))
+
+    def subtract(self, other):
+        """Remove counts also added to <other> (sketches are linear)."""
+        for row_idx, other_row in enumerate(other.rows):
+            self.rows[row_idx] = array("I", map(sub, self.rows[row_idx], other_row))
+        self.total -= other.total
+
+    def clear(self):
+        for row in self.rows:
+            row[:] = array("I", bytes(4 * self.width))
+        self.total = 0
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters: tracks at most <capacity> keys, and any key
+    occurring more than <total count> / capacity times is guaranteed to be
+    tracked. A new key replaces the smallest one and inherits its count.
+    """
+
+    def __init__(self, capacity=SKETCH_HEAVY_HITTERS):
+        self.capacity = capacity
+        self.counts = {}
+        # (count, tie breaker, key) entries, possibly stale
+        self._heap = []
+        self._tie_breaker = counter()
+
+    def add(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        else:
+            # Stale heap entries are skipped until a current minimum turns up
+            while True:
+                min_count, _, min_key = heapq.heappop(self._heap)
+                if counts.get(min_key) == min_count:
+                    break
+            del counts[min_key]
+            counts[key] = min_count + count
+        heapq.heappush(self._heap, (counts[key], next(self._tie_breaker), key))
+
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [
+                (occurrences, next(self._tie_breaker), k)
+                for k, occurrences in counts.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def clear(self):
+        self.counts = {}
+        self._heap = []
+
+
+class SlidingWindowSTPOSketch:
+    """
+    Approximate STPO counts over a sliding window in fixed memory, for days
+    when the exact map would not fit.
+
+    The window is split into <bucket_duration> buckets, each with its own
+    count-min sketch and Space-Saving heavy hitters over
+    (separation, first_word, second_word) keys. A running total sketch holds
+    the sum of all buckets; when a bucket leaves the window it is subtracted
+    from the total and reused. Snapshots list the heavy hitters of every
+    bucket in the window, counted with the total sketch.
+    """
+
+    def __init__(
+        self,
+        window=SKETCH_WINDOW,
+        bucket_duration=SKETCH_BUCKET_DURATION,
+        epsilon=SKETCH_EPSILON,
+        delta=SKETCH_DELTA,
+        heavy_hitters=SKETCH_HEAVY_HITTERS,
+        max_separation=20,
+    ):
+        self.window = window
+        self.bucket_duration = bucket_duration
+        self.bucket_count = math.ceil(window / bucket_duration)
+        self.max_separation = max_separation
+
+        self.total = CountMinSketch(epsilon, delta)
+        self.buckets = [
+            {
+                "bucket_id": None,
+                "sketch": CountMinSketch(epsilon, delta),
+                "heavy_hitters": SpaceSaving(heavy_hitters),
+            }
+            for _ in range(self.bucket_count)
+        ]
+
+    @property
+    def memory_bytes(self) -> int:
+        """Counter memory, fixed at creation (heavy hitter dicts excluded)."""
+        return self.total.memory_bytes * (self.bucket_count + 1)
+
+    def _bucket_id(self, now):
+        return int(now.timestamp() // self.bucket_duration.total_seconds())
+
+    def group_by_bucket(self, timed_items) -> list:
+        """
+        [(<latest time>, [<item>, ...]), ...] for (<item>, <time>) pairs, one
+        entry per sketch bucket in time order, so each group can be added at
+        its own time.
+        """
+        buckets = {}
+        for item, item_time in timed_items:
+            bucket = buckets.setdefault(self._bucket_id(item_time), [item_time, []])
+            bucket[0] = max(bucket[0], item_time)
+            bucket[1].append(item)
+        return [tuple(buckets[bucket_id]) for bucket_id in sorted(buckets)]
+
+    def _clear_bucket(self, bucket):
+        self.total.subtract(bucket["sketch"])
+        bucket["sketch"].clear()
+        bucket["heavy_hitters"].clear()
+        bucket["bucket_id"] = None
+
+    def _bucket(self, now):
+        """The bucket for <now>, expiring whatever used its slot before."""
+        bucket_id = self._bucket_id(now)
+        bucket = self.buckets[bucket_id % self.bucket_count]
+        if bucket["bucket_id"] != bucket_id:
+            if bucket["bucket_id"] is not None:
+                self._clear_bucket(bucket)
+            bucket["bucket_id"] = bucket_id
+        return bucket
+
+    def expire(self, now=None):
+        now = now or datetime.now(timezone.utc)
+        oldest_bucket_id = self._bucket_id(now) - self.bucket_count + 1
+        for bucket in self.buckets:
+            if bucket["bucket_id"] is not None and (
+                bucket["bucket_id"] < oldest_bucket_id
+            ):
+                self._clear_bucket(bucket)
+
+    def add_pairs(self, separation_indexed_word_pairs, now=None):
+        """Count (separation, first_word, second_word) pairs at time <now>."""
+        now = now or datetime.now(timezone.utc)
+        self.expire(now)
+        bucket = self._bucket(now)
+        sketch = bucket["sketch"]
+        heavy_hitters = bucket["heavy_hitters"]
+        total = self.total
+        for pair in separation_indexed_word_pairs:
+            if pair[0] < self.max_separation:
+                sketch.add(pair)
+                total.add(pair)
+                heavy_hitters.add(pair)
+
+    def to_stpo_map(self, now=None) -> dict:
+        """Approximate STPO map of the window, in build_stpo_map's format."""
+        self.expire(now)
+        candidates = set()
+        for bucket in self.buckets:
+            candidates.update(bucket["heavy_hitters"].counts.keys())
+
+        separation_to_pair_occurrences = {}
+        for pair in candidates:
+            separation, first_word, second_word = pair
+            first_words = separation_to_pair_occurrences.setdefault(separation, {})
+            first_words.setdefault(first_word, {})[second_word] = self.total.estimate(
+                pair
+            )
+
+        return separation_to_pair_occurrences
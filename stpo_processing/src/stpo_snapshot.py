@@ -0,0 +1,594 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from .constants import (
+    ANALYSIS_INTERVAL,
+    SNAPSHOT_FORMAT,
+    SNAPSHOT_KEYFRAME_INTERVAL,
+    SNAPSHOT_SIDECAR_DIR,
+    STPO_MAP_MODEL,
+)
+from .logging import set_local_logger
+from .stpo_pruning import PRUNED_MASS_KEY, truncate_stpo_map
+
+logger = set_local_logger(__name__)
+
+SNAPSHOT_MAGIC = b"STPO"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct("<4sHHII")
+_SEPARATION_HEADER = struct.Struct("<III")
+_UINT_SIZE = 4
+
+SNAPSHOT_COLUMNS = [
+    "id",
+    "created_at",
+    "snapshot_interval",
+    "snapshot_format",
+    "stpo_snapshot",
+    "stpo_snapshot_binary",
+    "stpo_snapshot_path",
+    "keyframe_id",
+]
+
+
+def _padding(size):
+    return -size % _UINT_SIZE
+
+
+def _uint_bytes(values):
+    values = array("I", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def stpo_map_to_bytes(stpo_map: dict) -> bytes:
+    """
+    Encode an STPO map (see build_stpo_map) as a compact binary snapshot.
+    Separation keys may be ints or the strings json.dumps leaves behind.
+
+    layout (little endian, every section 4-byte aligned) = {
+        header: <magic "STPO"> <version: u16> <reserved: u16>
+            <vocabulary_bytes: u32> <separation_count: u32>,
+        vocabulary: zlib("\\n".join(<sorted words>)), zero padded,
+        separation_headers: [<separation: u32> <first_count: u32> <pair_count: u32>],
+        per separation, in header order: {
+            first_word_ids: u32[first_count] (sorted),
+            pair_offsets: u32[first_count + 1] (row start of each first word),
+            second_word_ids: u32[pair_count] (sorted within each row),
+            counts: u32[pair_count],
+        },
+    }
+
+    Word ids index into the sorted vocabulary, so id order is word order.
+    """
+    words = set()
+    for first_words in stpo_map.values():
+        words.update(first_words.keys())
+        for second_words in first_words.values():
+            words.update(second_words.keys())
+    vocabulary = sorted(words)
+    word_ids = {word: word_id for word_id, word in enumerate(vocabulary)}
+
+    def sorted_id_pairs():
+        for separation in sorted(stpo_map.keys(), key=int):
+            rows = sorted(
+                (word_ids[first_word], second_words)
+                for first_word, second_words in stpo_map[separation].items()
+            )
+            for first_word_id, second_words in rows:
+                for second_word_id, occurrences in sorted(
+                    (word_ids[second_word], occurrences)
+                    for second_word, occurrences in second_words.items()
+                ):
+                    yield int(separation), first_word_id, second_word_id, occurrences
+
+    return sorted_pairs_to_bytes(vocabulary, sorted_id_pairs())
+
+
+def sorted_pairs_to_bytes(vocabulary: list, sorted_id_pairs) -> bytes:
+    """
+    Encode a binary snapshot (see stpo_map_to_bytes) from a sorted vocabulary
+    and (separation, first_word_id, second_word_id, occurrences) tuples in
+    ascending key order, without building an STPO map.
+    """
+    vocabulary_bytes = zlib.compress("\n".join(vocabulary).encode("utf-8"))
+
+    separation_headers = []
+    separation_sections = []
+
+    def add_separation(
+        separation, first_word_ids, pair_offsets, second_word_ids, counts
+    ):
+        separation_headers.append(
+            _SEPARATION_HEADER.pack(separation, len(first_word_ids), len(counts))
+        )
+        separation_sections.extend(
+            _uint_bytes(uints)
+            for uints in [first_word_ids, pair_offsets, second_word_ids, counts]
+        )
+
+    separation = None
+    first_word_ids = array("I")
+    pair_offsets = array("I")
+    second_word_ids = array("I")
+    counts = array("I")
+    for pair_separation, first_word_id, second_word_id, occurrences in sorted_id_pairs:
+        if pair_separation != separation:
+            if separation is not None:
+                pair_offsets.append(len(counts))
+                add_separation(
+                    separation, first_word_ids, pair_offsets, second_word_ids, counts
+                )
+            separation = pair_separation
+            first_word_ids = array("I")
+            pair_offsets = array("I")
+            second_word_ids = array("I")
+            counts = array("I")
+        if not first_word_ids or first_word_ids[-1] != first_word_id:
+            first_word_ids.append(first_word_id)
+            pair_offsets.append(len(counts))
+        second_word_ids.append(second_word_id)
+        counts.append(occurrences)
+    if separation is not None:
+        pair_offsets.append(len(counts))
+        add_separation(
+            separation, first_word_ids, pair_offsets, second_word_ids, counts
+        )
+
+    return b"".join(
+        [
+            _HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_VERSION,
+                0,
+                len(vocabulary_bytes),
+                len(separation_headers),
+            ),
+            vocabulary_bytes,
+            b"\0" * _padding(len(vocabulary_bytes)),
+            *separation_headers,
+            *separation_sections,
+        ]
+    )
+
+
+class _SeparationView(Mapping):
+    """first_word -> {second_word: occurrences} for one separation."""
+
+    def __init__(self, snapshot, first_word_ids, pair_offsets, second_word_ids, counts):
+        self._snapshot = snapshot
+        self.first_word_ids = first_word_ids
+        self.pair_offsets = pair_offsets
+        self.second_word_ids = second_word_ids
+        self.counts = counts
+
+    def _row(self, first_word):
+        word_id = self._snapshot.word_id(first_word)
+        if word_id is None:
+            return None
+        idx = bisect_left(self.first_word_ids, word_id)
+        if idx == len(self.first_word_ids) or self.first_word_ids[idx] != word_id:
+            return None
+        return self.pair_offsets[idx], self.pair_offsets[idx + 1]
+
+    def __getitem__(self, first_word):
+        row = self._row(first_word)
+        if row is None:
+            raise KeyError(first_word)
+        vocabulary = self._snapshot.vocabulary
+        return {
+            vocabulary[self.second_word_ids[i]]: self.counts[i] for i in range(*row)
+        }
+
+    def __contains__(self, first_word):
+        return self._row(first_word) is not None
+
+    def __iter__(self):
+        vocabulary = self._snapshot.vocabulary
+        for word_id in self.first_word_ids:
+            yield vocabulary[word_id]
+
+    def __len__(self):
+        return len(self.first_word_ids)
+
+    def get_count(self, first_word, second_word) -> int:
+        row = self._row(first_word)
+        second_word_id = self._snapshot.word_id(second_word)
+        if row is None or second_word_id is None:
+            return 0
+        lo, hi = row
+        idx = bisect_left(self.second_word_ids, second_word_id, lo, hi)
+        if idx < hi and self.second_word_ids[idx] == second_word_id:
+            return self.counts[idx]
+        return 0
+
+
+class STPOSnapshot(Mapping):
+    """
+    Read-only view of a compact binary STPO snapshot.
+
+    Count arrays are read in place from the underlying buffer (bytes, a
+    bytea memoryview or an mmap), so loading costs only the vocabulary
+    decompression. Behaves like the nested dict from build_stpo_map:
+        snapshot[<separation>][<first_word>] -> {<second_word>: <occurrences>}
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._views = []
+        view = self._view(memoryview(buffer))
+
+        magic, version, _, vocabulary_size, separation_count = _HEADER.unpack_from(
+            view, 0
+        )
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Buffer is not an STPO snapshot.")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported STPO snapshot version: {version}")
+
+        offset = _HEADER.size
+        vocabulary_text = zlib.decompress(view[offset : offset + vocabulary_size])
+        vocabulary_text = vocabulary_text.decode("utf-8")
+        self.vocabulary = vocabulary_text.split("\n") if vocabulary_text else []
+        self._word_ids = None
+        offset += vocabulary_size + _padding(vocabulary_size)
+
+        separation_headers = []
+        for _ in range(separation_count):
+            separation_headers.append(_SEPARATION_HEADER.unpack_from(view, offset))
+            offset += _SEPARATION_HEADER.size
+
+        self._separations = {}
+        for separation, first_count, pair_count in separation_headers:
+            arrays = []
+            for length in [first_count, first_count + 1, pair_count, pair_count]:
+                arrays.append(self._uint_array(view, offset, length))
+                offset += length * _UINT_SIZE
+            self._separations[separation] = _SeparationView(self, *arrays)
+
+    @classmethod
+    def from_file(cls, path):
+        """Memory-map a snapshot file written by write_stpo_snapshot_file."""
+        with open(path, "rb") as snapshot_file:
+            buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def _view(self, view):
+        self._views.append(view)
+        return view
+
+    def _uint_array(self, view, offset, length):
+        uints = self._view(view[offset : offset + length * _UINT_SIZE].cast("I"))
+        if sys.byteorder == "big":
+            uints = array("I", uints)
+            uints.byteswap()
+        return uints
+
+    def close(self):
+        """Release the buffer views, and the mmap if from_file opened one."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._separations = {}
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, separation):
+        return self._separations[separation]
+
+    def __iter__(self):
+        return iter(self._separations)
+
+    def __len__(self):
+        return len(self._separations)
+
+    def word_id(self, word):
+        if self._word_ids is None:
+            self._word_ids = {w: word_id for word_id, w in enumerate(self.vocabulary)}
+        return self._word_ids.get(word)
+
+    def get_count(self, separation, first_word, second_word) -> int:
+        if separation not in self._separations:
+            return 0
+        return self._separations[separation].get_count(first_word, second_word)
+
+    def successors(self, separation, first_word) -> dict:
+        """Real successors of <first_word>, without the row's pruned mass."""
+        if separation not in self._separations:
+            return {}
+        second_words = self._separations[separation].get(first_word, {})
+        second_words.pop(PRUNED_MASS_KEY, None)
+        return second_words
+
+    def to_stpo_map(self) -> dict:
+        return {
+            separation: dict(first_words.items())
+            for separation, first_words in self._separations.items()
+        }
+
+
+def write_stpo_snapshot_file(stpo_map: dict, path) -> str:
+    """Write a binary snapshot atomically, so readers never map a partial file."""
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(stpo_map_to_bytes(stpo_map))
+    os.replace(temp_path, path)
+    return path
+
+
+def _next_snapshot_id(cur) -> int:
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id'));", [STPO_MAP_MODEL["name"]]
+    )
+    return cur.fetchone()[0]
+
+
+def insert_stpo_snapshot(
+    cur,
+    stpo_map,
+    snapshot_interval,
+    created_at,
+    snapshot_format=SNAPSHOT_FORMAT,
+    sidecar_dir=SNAPSHOT_SIDECAR_DIR,
+    keyframe_id=None,
+) -> int:
+    """
+    Write an STPO map to stpo_map in <snapshot_format> and return its id.
+    For "delta", <stpo_map> is a delta from diff_stpo_maps against the
+    previous snapshot in the chain starting at <keyframe_id>.
+    """
+    snapshot_id = _next_snapshot_id(cur)
+    column_data = [
+        {"name": "id", "value": snapshot_id},
+        {"name": "snapshot_interval", "value": snapshot_interval},
+        {"name": "created_at", "value": created_at},
+        {"name": "snapshot_format", "value": snapshot_format},
+    ]
+
+    if snapshot_format == "json":
+        column_data.append({"name": "stpo_snapshot", "value": json.dumps(stpo_map)})
+    elif snapshot_format in ["binary", "delta"]:
+        snapshot_bytes = stpo_map_to_bytes(stpo_map)
+        logger.debug(f"Binary snapshot size: {len(snapshot_bytes)} bytes")
+        column_data.append({"name": "stpo_snapshot_binary", "value": snapshot_bytes})
+        if snapshot_format == "delta":
+            column_data.append({"name": "keyframe_id", "value": keyframe_id})
+    elif snapshot_format == "sidecar":
+        # Windows of one cycle share created_at, so the id keeps names unique
+        file_name = f"stpo_{created_at:%Y%m%dT%H%M%S}_{snapshot_id}.stpo"
+        path = write_stpo_snapshot_file(stpo_map, os.path.join(sidecar_dir, file_name))
+        column_data.append({"name": "stpo_snapshot_path", "value": path})
+    elif snapshot_format == "relational":
+        # Load the pairs before the stpo_map row exists, so readers never see
+        # a partially loaded snapshot
+        cur.insert_stpo_pairs(cur, snapshot_id, stpo_map)
+    else:
+        raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+
+    table_row = {"table_name": STPO_MAP_MODEL["name"], "column_data": column_data}
+    cur.insert_into_table(cur, table_row)
+    return snapshot_id
+
+
+def diff_stpo_maps(previous_map: dict, current_map: dict) -> dict:
+    """
+    Pairs whose counts changed from <previous_map> to <current_map>, in STPO
+    map form, holding the new count. Pairs that disappeared get a count of 0.
+    """
+    delta = {}
+    for separation in previous_map.keys() | current_map.keys():
+        previous_first_words = previous_map.get(separation, {})
+        current_first_words = current_map.get(separation, {})
+        for first_word in previous_first_words.keys() | current_first_words.keys():
+            previous_second_words = previous_first_words.get(first_word, {})
+            current_second_words = current_first_words.get(first_word, {})
+            if previous_second_words == current_second_words:
+                continue
+            changes = {
+                second_word: occurrences
+                for second_word, occurrences in current_second_words.items()
+                if previous_second_words.get(second_word) != occurrences
+            }
+            for second_word in previous_second_words.keys():
+                if second_word not in current_second_words:
+                    changes[second_word] = 0
+            if changes:
+                delta.setdefault(separation, {})[first_word] = changes
+
+    return delta
+
+
+def apply_stpo_delta(stpo_map: dict, delta) -> dict:
+    """Apply a delta from diff_stpo_maps to <stpo_map> in place."""
+    for separation, first_words in delta.items():
+        separation_map = stpo_map.setdefault(separation, {})
+        for first_word, changes in first_words.items():
+            second_words = separation_map.setdefault(first_word, {})
+            for second_word, occurrences in changes.items():
+                if occurrences:
+                    second_words[second_word] = occurrences
+                else:
+                    second_words.pop(second_word, None)
+            if not second_words:
+                del separation_map[first_word]
+        if not separation_map:
+            del stpo_map[separation]
+
+    return stpo_map
+
+
+class DeltaSnapshotWriter:
+    """
+    Writes every <keyframe_interval>th snapshot in full (as <keyframe_format>)
+    and only the changed pairs in between, as "delta" snapshots chained to
+    the last keyframe. A keyframe_interval of 1 writes every snapshot in full.
+
+    With <prune>, each map's long tail is truncated in place with the
+    STPO_PRUNE_* settings before it is written (see truncate_stpo_map), so
+    callers publishing the same map get the pruned model.
+    """
+
+    def __init__(
+        self,
+        keyframe_interval=SNAPSHOT_KEYFRAME_INTERVAL,
+        keyframe_format=SNAPSHOT_FORMAT,
+        prune=True,
+    ):
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_format = keyframe_format
+        self.prune = prune
+        self.previous_map = None
+        self.keyframe_id = None
+        self.snapshots_since_keyframe = 0
+
+    def insert(self, cur, stpo_map: dict, snapshot_interval, created_at) -> int:
+        if self.prune:
+            truncate_stpo_map(stpo_map)
+        is_keyframe = (
+            self.previous_map is None
+            or self.snapshots_since_keyframe + 1 >= self.keyframe_interval
+        )
+
+        if is_keyframe:
+            snapshot_id = insert_stpo_snapshot(
+                cur,
+                stpo_map,
+                snapshot_interval,
+                created_at,
+                snapshot_format=self.keyframe_format,
+            )
+            self.keyframe_id = snapshot_id
+            self.snapshots_since_keyframe = 0
+        else:
+            delta = diff_stpo_maps(self.previous_map, stpo_map)
+            snapshot_id = insert_stpo_snapshot(
+                cur,
+                delta,
+                snapshot_interval,
+                created_at,
+                snapshot_format="delta",
+                keyframe_id=self.keyframe_id,
+            )
+            self.snapshots_since_keyframe += 1
+
+        # Only advance once the write succeeded, so the chain has no gaps
+        self.previous_map = stpo_map if self.keyframe_interval > 1 else None
+        return snapshot_id
+
+
+def load_stpo_snapshot(record: dict, cur=None):
+    """
+    Turn an stpo_map row (selected with SNAPSHOT_COLUMNS, dict_output=True)
+    into an STPO map. Binary and sidecar rows come back as an STPOSnapshot;
+    jsonb rows, including those written before snapshot formats existed,
+    come back as a nested dict with integer separations. Relational rows
+    need <cur> to read their pairs. Delta rows come back as the bare delta;
+    use select_stpo_snapshot to reconstruct the full map.
+    """
+    snapshot_format = record.get("snapshot_format") or "json"
+
+    if snapshot_format == "json":
+        stpo_snapshot = record["stpo_snapshot"]
+        if isinstance(stpo_snapshot, str):
+            stpo_snapshot = json.loads(stpo_snapshot)
+        return {int(sep): first_words for sep, first_words in stpo_snapshot.items()}
+    if snapshot_format in ["binary", "delta"]:
+        return STPOSnapshot(record["stpo_snapshot_binary"])
+    if snapshot_format == "sidecar":
+        return STPOSnapshot.from_file(record["stpo_snapshot_path"])
+    if snapshot_format == "relational":
+        # The pruned mass keeps the model's row totals
+        return cur.select_stpo_pairs(cur, record["id"], include_pruned=True)
+
+    raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+
+
+def _select_snapshot_records(cur, where: list) -> list:
+    select_snapshot = {
+        "table_name": STPO_MAP_MODEL["name"],
+        "columns": SNAPSHOT_COLUMNS,
+        "where": where,
+    }
+    return cur.select_from_table(cur, select_snapshot, dict_output=True)
+
+
+def _to_stpo_map(stpo_snapshot) -> dict:
+    if isinstance(stpo_snapshot, STPOSnapshot):
+        with stpo_snapshot:
+            return stpo_snapshot.to_stpo_map()
+    return stpo_snapshot
+
+
+def reconstruct_stpo_snapshot(cur, record: dict) -> dict:
+    """Rebuild the full STPO map of a delta row from its keyframe onwards."""
+    keyframe_id = record["keyframe_id"]
+    keyframes = _select_snapshot_records(
+        cur, [{"column": "id", "operator": "=", "value": keyframe_id}]
+    )
+    if not keyframes:
+        raise ValueError(f"Keyframe {keyframe_id} of snapshot {record['id']} is gone.")
+    stpo_map = _to_stpo_map(load_stpo_snapshot(keyframes[0], cur))
+
+    deltas = _select_snapshot_records(
+        cur,
+        [
+            {"column": "keyframe_id", "operator": "=", "value": keyframe_id},
+            {"column": "id", "operator": "<=", "value": record["id"]},
+        ],
+    )
+    for delta_record in sorted(deltas, key=lambda delta: delta["id"]):
+        with load_stpo_snapshot(delta_record) as delta:
+            apply_stpo_delta(stpo_map, delta)
+
+    return stpo_map
+
+
+def select_latest_snapshot_id(cur, snapshot_interval=ANALYSIS_INTERVAL):
+    """Id of the newest snapshot covering <snapshot_interval>, or None."""
+    select_latest_id = {
+        "table_name": STPO_MAP_MODEL["name"],
+        "text": "max(id)",
+        "where": [
+            {"column": "snapshot_interval", "operator": "=", "value": snapshot_interval}
+        ],
+    }
+    results = cur.select_from_table(cur, select_latest_id)
+    return results[0][0] if results else None
+
+
+def select_stpo_snapshot(cur, snapshot_id=None, snapshot_interval=ANALYSIS_INTERVAL):
+    """
+    Load snapshot <snapshot_id>, or the latest one covering
+    <snapshot_interval> if not given. Delta snapshots are reconstructed into
+    a full map.
+    """
+    if snapshot_id is None:
+        snapshot_id = select_latest_snapshot_id(cur, snapshot_interval)
+        if snapshot_id is None:
+            return None
+
+    results = _select_snapshot_records(
+        cur, [{"column": "id", "operator": "=", "value": snapshot_id}]
+    )
+    if not results:
+        return None
+    if results[0]["snapshot_format"] == "delta":
+        return reconstruct_stpo_snapshot(cur, results[0])
+    return load_stpo_snapshot(results[0], cur)
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from stpo_processing.src.commit_filter import CommitFilterStats, has_post_creates
+
+
+def make_commit(*ops):
+    return SimpleNamespace(
+        ops=[SimpleNamespace(action=action, path=path) for action, path in ops]
+    )
+
+
+def test_has_post_creates():
+    assert has_post_creates(make_commit(("create", "app.bsky.feed.post/3k2a")))
+    assert has_post_creates(
+        make_commit(
+            ("create", "app.bsky.feed.like/3k2b"),
+            ("create", "app.bsky.feed.post/3k2c"),
+        )
+    )
+    assert not has_post_creates(make_commit(("create", "app.bsky.feed.like/3k2a")))
+    assert not has_post_creates(make_commit(("delete", "app.bsky.feed.post/3k2a")))
+    assert not has_post_creates(make_commit(("create", "app.bsky.feed.postgate/3k2a")))
+    assert not has_post_creates(make_commit())
+
+
+def test_saved_seconds_estimate():
+    stats = CommitFilterStats()
+    assert stats.saved_seconds == 0.0
+    stats.record_decoded(0.002)
+    stats.record_decoded(0.004)
+    for _ in range(10):
+        stats.record_rejected()
+
+    assert stats.stats()["commits"] == 12
+    assert stats.stats()["rejected_commits"] == 10
+    assert abs(stats.saved_seconds - 0.03) < 1e-9
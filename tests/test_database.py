@@ -3,7 +3,11 @@ from datetime import datetime, timedelta
 import psycopg2
 
 # sys.path.append("./stpo_processing")
-from stpo_processing.src.database import get_database_credentials, STPOCursor
+from stpo_processing.src.database import (
+    get_database_credentials,
+    statement_cache,
+    STPOCursor,
+)
 from stpo_processing.src.logging import set_local_logger
 
 logger = set_local_logger(__name__)
@@ -160,3 +164,173 @@ def test_table_communication():
         print("Dropping test table.")
         cur.execute(f"drop table {table_attributes['name']};")
         con.close()
+
+
+def test_copy_into_table():
+    db_creds = get_database_credentials()
+    con = psycopg2.connect(**db_creds)
+    cur = con.cursor(cursor_factory=STPOCursor)
+    con.autocommit = True
+
+    try:
+        table_attributes = {
+            "name": "test_table",
+            "temp": False,
+            "is_if_not_exists": True,
+            "columns": [
+                {"name": "example_text", "data_type": "text", "is_null": True},
+                {"name": "example_count", "data_type": "integer", "is_null": False},
+            ],
+            "indexes": [{"name": "test_table_count_idx", "columns": ["example_count"]}],
+        }
+        create_table(cur, table_attributes)
+
+        rows = [("plain", 1), ("tab\there", 2), ("new\nline \\ slash", 3), (None, 4)]
+        # NUL can't be stored in text, so it's stripped
+        stored_rows = rows + [("nulbyte", 5)]
+        rows = rows + [("nul\x00byte", 5)]
+        cur.copy_into_table(
+            cur, "test_table", ["example_text", "example_count"], rows, verbose=True
+        )
+
+        select_attrs = {
+            "table_name": "test_table",
+            "columns": ["example_text", "example_count"],
+        }
+        results = select_from_table(cur, select_attrs)
+
+        assert sorted(results, key=lambda row: row[1]) == stored_rows
+
+    finally:
+        print("Dropping test table.")
+        cur.execute(f"drop table {table_attributes['name']};")
+        con.close()
+
+
+def test_statement_cache():
+    db_creds = get_database_credentials()
+    con = psycopg2.connect(**db_creds)
+    cur = con.cursor(cursor_factory=STPOCursor)
+    con.autocommit = True
+
+    try:
+        table_attributes = {
+            "name": "test_table",
+            "temp": False,
+            "is_if_not_exists": True,
+            "columns": [
+                {"name": "example_text", "data_type": "text", "is_null": True},
+                {"name": "example_count", "data_type": "integer", "is_null": False},
+            ],
+        }
+        create_table(cur, table_attributes)
+
+        misses = statement_cache.misses
+        prepares = statement_cache.prepares
+        for count in range(statement_cache.prepare_threshold + 2):
+            cur.insert_into_table(
+                cur,
+                {
+                    "table_name": "test_table",
+                    "column_data": [
+                        {"name": "example_text", "value": "100%"},
+                        {"name": "example_count", "value": count},
+                    ],
+                },
+            )
+        assert statement_cache.misses == misses + 1
+        assert statement_cache.prepares == prepares + 1
+
+        select_attrs = {
+            "table_name": "test_table",
+            "columns": ["example_count"],
+            "where": [{"column": "example_text", "operator": "=", "value": "100%"}],
+        }
+        for _ in range(statement_cache.prepare_threshold + 2):
+            results = select_from_table(cur, select_attrs)
+        assert sorted(results) == [
+            (count,) for count in range(statement_cache.prepare_threshold + 2)
+        ]
+        assert statement_cache.prepares == prepares + 2
+
+    finally:
+        print("Dropping test table.")
+        cur.execute(f"drop table {table_attributes['name']};")
+        con.close()
+
+
+def test_statement_cache_deallocates_evicted():
+    db_creds = get_database_credentials()
+    con = psycopg2.connect(**db_creds)
+    cur = con.cursor(cursor_factory=STPOCursor)
+    con.autocommit = True
+
+    max_statements = statement_cache.max_statements
+    try:
+        table_attributes = {
+            "name": "test_table",
+            "temp": False,
+            "is_if_not_exists": True,
+            "columns": [
+                {"name": "example_text", "data_type": "text", "is_null": True},
+                {"name": "example_count", "data_type": "integer", "is_null": False},
+            ],
+        }
+        create_table(cur, table_attributes)
+
+        statement_cache.max_statements = 1
+        for column in ["example_text", "example_count", "example_text"]:
+            select_attrs = {"table_name": "test_table", "columns": [column]}
+            for _ in range(statement_cache.prepare_threshold):
+                select_from_table(cur, select_attrs)
+
+            cur.execute("SELECT count(*) FROM pg_prepared_statements;")
+            assert cur.fetchone() == (1,)
+
+    finally:
+        statement_cache.max_statements = max_statements
+        print("Dropping test table.")
+        cur.execute(f"drop table {table_attributes['name']};")
+        con.close()
+
+
+def test_bootstrap_schema():
+    db_creds = get_database_credentials()
+    con = psycopg2.connect(**db_creds)
+    cur = con.cursor(cursor_factory=STPOCursor)
+    con.autocommit = True
+
+    table_attributes = {
+        "name": "test_table",
+        "temp": False,
+        "is_if_not_exists": True,
+        "columns": [
+            {"name": "example_text", "data_type": "text", "is_null": False},
+        ],
+    }
+    try:
+        assert cur.bootstrap_schema(cur, [table_attributes]) == ["test_table"]
+        assert cur.bootstrap_schema(cur, [table_attributes]) == []
+
+        # Columns, indexes and dropped NOT NULLs added to the model are applied
+        updated_attributes = {
+            **table_attributes,
+            "columns": [
+                {"name": "example_text", "data_type": "text", "is_null": True},
+                {"name": "example_count", "data_type": "integer", "is_null": True},
+            ],
+            "indexes": [{"name": "test_table_count_idx", "columns": ["example_count"]}],
+        }
+        assert cur.bootstrap_schema(cur, [updated_attributes]) == ["test_table"]
+        assert cur.select_schema(cur, ["test_table"]) == {
+            "test_table": {
+                "columns": {"example_text": True, "example_count": True},
+                "indexes": {"test_table_count_idx"},
+            }
+        }
+        assert cur.bootstrap_schema(cur, [updated_attributes]) == []
+
+    finally:
+        print("Dropping test table.")
+        cur.execute(f"drop table {table_attributes['name']};")
+        con.close()
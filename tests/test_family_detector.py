@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+from stpo_processing.src.family_detector import OnlineFamilyDetector
+from stpo_processing.src.raw_post_processing import build_post_families, format_post
+
+POSTS = [
+    "Get free followers now at example.com",
+    "get FREE followers now at example.com!",
+    "I had a lovely walk in the park today",
+    "Get free followers now at example.com",
+    "hi",
+]
+
+
+def test_detector_families():
+    detector = OnlineFamilyDetector()
+    events = []
+    detector.listeners.append(events.append)
+
+    for post in POSTS:
+        detector.add_post(post)
+
+    assert [event["family_size"] for event in events] == [1, 2, 1, 3]
+    assert [event["is_new_family"] for event in events] == [True, False, True, False]
+    assert events[1]["family_name"] == POSTS[0]
+    assert detector.post_count == 4
+
+    spam_words = format_post(POSTS[0]).split()
+    assert detector.get_repetitive_posts() == [spam_words] * 4
+
+
+def test_detector_matches_batch_families():
+    detector = OnlineFamilyDetector()
+    for post in POSTS:
+        detector.add_post(post)
+
+    batch_posts = build_post_families(POSTS)
+    online_posts = detector.get_repetitive_posts(min_family_size=1)
+    assert sorted(online_posts) == sorted(batch_posts)
+
+
+def test_detector_expiry_and_memory_bound():
+    now = datetime.now(timezone.utc)
+    detector = OnlineFamilyDetector(window=timedelta(hours=1), max_posts=3)
+
+    detector.add_post(POSTS[0], created_at=now - timedelta(hours=2))
+    detector.add_post(POSTS[2], created_at=now - timedelta(minutes=5))
+    detector.add_post(POSTS[1], created_at=now)
+    assert detector.get_repetitive_posts(now=now) == []
+    assert detector.post_count == 2
+
+    detector.add_post(POSTS[0], created_at=now)
+    detector.add_post("Another completely different post here", created_at=now)
+    assert detector.post_count == 3
+    assert list(detector.families.keys()) == [
+        POSTS[0],
+        "Another completely different post here",
+    ]
+
+
+def test_detector_trims_singletons():
+    detector = OnlineFamilyDetector(max_singletons=1)
+    detector.add_post(POSTS[0])
+    detector.add_post(POSTS[1])
+    detector.add_post(POSTS[2])
+    detector.add_post("Another completely different post here")
+
+    # The spam family has two posts, so only the oldest singleton is dropped
+    assert list(detector.families.keys()) == [
+        POSTS[0],
+        "Another completely different post here",
+    ]
+    assert "lovely" not in detector.families_by_word
+    assert detector.families_by_word["free"] == {POSTS[0]}
+    assert detector.add_post(POSTS[3])["family_size"] == 3
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+
+from stpo_processing.src.family_index import FamilyIndex
+from stpo_processing.src.raw_post_processing import normalize_post, orchestrate_stpo
+
+SPAM = "Get free followers now at example.com"
+POSTS = [
+    SPAM,
+    "get FREE followers now at example.com!",
+    "I had a lovely walk in the park today",
+]
+
+
+def test_family_index_matches_across_cycles():
+    family_index = FamilyIndex()
+    first_stpo_map = orchestrate_stpo(POSTS, family_index=family_index)
+    # The one-off post isn't indexed
+    assert list(family_index.families.keys()) == [SPAM]
+    assert family_index.families[SPAM]["member_count"] == 2
+
+    # Overlapping windows re-read the same posts, so counts aren't summed
+    cycle_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    second_stpo_map = orchestrate_stpo(
+        POSTS, family_index=family_index, cycle_time=cycle_time
+    )
+    assert second_stpo_map == first_stpo_map
+    assert family_index.families[SPAM]["member_count"] == 2
+    assert family_index.families[SPAM]["last_seen"] == cycle_time
+
+    only_copy = orchestrate_stpo(POSTS[1:], family_index=family_index)
+    assert only_copy == orchestrate_stpo(POSTS[1:])
+    assert family_index.families[SPAM]["member_count"] == 1
+
+
+def test_family_index_expiry():
+    now = datetime.now(timezone.utc)
+    family_index = FamilyIndex(ttl=timedelta(hours=1))
+    orchestrate_stpo(POSTS, family_index=family_index)
+    assert family_index.match(set(normalize_post(POSTS[1]))) == SPAM
+
+    assert family_index.expire(now + timedelta(minutes=30)) == 0
+    assert family_index.expire(now + timedelta(hours=2)) == 1
+    assert len(family_index) == 0
+    assert family_index.families_by_length == {}
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from stpo_processing.src.firehose_checkpoint import (
+    FirehoseCheckpoint,
+    parse_commit_time,
+)
+
+NOW = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def test_resume_cursor():
+    checkpoint = FirehoseCheckpoint(resume_max_age=timedelta(hours=1))
+    assert checkpoint.resume_cursor(NOW) is None
+
+    checkpoint.mark_saved(1000, NOW - timedelta(minutes=5))
+    assert checkpoint.resume_cursor(NOW) == 1000
+
+    checkpoint.mark_saved(1000, NOW - timedelta(hours=2))
+    assert checkpoint.resume_cursor(NOW) is None
+
+
+def test_observe_skips_replayed_commits():
+    checkpoint = FirehoseCheckpoint()
+    checkpoint.mark_saved(10, NOW)
+    checkpoint.resume_cursor(NOW)
+
+    assert [checkpoint.observe(seq) for seq in [9, 10, 11, 12, 11]] == [
+        False,
+        False,
+        True,
+        True,
+        False,
+    ]
+    assert checkpoint.replayed_commits == 3
+
+    # A restarted client receives unsaved commits again
+    checkpoint.resume_cursor(NOW)
+    assert checkpoint.observe(11)
+
+
+def test_flush_delay_paces_only_catch_up():
+    checkpoint = FirehoseCheckpoint(
+        catchup_lag=timedelta(seconds=30), catchup_max_posts_per_second=100
+    )
+    live_time = parse_commit_time("2024-01-01T11:59:50.000Z")
+    old_time = parse_commit_time("2024-01-01T10:00:00.000Z")
+
+    assert checkpoint.flush_delay(500, live_time, 0, NOW) == 0
+    assert checkpoint.flush_delay(500, old_time, 1, NOW) == 4
+    assert checkpoint.flush_delay(500, old_time, 10, NOW) == 0
+    assert checkpoint.flush_delay(500, None, 0, NOW) == 0
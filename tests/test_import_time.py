@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "stpo_processing"
+)
+
+# Cumulative import time allowed for the entry point, in microseconds. Far
+# above the ~0.1 s it takes, so a loaded machine doesn't trip it, but a slow
+# import creeping back onto the startup path does
+IMPORT_TIME_BUDGET = 2_000_000
+# Slow imports the entry point must leave to the code paths that need them
+DEFERRED_MODULES = ["atproto", "nltk", "dotenv", "psycopg2"]
+
+
+def get_import_times(module) -> dict:
+    """{<module>: <cumulative microseconds>} from python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PACKAGE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+def test_main_import_time():
+    import_times = get_import_times("src.main")
+    assert import_times["src.main"] < IMPORT_TIME_BUDGET
+
+
+def test_main_defers_slow_imports():
+    import_times = get_import_times("src.main")
+    for module in DEFERRED_MODULES:
+        assert module not in import_times
@@ -0,0 +1,42 @@
+from stpo_processing.src.ingest_filters import (
+    get_post_fields,
+    get_post_lang,
+    make_post,
+    passes_ingest_filters,
+)
+
+
+def test_get_post_fields():
+    record = {
+        "$type": "app.bsky.feed.post",
+        "text": "replying with a link",
+        "langs": ["en-US"],
+        "reply": {"root": {}, "parent": {}},
+        "embed": {"$type": "app.bsky.embed.external"},
+    }
+    post = get_post_fields(record)
+    assert post == make_post(
+        "replying with a link", langs=["en-US"], is_reply=True, has_embed=True
+    )
+    assert get_post_lang(post) == "en"
+
+    post = get_post_fields({"text": "no extras"})
+    assert post == make_post("no extras")
+    assert get_post_lang(post) is None
+
+
+def test_passes_ingest_filters():
+    post = make_post("hello there", langs=["en-GB"])
+    assert passes_ingest_filters(post, langs=None)
+    assert passes_ingest_filters(post, langs=["en"])
+    assert passes_ingest_filters(post, langs=["en-GB"])
+    assert not passes_ingest_filters(post, langs=["ja"])
+
+    untagged = make_post("hello there")
+    assert passes_ingest_filters(untagged, langs=["en"], untagged_langs=True)
+    assert not passes_ingest_filters(untagged, langs=["en"], untagged_langs=False)
+
+    assert not passes_ingest_filters(make_post("hi"), min_text_length=3)
+    assert not passes_ingest_filters(post, max_text_length=5)
+    assert not passes_ingest_filters(make_post("a reply", is_reply=True), replies=False)
+    assert not passes_ingest_filters(make_post("a link", has_embed=True), embeds=False)
@@ -0,0 +1,62 @@
+from stpo_processing.src.model_cache import STPOModelCache
+from stpo_processing.src.stpo_model import STPOModel
+
+STPO_MAPS = {
+    1: {1: {"free": {"followers": 3}}},
+    2: {1: {"free": {"followers": 1, "likes": 1}}},
+    3: {1: {"buy": {"now": 2}}},
+}
+
+
+def get_cache(latest_snapshot_id, loads, **kwargs):
+    def load_snapshot(cur, snapshot_id):
+        loads.append(snapshot_id)
+        return STPO_MAPS.get(snapshot_id)
+
+    return STPOModelCache(
+        load_snapshot=load_snapshot,
+        get_latest_snapshot_id=lambda cur: latest_snapshot_id[0],
+        **kwargs,
+    )
+
+
+def test_model_cache_hits_and_eviction():
+    loads = []
+    cache = get_cache([3], loads, max_models=2, check_interval=0)
+
+    model = cache.get_model(None)
+    assert model[1]["buy"].freq("now") == 1
+    assert cache.get_model(None) is model
+    assert cache.get_model(None, snapshot_id=1)[1]["free"]["followers"] == 3
+    cache.get_model(None, snapshot_id=2)
+
+    assert loads == [3, 1, 2]
+    # The newest snapshot's model outlives less recently used ones
+    assert list(cache.cache.keys()) == [3, 2]
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.get_model(None, snapshot_id=4) is None
+
+
+def test_model_cache_memory_bound():
+    loads = []
+    max_bytes = STPOModel.from_stpo_map(STPO_MAPS[2]).nbytes
+    cache = get_cache([3], loads, max_models=10, max_bytes=max_bytes)
+
+    cache.get_model(None, snapshot_id=2)
+    cache.get_model(None, snapshot_id=1)
+    assert list(cache.cache.keys()) == [1]
+    assert cache.total_bytes <= max_bytes
+
+
+def test_model_cache_publish():
+    loads = []
+    latest_snapshot_id = [2]
+    cache = get_cache(latest_snapshot_id, loads, check_interval=3600)
+
+    cache.get_model(None)
+    latest_snapshot_id[0] = 3
+    cache.publish(3, STPO_MAPS[3])
+    model = cache.get_model(None)
+
+    assert "buy" in model[1]
+    assert loads == [2]
@@ -0,0 +1,84 @@
+from datetime import datetime, timezone
+
+from stpo_processing.src.ingest_filters import make_post
+from stpo_processing.src.post_spool import PostSpool, RECORD_HEADER
+
+CREATED_AT = datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc)
+POSTS = [
+    make_post("first post", langs=["en"]),
+    make_post("second post ✨", langs=["ja", "en-US"], is_reply=True),
+    make_post("third\tpost\nwith breaks", has_embed=True),
+]
+
+
+def test_spool_drains_in_order_across_segments(tmp_path):
+    spool = PostSpool(str(tmp_path), segment_bytes=50, max_bytes=10000)
+    spool.append(POSTS[:2], created_at=CREATED_AT)
+    spool.append(POSTS[2:], created_at=CREATED_AT)
+    assert len(spool) >= 2
+
+    written = []
+    drained_posts = spool.drain(lambda posts, times: written.append((posts, times)))
+
+    assert drained_posts == 3
+    assert [post for posts, _ in written for post in posts] == POSTS
+    assert all(
+        created_at == CREATED_AT.replace(tzinfo=None)
+        for _, times in written
+        for created_at in times
+    )
+    assert spool.is_empty()
+    assert list(tmp_path.iterdir()) == []
+    assert spool.stats()["bytes"] == 0
+
+
+def test_failed_drain_keeps_posts_and_recovers_after_restart(tmp_path):
+    spool = PostSpool(str(tmp_path))
+    spool.append(POSTS)
+
+    def fail(posts, times):
+        raise RuntimeError("database down")
+
+    assert spool.drain(fail) == 0
+    assert not spool.is_empty()
+    spool.close()
+
+    # A new spool over the same directory picks up the old segments
+    restarted = PostSpool(str(tmp_path))
+    written = []
+    assert restarted.drain(lambda posts, times: written.extend(posts)) == 3
+    assert written == POSTS
+
+
+def test_spool_bounds_disk_use(tmp_path):
+    record_bytes = RECORD_HEADER.size + len("first post") + len("en")
+    spool = PostSpool(str(tmp_path), max_bytes=2 * record_bytes)
+
+    assert spool.append([POSTS[0]] * 5) == 2
+    stats = spool.stats()
+    assert stats["bytes"] == 2 * record_bytes
+    assert stats["spooled_posts"] == 2
+    assert stats["dropped_posts"] == 3
+
+
+def test_failing_segment_moves_to_dead_letter(tmp_path):
+    spool = PostSpool(str(tmp_path), segment_bytes=1, max_attempts=2)
+    spool.append(POSTS[:2])
+
+    def reject_first(posts, times):
+        if posts == POSTS[:1]:
+            raise ValueError("bad post")
+        written.extend(posts)
+
+    written = []
+    # A lost connection doesn't count as an attempt
+    assert spool.drain(reject_first, transient_errors=(ValueError,)) == 0
+    assert spool.drain(reject_first) == 0
+    assert written == []
+
+    # The second failure moves the segment aside and unblocks the next one
+    assert spool.drain(reject_first) == 1
+    assert written == POSTS[1:2]
+    assert spool.is_empty()
+    assert [path.suffix for path in tmp_path.iterdir()] == [".dead"]
+    assert spool.stats()["dead_letter_posts"] == 1
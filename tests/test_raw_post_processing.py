@@ -0,0 +1,89 @@
+import random
+
+from stpo_processing.src.family_spill import PostFamilyStore
+from stpo_processing.src.raw_post_processing import (
+    build_post_families,
+    build_stpo_map,
+    build_weighted_stpo_map,
+    deduplicate_posts,
+    format_post,
+    get_post_word_separation,
+    normalize_post,
+    orchestrate_stpo,
+)
+
+POSTS = [
+    "Get free followers now at example.com",
+    "get FREE followers now at example.com!",
+    "I had a lovely walk in the park today",
+    "Get free followers now at example.com",
+]
+
+
+def test_normalize_post():
+    for post in POSTS:
+        assert normalize_post(post) == format_post(post).split()
+
+
+def test_stored_tokens_match_normalizing():
+    post_tokens = [normalize_post(post) for post in POSTS]
+    assert build_post_families(POSTS, post_tokens=post_tokens) == build_post_families(
+        POSTS
+    )
+    assert orchestrate_stpo(POSTS, post_tokens=post_tokens) == orchestrate_stpo(POSTS)
+
+
+def test_deduplicate_posts():
+    unique_posts, unique_post_tokens, post_weights = deduplicate_posts(POSTS)
+    # POSTS[1] and POSTS[3] normalize to POSTS[0]
+    assert unique_posts == [POSTS[0], POSTS[2]]
+    assert unique_post_tokens == [normalize_post(post) for post in unique_posts]
+    assert post_weights == [3, 1]
+
+
+def test_deduplicated_stpo_map_matches():
+    rng = random.Random(7)
+    words = ["free", "followers", "click", "here", "now", "the", "park", "walk"]
+    templates = [" ".join(rng.choices(words, k=rng.randint(2, 30))) for _ in range(40)]
+    posts = [rng.choice(templates) for _ in range(400)]
+    posts += [post.upper() + "!" for post in posts[:50]]
+    rng.shuffle(posts)
+
+    assert orchestrate_stpo(posts, deduplicate=True) == orchestrate_stpo(
+        posts, deduplicate=False
+    )
+
+
+def test_weighted_stpo_map():
+    post_tokens = [normalize_post(post) for post in POSTS]
+    repeated_pairs = get_post_word_separation(post_tokens * 3)
+    expected_stpo_map = build_stpo_map(repeated_pairs)
+
+    pairs = get_post_word_separation(post_tokens)
+    assert build_stpo_map(pairs, pair_weights=[3] * len(pairs)) == expected_stpo_map
+    assert build_weighted_stpo_map(post_tokens, [3] * len(POSTS)) == expected_stpo_map
+
+    stpo_map = build_weighted_stpo_map(post_tokens)
+    build_weighted_stpo_map(post_tokens, [2] * len(POSTS), stpo_map=stpo_map)
+    assert stpo_map == expected_stpo_map
+
+
+def test_spilled_families_match():
+    rng = random.Random(8)
+    words = ["free", "followers", "click", "here", "now", "the", "park", "walk"]
+    posts = [" ".join(rng.choices(words, k=rng.randint(2, 30))) for _ in range(300)]
+    posts += posts[:100]
+
+    for deduplicate in [True, False]:
+        assert orchestrate_stpo(
+            posts, deduplicate=deduplicate, spill=True
+        ) == orchestrate_stpo(posts, deduplicate=deduplicate, spill=False)
+
+    with PostFamilyStore(max_bytes=0) as family_store:
+        build_post_families(
+            posts, family_cutoff=10, family_append=2, family_store=family_store
+        )
+        assert family_store.spilled_chunks == len(family_store) > 1
+        assert [post_words for post_words, _ in family_store.iter_members()] == (
+            build_post_families(posts, family_cutoff=10, family_append=2)
+        )
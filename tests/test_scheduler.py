@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+import time
+
+from stpo_processing.src.scheduler import Scheduler, ScheduledTask, next_tick
+
+
+def test_next_tick():
+    now = datetime(2024, 1, 1, 12, 3, 30, tzinfo=timezone.utc)
+    assert next_tick(timedelta(minutes=10), now) == now.replace(minute=10, second=0)
+    assert next_tick(timedelta(minutes=10), now.replace(minute=10, second=0)) == (
+        now.replace(minute=20, second=0)
+    )
+
+
+def test_overlap_policies():
+    def slow_task(scheduled_at, cancel_event=None):
+        if cancel_event is not None:
+            cancel_event.wait(1)
+        else:
+            time.sleep(0.2)
+
+    scheduled_at = datetime.now(timezone.utc)
+    skip_task = ScheduledTask("skip", slow_task, timedelta(seconds=1))
+    queue_task = ScheduledTask(
+        "queue", slow_task, timedelta(seconds=1), overlap="queue"
+    )
+    cancel_task = ScheduledTask(
+        "cancel", slow_task, timedelta(seconds=1), overlap="cancel"
+    )
+    for task in [skip_task, queue_task, cancel_task]:
+        task.dispatch(scheduled_at)
+        time.sleep(0.05)
+        task.dispatch(scheduled_at + timedelta(seconds=1))
+
+    time.sleep(0.7)
+    assert skip_task.missed_runs == 1
+    assert len(skip_task.runs) == 1
+    assert queue_task.missed_runs == 0
+    assert [run["scheduled_at"] for run in queue_task.runs] == [
+        scheduled_at,
+        scheduled_at + timedelta(seconds=1),
+    ]
+    assert cancel_task.runs[0]["status"] == "cancelled"
+    assert queue_task.stats()["runs"] == 2
+
+
+def test_scheduler_runs_and_stops():
+    runs = []
+    scheduler = Scheduler()
+    task = scheduler.add_task(
+        "fixed_delay", runs.append, timedelta(milliseconds=20), mode="fixed_delay"
+    )
+    scheduler.start()
+    time.sleep(0.2)
+    scheduler.stop()
+    scheduler.join()
+
+    assert len(runs) >= 3
+    assert all(run["status"] == "ok" for run in task.runs)
+    assert task.runs[-1]["duration"] >= 0
@@ -0,0 +1,45 @@
+import pytest
+
+from stpo_processing.src.raw_post_processing import (
+    build_weighted_stpo_map,
+    get_post_score,
+    normalize_post,
+    stpo_map_to_cfdist_map,
+)
+from stpo_processing.src.scoring_pool import ScoringPool, benchmark_scoring
+
+POSTS = [
+    "get free followers now at example dot com today only",
+    "get free followers now at example dot com while it lasts",
+    "click here for more free followers and likes every day",
+    "the weather is lovely this afternoon by the river",
+    "short post",
+]
+
+
+def make_stpo_map():
+    return build_weighted_stpo_map([normalize_post(post) for post in POSTS])
+
+
+def test_scoring_pool():
+    stpo_map = make_stpo_map()
+    cfdist_model = stpo_map_to_cfdist_map(stpo_map)
+    posts = POSTS * 5
+    with ScoringPool(workers=2, chunk_size=3) as pool:
+        pool.publish(1, stpo_map)
+        assert pool.score(posts) == pytest.approx(
+            [get_post_score(post, cfdist_model) for post in posts]
+        )
+
+        # A newly published model replaces the old one in every worker
+        pool.publish(2, build_weighted_stpo_map([normalize_post(POSTS[3])] * 3))
+        assert pool.publisher.generation == 2
+        assert pool.score(POSTS[:2]) != pytest.approx(
+            [get_post_score(post, cfdist_model) for post in POSTS[:2]]
+        )
+
+
+def test_benchmark_scoring():
+    results = benchmark_scoring(POSTS * 20, make_stpo_map(), worker_counts=[1])
+    assert [result["workers"] for result in results] == [0, 1]
+    assert all(result["posts_per_second"] > 0 for result in results)
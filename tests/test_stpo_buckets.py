@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+
+from stpo_processing.src.raw_post_processing import orchestrate_stpo
+from stpo_processing.src.stpo_buckets import STPOBucketStore
+from stpo_processing.src.stpo_merge import combine_stpo_maps
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SPAM = "get free followers now at example dot com"
+POSTS = [
+    (START + timedelta(minutes=10), SPAM),
+    (START + timedelta(minutes=20), SPAM),
+    (START + timedelta(hours=2, minutes=5), SPAM),
+    (START + timedelta(hours=2, minutes=6), "click here for more free followers"),
+    (START + timedelta(hours=3, minutes=1), SPAM),
+]
+
+
+def test_window_maps_merge_buckets():
+    loads = []
+
+    def load_posts(start, end):
+        loads.append(start)
+        return [post for created_at, post in POSTS if start <= created_at < end], None
+
+    store = STPOBucketStore(
+        windows=[timedelta(hours=1), timedelta(hours=4)],
+        bucket_duration=timedelta(hours=1),
+    )
+    now = START + timedelta(hours=3, minutes=30)
+    store.update(load_posts, now)
+    # Five buckets cover the 4 hour window, the last still open
+    assert len(loads) == 5
+    assert [bucket["is_complete"] for bucket in store.buckets.values()] == [
+        True,
+        True,
+        True,
+        True,
+        False,
+    ]
+
+    # The 1 hour window reaches back into the last complete bucket
+    window_maps = store.window_maps(now)
+    assert window_maps[timedelta(hours=1)] == combine_stpo_maps(
+        [
+            orchestrate_stpo([post for _, post in POSTS[2:4]]),
+            orchestrate_stpo([SPAM]),
+        ]
+    )
+    assert window_maps[timedelta(hours=4)] == combine_stpo_maps(
+        [
+            orchestrate_stpo([SPAM, SPAM]),
+            orchestrate_stpo([post for _, post in POSTS[2:4]]),
+            orchestrate_stpo([SPAM]),
+        ]
+    )
+
+    # Only the open bucket is rebuilt, and the oldest one expires
+    loads.clear()
+    later = START + timedelta(hours=4, minutes=30)
+    store.update(load_posts, later)
+    assert loads == [START + timedelta(hours=3), START + timedelta(hours=4)]
+    assert min(store.buckets.keys()) == START
+
+
+def test_window_read_early_in_bucket():
+    def load_posts(start, end):
+        return [post for created_at, post in POSTS if start <= created_at < end], None
+
+    store = STPOBucketStore(
+        windows=[timedelta(hours=1)], bucket_duration=timedelta(hours=1)
+    )
+    # A minute into the hour, the open bucket alone would hold one minute
+    now = START + timedelta(hours=3, minutes=1, seconds=30)
+    store.update(load_posts, now)
+    assert sorted(store.buckets.keys()) == [
+        START + timedelta(hours=2),
+        START + timedelta(hours=3),
+    ]
+    assert store.window_map(timedelta(hours=1), now) == combine_stpo_maps(
+        [
+            orchestrate_stpo([post for _, post in POSTS[2:4]]),
+            orchestrate_stpo([SPAM]),
+        ]
+    )
@@ -0,0 +1,124 @@
+from collections import Counter
+import copy
+import random
+
+from stpo_processing.src.stpo_merge import (
+    combine_stpo_maps,
+    merge_sorted_pairs,
+    merge_stpo_map,
+    merge_stpo_snapshots,
+    prune_stpo_map,
+    subtract_stpo_map,
+)
+from stpo_processing.src.stpo_snapshot import STPOSnapshot, stpo_map_to_bytes
+
+WORDS = ["free", "followers", "click", "here", "now", "café", "a", "z"]
+
+
+def random_stpo_map(rng):
+    stpo_map = {}
+    for _ in range(rng.randint(0, 40)):
+        separation = rng.randint(1, 4)
+        first_words = stpo_map.setdefault(separation, {})
+        second_words = first_words.setdefault(rng.choice(WORDS), {})
+        second_words[rng.choice(WORDS)] = rng.randint(1, 5)
+    return stpo_map
+
+
+def to_counter(stpo_map):
+    return Counter(
+        {
+            (separation, first_word, second_word): occurrences
+            for separation, first_words in stpo_map.items()
+            for first_word, second_words in first_words.items()
+            for second_word, occurrences in second_words.items()
+        }
+    )
+
+
+def is_compact(stpo_map):
+    """No empty separations or rows and no non-positive counts."""
+    return all(
+        first_words
+        and all(
+            second_words and min(second_words.values()) > 0
+            for second_words in first_words.values()
+        )
+        for first_words in stpo_map.values()
+    )
+
+
+def test_combine_matches_counter_sum():
+    rng = random.Random(11)
+    for _ in range(200):
+        stpo_maps = [random_stpo_map(rng) for _ in range(rng.randint(0, 5))]
+        originals = copy.deepcopy(stpo_maps)
+
+        combined = combine_stpo_maps(stpo_maps)
+        assert to_counter(combined) == sum(map(to_counter, stpo_maps), Counter())
+        assert is_compact(combined)
+        # Inputs aren't mutated or aliased
+        assert stpo_maps == originals
+        merge_stpo_map(combined, random_stpo_map(rng))
+        assert stpo_maps == originals
+
+
+def test_subtract_inverts_merge():
+    rng = random.Random(12)
+    for _ in range(200):
+        stpo_map = random_stpo_map(rng)
+        expired_map = random_stpo_map(rng)
+        merged = merge_stpo_map(copy.deepcopy(stpo_map), expired_map)
+        assert subtract_stpo_map(merged, expired_map) == stpo_map
+
+
+def test_prune():
+    rng = random.Random(13)
+    for _ in range(200):
+        stpo_map = random_stpo_map(rng)
+        min_count = rng.randint(1, 6)
+        expected = +Counter(
+            {
+                pair: occurrences
+                for pair, occurrences in to_counter(stpo_map).items()
+                if occurrences >= min_count
+            }
+        )
+        pruned = prune_stpo_map(stpo_map, min_count)
+        assert to_counter(pruned) == expected
+        assert is_compact(pruned)
+
+
+def test_merge_sorted_pairs():
+    rng = random.Random(14)
+    for _ in range(200):
+        counters = [
+            Counter({rng.randrange(50): rng.randint(1, 9) for _ in range(20)})
+            for _ in range(rng.randint(0, 7))
+        ]
+        merged = list(merge_sorted_pairs([sorted(c.items()) for c in counters]))
+        assert merged == sorted(sum(counters, Counter()).items())
+
+
+def test_merge_snapshots_matches_dict_merge():
+    rng = random.Random(15)
+    for _ in range(100):
+        stpo_maps = [random_stpo_map(rng) for _ in range(rng.randint(1, 5))]
+        combined = combine_stpo_maps(stpo_maps)
+        merged_bytes = merge_stpo_snapshots(
+            [stpo_map_to_bytes(stpo_map) for stpo_map in stpo_maps]
+        )
+        assert STPOSnapshot(merged_bytes).to_stpo_map() == combined
+
+        # Subtracting the last map again, with pruning
+        min_count = rng.randint(1, 3)
+        expected = subtract_stpo_map(
+            copy.deepcopy(combined), stpo_maps[-1], min_count=min_count
+        )
+        prune_stpo_map(expected, min_count)
+        merged_bytes = merge_stpo_snapshots(
+            [merged_bytes, stpo_map_to_bytes(stpo_maps[-1])],
+            signs=[1, -1],
+            min_count=min_count,
+        )
+        assert STPOSnapshot(merged_bytes).to_stpo_map() == expected
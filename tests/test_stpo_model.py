@@ -0,0 +1,90 @@
+import pytest
+
+from stpo_processing.src.constants import PRUNED_MASS_KEY
+from stpo_processing.src.raw_post_processing import (
+    build_weighted_stpo_map,
+    get_post_score,
+    normalize_post,
+    stpo_map_to_cfdist_map,
+)
+from stpo_processing.src.stpo_model import (
+    SharedModelPublisher,
+    SharedModelReader,
+    STPOModel,
+)
+from stpo_processing.src.stpo_snapshot import STPOSnapshot, stpo_map_to_bytes
+
+POSTS = [
+    "get free followers now at example dot com today only",
+    "get free followers now at example dot com while it lasts",
+    "click here for more free followers and likes every day",
+    "the weather is lovely this afternoon by the river",
+    "naïve café posts score too ✨",
+]
+
+
+def make_stpo_map():
+    return build_weighted_stpo_map([normalize_post(post) for post in POSTS])
+
+
+def test_model_matches_cfdist():
+    stpo_map = make_stpo_map()
+    cfdist_model = stpo_map_to_cfdist_map(stpo_map)
+    model = STPOModel.from_stpo_map(stpo_map)
+
+    assert sorted(model) == sorted(cfdist_model)
+    for separation, cfdist in cfdist_model.items():
+        assert sorted(model[separation]) == sorted(cfdist)
+        for first_word, freq_dist in cfdist.items():
+            assert dict(model[separation][first_word]) == dict(freq_dist)
+            assert model[separation][first_word].N() == freq_dist.N()
+    for post in POSTS + ["an unseen post about nothing in particular"]:
+        assert get_post_score(post, model) == pytest.approx(
+            get_post_score(post, cfdist_model)
+        )
+
+
+def test_model_lookups():
+    model = STPOModel.from_stpo_map({1: {"free": {"followers": 3, "likes": 1}}})
+    assert model[1]["free"].freq("followers") == 0.75
+    assert model[1]["free"]["unseen"] == 0
+    assert model[1]["free"].most_common(1) == [("followers", 3)]
+    assert "free" in model[1] and "unseen" not in model[1]
+    assert model[1]["unseen"].freq("followers") == 0
+    assert len(STPOModel.from_stpo_map({})) == 0
+
+    # Snapshots encode to the same model as their maps
+    with STPOSnapshot(stpo_map_to_bytes(make_stpo_map())) as snapshot:
+        assert dict(STPOModel.from_stpo_map(snapshot)[1]["free"]) == {"followers": 3}
+
+
+def test_model_hides_pruned_mass():
+    model = STPOModel.from_stpo_map(
+        {1: {"free": {PRUNED_MASS_KEY: 6, "followers": 3, "likes": 1}}}
+    )
+    freq_dist = model[1]["free"]
+    assert dict(freq_dist) == {"followers": 3, "likes": 1}
+    assert len(freq_dist) == 2
+    assert PRUNED_MASS_KEY not in freq_dist
+    assert freq_dist.most_common(1) == [("followers", 3)]
+    # The pruned mass still normalizes frequencies
+    assert freq_dist.N() == 10
+    assert freq_dist.freq("followers") == 0.3
+
+
+def test_shared_model_hot_swap():
+    with SharedModelPublisher() as publisher:
+        reader = SharedModelReader(publisher.name)
+        assert reader.get() is None
+
+        publisher.publish({1: {"free": {"followers": 3}}})
+        model = reader.get()
+        assert model[1]["free"]["followers"] == 3
+        assert reader.get() is model
+
+        # A reader that skipped a generation maps the newest one
+        publisher.publish({1: {"buy": {"now": 1}}})
+        publisher.publish({1: {"buy": {"now": 2}}})
+        assert reader.get()[1]["buy"]["now"] == 2
+        assert reader.generation == publisher.generation == 3
+        reader.close()
@@ -0,0 +1,56 @@
+import copy
+
+from stpo_processing.src.raw_post_processing import stpo_map_to_cfdist_map
+from stpo_processing.src.stpo_pruning import PRUNED_MASS_KEY, truncate_stpo_map
+
+STPO_MAP = {
+    1: {
+        "free": {"followers": 10, "stuff": 5, "money": 2, "rare": 1},
+        "click": {"here": 3},
+    },
+    2: {"free": {"now": 1}},
+}
+
+
+def test_min_count_and_top_k():
+    stpo_map = truncate_stpo_map(copy.deepcopy(STPO_MAP), min_count=2, top_k=2)
+    assert stpo_map == {
+        1: {
+            "free": {"followers": 10, "stuff": 5, PRUNED_MASS_KEY: 3},
+            "click": {"here": 3},
+        },
+        2: {"free": {PRUNED_MASS_KEY: 1}},
+    }
+    # Pruning again changes nothing
+    assert truncate_stpo_map(copy.deepcopy(stpo_map), min_count=2, top_k=2) == (
+        stpo_map
+    )
+
+
+def test_byte_budget():
+    stpo_map = truncate_stpo_map(copy.deepcopy(STPO_MAP), max_bytes=160 * 5)
+    entries = [
+        (second_word, occurrences)
+        for first_words in stpo_map.values()
+        for second_words in first_words.values()
+        for second_word, occurrences in second_words.items()
+    ]
+    # The pruned mass entries count towards the budget too
+    assert len(entries) == 5
+    assert sorted(pair for pair in entries if pair[0] != PRUNED_MASS_KEY) == [
+        ("followers", 10),
+        ("here", 3),
+        ("stuff", 5),
+    ]
+    assert stpo_map[2]["free"] == {PRUNED_MASS_KEY: 1}
+
+
+def test_frequencies_stay_normalized():
+    cfdist_map = stpo_map_to_cfdist_map(STPO_MAP)
+    pruned_cfdist_map = stpo_map_to_cfdist_map(
+        truncate_stpo_map(copy.deepcopy(STPO_MAP), top_k=1)
+    )
+    assert pruned_cfdist_map[1]["free"].freq("followers") == (
+        cfdist_map[1]["free"].freq("followers")
+    )
+    assert pruned_cfdist_map[1]["free"].freq("stuff") == 0
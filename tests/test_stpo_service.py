@@ -0,0 +1,66 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from stpo_processing.src.family_detector import OnlineFamilyDetector
+from stpo_processing.src.model_cache import STPOModelCache
+from stpo_processing.src.raw_post_processing import orchestrate_stpo
+from stpo_processing.src.stpo_pruning import PRUNED_MASS_KEY
+from stpo_processing.src.stpo_service import STPOService, start_stpo_service
+
+POSTS = [
+    "Get free followers now at example.com",
+    "get FREE followers now at example.com!",
+    "I had a lovely walk in the park today",
+]
+
+
+def get_json(url, body=None):
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    with urlopen(Request(url, data=data)) as response:
+        return json.loads(response.read())
+
+
+def test_service_queries():
+    cache = STPOModelCache()
+    cache.publish(7, orchestrate_stpo(POSTS))
+    server = start_stpo_service(port=0, cache=cache)
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        current_map = get_json(f"{url}/map")
+        assert current_map["snapshot_id"] == 7
+        assert current_map["stpo_map"]["1"]["free"] == {"followers": 3}
+
+        pairs = get_json(f"{url}/pairs?word=free&separation=1")
+        assert pairs["pairs"] == {"1": [["followers", 3]]}
+
+        scores = get_json(f"{url}/score", {"posts": POSTS})["scores"]
+        assert len(scores) == 3
+        assert scores[0] > scores[2]
+
+        with pytest.raises(HTTPError) as excinfo:
+            get_json(f"{url}/score", {"posts": "not a list"})
+        assert excinfo.value.code == 400
+    finally:
+        server.shutdown()
+
+
+def test_pruned_mass_hidden():
+    cache = STPOModelCache()
+    cache.publish(1, {1: {"free": {PRUNED_MASS_KEY: 9, "followers": 3, "stuff": 2}}})
+    service = STPOService(cache=cache)
+    assert service.get_map()["stpo_map"][1]["free"] == {"followers": 3, "stuff": 2}
+    assert service.top_pairs("free", k=1)["pairs"] == {1: [("followers", 3)]}
+
+
+def test_fresh_model_from_detector():
+    detector = OnlineFamilyDetector()
+    service = STPOService(cache=STPOModelCache(), family_detector=detector)
+    for post in POSTS:
+        detector.add_post(post)
+
+    fresh_map = service.get_map(fresh=True)
+    assert fresh_map["fresh"]
+    assert fresh_map["stpo_map"][1]["free"]["followers"] >= 2
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+import random
+
+from stpo_processing.src.raw_post_processing import (
+    build_stpo_map,
+    get_post_word_separation,
+)
+from stpo_processing.src.stpo_sketch import (
+    CountMinSketch,
+    SlidingWindowSTPOSketch,
+    SpaceSaving,
+)
+
+
+def test_count_min_sketch_bounds():
+    rng = random.Random(3)
+    sketch = CountMinSketch(epsilon=0.01, delta=0.01)
+    true_counts = {}
+    for _ in range(5000):
+        key = rng.randrange(500)
+        true_counts[key] = true_counts.get(key, 0) + 1
+        sketch.add(key)
+
+    allowed_error = 0.01 * sketch.total
+    for key, count in true_counts.items():
+        assert count <= sketch.estimate(key) <= count + allowed_error
+
+
+def test_space_saving_keeps_heavy_hitters():
+    heavy_hitters = SpaceSaving(capacity=10)
+    for idx in range(2000):
+        heavy_hitters.add("spam" if idx % 4 == 0 else idx)
+    assert "spam" in heavy_hitters.counts
+    assert heavy_hitters.counts["spam"] >= 500
+    assert len(heavy_hitters.counts) == 10
+
+
+def test_sliding_window_sketch():
+    posts = ["free followers click here now".split()] * 3
+    pairs = get_post_word_separation(posts)
+    now = datetime.now(timezone.utc)
+    sketch = SlidingWindowSTPOSketch(
+        window=timedelta(hours=2),
+        bucket_duration=timedelta(hours=1),
+        epsilon=0.001,
+        heavy_hitters=100,
+    )
+
+    sketch.add_pairs(pairs, now=now - timedelta(hours=1))
+    sketch.add_pairs(pairs, now=now)
+    assert sketch.to_stpo_map(now=now) == build_stpo_map(pairs + pairs)
+
+    later = now + timedelta(hours=1)
+    assert sketch.to_stpo_map(now=later) == build_stpo_map(pairs)
+    assert sketch.to_stpo_map(now=later + timedelta(hours=1)) == {}
+    assert sketch.total.total == 0
+
+
+def test_group_by_bucket():
+    sketch = SlidingWindowSTPOSketch(
+        window=timedelta(hours=2), bucket_duration=timedelta(hours=1)
+    )
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    timed_items = [
+        ("c", start + timedelta(minutes=70)),
+        ("a", start + timedelta(minutes=10)),
+        ("b", start + timedelta(minutes=50)),
+    ]
+    assert sketch.group_by_bucket(timed_items) == [
+        (start + timedelta(minutes=50), ["a", "b"]),
+        (start + timedelta(minutes=70), ["c"]),
+    ]
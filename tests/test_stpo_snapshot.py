@@ -0,0 +1,114 @@
+import json
+
+from stpo_processing.src.constants import PRUNED_MASS_KEY
+from stpo_processing.src.raw_post_processing import (
+    build_stpo_map,
+    get_post_word_separation,
+    stpo_map_to_cfdist_map,
+)
+from stpo_processing.src.stpo_snapshot import (
+    STPOSnapshot,
+    apply_stpo_delta,
+    diff_stpo_maps,
+    load_stpo_snapshot,
+    stpo_map_to_bytes,
+    write_stpo_snapshot_file,
+)
+
+POSTS = [
+    "free followers click here for free followers".split(),
+    "free followers now".split(),
+    "café ünïcode words here".split(),
+]
+
+
+def get_stpo_map():
+    return build_stpo_map(get_post_word_separation(POSTS))
+
+
+def test_snapshot_round_trip():
+    stpo_map = get_stpo_map()
+    snapshot = STPOSnapshot(stpo_map_to_bytes(stpo_map))
+
+    assert snapshot.to_stpo_map() == stpo_map
+    assert sorted(snapshot.keys()) == sorted(stpo_map.keys())
+    assert snapshot.get_count(1, "free", "followers") == 3
+    assert snapshot.get_count(1, "followers", "free") == 0
+    assert snapshot.get_count(99, "free", "followers") == 0
+    assert snapshot.get_count(1, "missing", "followers") == 0
+    assert snapshot.successors(1, "free") == stpo_map[1]["free"]
+    assert snapshot.successors(1, "missing") == {}
+    assert "free" in snapshot[1]
+    assert "missing" not in snapshot[1]
+
+
+def test_snapshot_successors_skip_pruned_mass():
+    stpo_map = {1: {"free": {PRUNED_MASS_KEY: 6, "followers": 3}}}
+    snapshot = STPOSnapshot(stpo_map_to_bytes(stpo_map))
+    assert snapshot.successors(1, "free") == {"followers": 3}
+    assert snapshot.to_stpo_map() == stpo_map
+
+
+def test_snapshot_accepts_json_keys():
+    stpo_map = get_stpo_map()
+    json_map = json.loads(json.dumps(stpo_map))
+    assert STPOSnapshot(stpo_map_to_bytes(json_map)).to_stpo_map() == stpo_map
+
+
+def test_empty_snapshot():
+    snapshot = STPOSnapshot(stpo_map_to_bytes({}))
+    assert snapshot.to_stpo_map() == {}
+    assert snapshot.vocabulary == []
+
+
+def test_snapshot_cfdist_map():
+    stpo_map = get_stpo_map()
+    snapshot = STPOSnapshot(stpo_map_to_bytes(stpo_map))
+    cfdist_map = stpo_map_to_cfdist_map(snapshot)
+    assert cfdist_map[1]["free"].freq("followers") == 1
+
+
+def test_snapshot_file(tmp_path):
+    stpo_map = get_stpo_map()
+    path = write_stpo_snapshot_file(stpo_map, tmp_path / "snapshots" / "a.stpo")
+
+    with STPOSnapshot.from_file(path) as snapshot:
+        assert snapshot.to_stpo_map() == stpo_map
+
+
+def test_load_stpo_snapshot_formats(tmp_path):
+    stpo_map = get_stpo_map()
+    legacy_record = {"stpo_snapshot": json.loads(json.dumps(stpo_map))}
+    assert load_stpo_snapshot(legacy_record) == stpo_map
+
+    binary_record = {
+        "snapshot_format": "binary",
+        "stpo_snapshot_binary": memoryview(stpo_map_to_bytes(stpo_map)),
+    }
+    assert load_stpo_snapshot(binary_record).to_stpo_map() == stpo_map
+
+    sidecar_record = {
+        "snapshot_format": "sidecar",
+        "stpo_snapshot_path": write_stpo_snapshot_file(stpo_map, tmp_path / "b.stpo"),
+    }
+    with load_stpo_snapshot(sidecar_record) as snapshot:
+        assert snapshot.to_stpo_map() == stpo_map
+
+
+def test_delta_round_trip():
+    previous_map = get_stpo_map()
+    current_map = build_stpo_map(
+        get_post_word_separation(
+            POSTS[:2] + ["free followers click here for free likes".split()]
+        )
+    )
+    delta = diff_stpo_maps(previous_map, current_map)
+
+    assert delta[1]["free"] == {"followers": 4, "likes": 1}
+    assert "now" not in delta[1]
+    assert delta[1]["café"] == {"ünïcode": 0}
+    assert diff_stpo_maps(current_map, current_map) == {}
+
+    with STPOSnapshot(stpo_map_to_bytes(delta)) as stored_delta:
+        reconstructed = apply_stpo_delta(get_stpo_map(), stored_delta)
+    assert reconstructed == current_map